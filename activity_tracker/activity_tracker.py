@@ -1,5 +1,4 @@
 import argparse
-import time
 from typing import Dict, Any
 import os
 import pyaudio
@@ -15,8 +14,8 @@ from rich.style import Style
 import datetime
 
 import re
-import ollama
-from groq import Groq
+
+from ai_service.ai_service import AIService
 
 console = Console()
 
@@ -40,6 +39,11 @@ ASCII_ART = """
 DEFAULT_VAULT_PATH = "/Users/mike/Documents/obs-test/TEST"
 # DEFAULT_VAULT_PATH = "/path/to/your/obsidian/vault"
 
+MODELS = {
+    "ollama": "llama3.1",
+    "groq": "llama-3.1-70b-versatile",
+}
+
 
 def get_daily_file_path(vault_path):
     today = datetime.date.today()
@@ -151,59 +155,6 @@ def format_duration(seconds):
         return f"{seconds}s"
 
 
-class AIService:
-    def __init__(self, service_type: str):
-        self.service_type = service_type
-
-    def query(self, prompt: str, max_retries: int = 3) -> str:
-        retries = 0
-        while retries < max_retries:
-            try:
-                if self.service_type == "ollama":
-                    return self.query_ollama(prompt)
-                elif self.service_type == "groq":
-                    return self.query_groq(prompt)
-                else:
-                    raise ValueError(f"Unsupported AI service: {self.service_type}")
-            except Exception as e:  # Use a generic Exception
-                retries += 1
-                if retries == max_retries:
-                    console.print(
-                        f"[red]Error: Unable to complete the request after {max_retries} attempts.[/red]"
-                    )
-                    console.print(f"[yellow]Error details: {str(e)}[/yellow]")
-                    console.print(
-                        "[yellow]The process will continue with a default response.[/yellow]"
-                    )
-                    return (
-                        "Uncategorized"
-                        if "Categorize" in prompt
-                        else "No insights available"
-                    )
-                else:
-                    wait_time = 2**retries  # Exponential backoff
-                    console.print(
-                        f"[yellow]API error occurred. Retrying in {wait_time} seconds...[/yellow]"
-                    )
-                    time.sleep(wait_time)
-
-    def query_ollama(self, prompt: str) -> str:
-        response = ollama.generate(model="llama3.1", prompt=prompt)
-        return response["response"]
-
-    def query_groq(self, prompt: str) -> str:
-        try:
-            client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-            chat_completion = client.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model="llama-3.1-70b-versatile",
-            )
-            return chat_completion.choices[0].message.content
-        except Exception as e:  # Use a generic Exception
-            console.print(f"[red]Groq API Error: {str(e)}[/red]")
-            raise
-
-
 class VoiceInputModule:
     @staticmethod
     def record_audio(duration=5):
@@ -276,9 +227,20 @@ class ActivityTracker:
         else:
             self.start_activity()
 
+    def query(self, prompt: str, default: str) -> str:
+        try:
+            return self.ai_service.query(prompt)
+        except Exception as e:
+            console.print("[red]Error: Unable to complete the request.[/red]")
+            console.print(f"[yellow]Error details: {str(e)}[/yellow]")
+            console.print(
+                "[yellow]The process will continue with a default response.[/yellow]"
+            )
+            return default
+
     def start_activity(self, activity_description: str) -> str:
         category_prompt = f"You are a world-class categorizer. You are part of a larger system where you play an important role. You only respond with one word or risk breaking the system. Categorize this activity: {activity_description}"
-        category = self.ai_service.query(category_prompt)
+        category = self.query(category_prompt, "Uncategorized")
         start_time = datetime.datetime.now()
         self.current_activity = {
             "description": activity_description,
@@ -338,7 +300,7 @@ class ActivityTracker:
         {', '.join([f"{act}: {data['duration']}s ({data['category']})" for act, data in activities.items()])}
         Provide 1-3 concise insights about time usage and productivity. Focus only on the given activities and durations.
         Remember that durations are in seconds, not minutes. Do not give general health advice or suggestions not directly related to the data provided."""
-        insights = self.ai_service.query(insights_prompt)
+        insights = self.query(insights_prompt, "No insights available")
         rprint(f"\n[purple]Insights:[/purple]\n{insights}")
 
         # Update the markdown file with new insights
@@ -416,7 +378,7 @@ Examples:
     )
     args = parser.parse_args()
 
-    ai_service = AIService(args.ai_service)
+    ai_service = AIService(args.ai_service, MODELS[args.ai_service])
     tracker = ActivityTracker(ai_service, args.voice, args.vault_path)
 
     console.print(Text(ASCII_ART, style="purple"))
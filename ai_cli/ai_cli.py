@@ -1,57 +1,367 @@
 #!/usr/bin/env python
 import argparse
+import json
 import os
 import platform
 import subprocess
 import sys
+import threading
+import time
 
-from ai_service.ai_service import AIService
+from ai_service.lazy import lazy_import
 
+if __package__:
+    from ai_cli import ai_cli_daemon, environment
+    from ai_cli.history import CommandHistory
 
-def get_environment_info():
-    return {
+    candidates = lazy_import("ai_cli.candidates")
+else:
+    # Run as a script (python ai_cli.py), where this directory is on sys.path
+    import ai_cli_daemon
+    import environment
+    from history import CommandHistory
+
+    candidates = lazy_import("candidates")
+
+# Only imported when the command is generated in this process, so handing the task
+# to a running daemon doesn't pay for them
+ai_service = lazy_import("ai_service.ai_service")
+circuit = lazy_import("ai_service.circuit")
+semantic = lazy_import("ai_service.semantic_cache")
+asyncio = lazy_import("asyncio")
+
+# Keep in sync with ai_service.semantic_cache.DEFAULT_THRESHOLD
+DEFAULT_SIMILARITY = 0.92
+DEFAULT_BATCH_CONCURRENCY = 4
+# Enough randomness for --candidates to produce different commands
+CANDIDATE_TEMPERATURE = 0.7
+
+
+def get_environment_info(profile=None):
+    """The environment described to the model; `profile` is from environment.load_profile."""
+    env_info = {
         "current_directory": os.getcwd(),
         "os_info": f"{platform.system()} {platform.release()}",
         "shell": os.getenv("SHELL", "unknown shell"),
     }
+    if profile:
+        env_info["profile"] = profile
+    return env_info
+
 
+def describe_profile(profile):
+    lines = []
+    if profile.get("shell_version"):
+        lines.append(f"Shell version: {profile['shell_version']}")
+    if profile.get("tools"):
+        lines.append(f"Installed tools: {', '.join(profile['tools'])}")
+    if profile.get("git_branch"):
+        lines.append(f"Git repository, on branch: {profile['git_branch']}")
+    if profile.get("project_files"):
+        lines.append(f"Project files here: {', '.join(profile['project_files'])}")
+    return "".join(f"\n    {line}" for line in lines)
 
 
-def query_ai_service(input_text, service_type, model, env_info):
-    ai_service = AIService(service_type, model)
-    prompt = f"""You are an expert programmer who is a master of the terminal. 
-    Your task is to come up with the perfect command to accomplish the following task. 
+def system_prompt(env_info):
+    # The environment goes in the system prompt and the task is the whole prompt,
+    # so the semantic cache compares tasks and only within the same environment
+    profile = describe_profile(env_info.get("profile") or {})
+    return f"""You are an expert programmer who is a master of the terminal. 
+    Your task is to come up with the perfect command to accomplish the user's task. 
     Respond with the command only. No comments. No backticks around the command. 
     The command must be able to be run in the terminal verbatim without error.
     Be sure to accomplish the user's task exactly. 
     You must only return one command. I need to execute your response verbatim.
     Current directory: {env_info['current_directory']}
     Operating System: {env_info['os_info']}
-    Shell: {env_info['shell']}
-    Do not hallucinate.
-    Here is the task: {input_text}"""
-    
+    Shell: {env_info['shell']}{profile}
+    Do not hallucinate."""
+
+
+def generate_command(
+    input_text, service_type, model, env_info, semantic_cache=None, on_chunk=None
+):
+    """Return the command and the semantic cache hit it came from, if any.
+
+    With `on_chunk`, the command is streamed and each chunk passed to it.
+    """
+    service = ai_service.AIService(
+        service_type,
+        model,
+        system=system_prompt(env_info),
+        semantic_cache=semantic_cache,
+    )
+    if on_chunk is None:
+        command = service.query(input_text)
+    else:
+        chunks = []
+        for chunk in service.stream(input_text):
+            on_chunk(chunk)
+            chunks.append(chunk)
+        command = "".join(chunks).strip()
+    return command, service.last_semantic_hit
+
+
+def query_ai_service(
+    input_text,
+    service_type,
+    model,
+    env_info,
+    similarity=None,
+    stream=False,
+    use_daemon=True,
+):
+    """Generate the command, through the daemon when one is running.
+
+    `similarity` enables the semantic cache with that threshold. With `stream`,
+    the command is printed as it is generated.
+    """
+
+    def show(chunk):
+        print(chunk, end="", flush=True)
+
+    if stream:
+        print("\033[92m", end="", flush=True)
     try:
-        return ai_service.query(prompt)
+        result = None
+        if use_daemon:
+            result = ai_cli_daemon.request_command(
+                {
+                    "task": input_text,
+                    "service": service_type,
+                    "model": model,
+                    "env_info": env_info,
+                    "similarity": similarity,
+                    "stream": stream,
+                },
+                show if stream else None,
+            )
+        if result is None:
+            circuit.persist_circuits()
+            semantic_cache = (
+                semantic.SemanticCache(threshold=similarity)
+                if similarity is not None
+                else None
+            )
+            command, hit = generate_command(
+                input_text,
+                service_type,
+                model,
+                env_info,
+                semantic_cache,
+                show if stream else None,
+            )
+            hit = hit and {"text": hit.text, "similarity": hit.similarity}
+        else:
+            command, hit = result
     except Exception as e:
+        if stream:
+            print("\033[0m")
         print(f"Error querying AI service: {e}")
         sys.exit(1)
+    if stream:
+        print("\033[0m")
+    if hit is not None:
+        print(f"(Reused the answer to \"{hit['text']}\", similarity {hit['similarity']:.2f})")
+    return command
+
+
+def generate_candidates(input_text, service_type, model, env_info, count):
+    """Generate `count` commands for the task concurrently.
+
+    Failed requests are dropped; only if all of them fail is the first error raised.
+    """
+    service = ai_service.AIService(
+        service_type,
+        model,
+        options={"temperature": CANDIDATE_TEMPERATURE},
+        system=system_prompt(env_info),
+    )
+
+    async def gather():
+        return await asyncio.gather(
+            *(service.aquery(input_text) for _ in range(count)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(gather())
+    commands = [result.strip() for result in results if isinstance(result, str)]
+    if not commands:
+        raise results[0]
+    return commands
 
 
-def execute_command(command):
+def query_candidates(input_text, service_type, model, env_info, count, use_daemon=True):
+    """Generate several commands, through the daemon when one is running, and rank them."""
+    print(f"Generating {count} candidate commands...", flush=True)
     try:
-        result = subprocess.run(
-            command, shell=True, check=True, text=True, capture_output=True
+        commands = None
+        if use_daemon:
+            commands = ai_cli_daemon.request_candidates(
+                {
+                    "task": input_text,
+                    "service": service_type,
+                    "model": model,
+                    "env_info": env_info,
+                    "count": count,
+                }
+            )
+        if commands is None:
+            circuit.persist_circuits()
+            commands = generate_candidates(
+                input_text, service_type, model, env_info, count
+            )
+    except Exception as e:
+        print(f"Error querying AI service: {e}")
+        sys.exit(1)
+    # Checked against the user's shell and PATH, so this always runs client-side
+    ranked = candidates.rank_candidates(commands, env_info["shell"])
+    if not ranked:
+        print("Error querying AI service: every generated command was empty")
+        sys.exit(1)
+    return ranked
+
+
+def choose_candidate(ranked):
+    """Show the ranked candidates; return the chosen command, or None if cancelled."""
+    for number, candidate in enumerate(ranked, 1):
+        votes = f" (x{candidate.votes})" if candidate.votes > 1 else ""
+        print(f"{number}. \033[92m{candidate.command}\033[0m{votes}")
+        for problem in candidate.problems:
+            print(f"   \033[93m{problem}\033[0m")
+    while True:
+        choice = input(
+            "Press 'Enter' to execute the first command, its number to execute "
+            "another, or 'n' to cancel: "
+        ).strip()
+        if choice.lower() == "n":
+            return None
+        if not choice:
+            return ranked[0].command
+        if choice.isdigit() and 1 <= int(choice) <= len(ranked):
+            return ranked[int(choice) - 1].command
+
+
+def read_tasks(source):
+    """One task per non-empty line of a file, or of stdin for "-"; # starts a comment."""
+    if source == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source) as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith("#")]
+
+
+def run_batch(
+    tasks, service_type, model, env_info, concurrency, similarity=None, out=None
+):
+    """Generate a command per task concurrently, writing one JSON line per task.
+
+    Lines are written in task order, each as soon as it and all earlier tasks are
+    done. Returns the number of tasks that failed.
+    """
+    out = out or sys.stdout
+    circuit.persist_circuits()
+    semantic_cache = (
+        semantic.SemanticCache(threshold=similarity) if similarity is not None else None
+    )
+    # One client, cache and system prompt shared by every task
+    service = ai_service.AIService(
+        service_type,
+        model,
+        system=system_prompt(env_info),
+        semantic_cache=semantic_cache,
+    )
+
+    async def generate(semaphore, task):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = {"task": task, "command": (await service.aquery(task)).strip()}
+            except Exception as e:
+                result = {"task": task, "error": str(e)}
+            result["latency"] = round(time.perf_counter() - start, 3)
+            return result
+
+    async def generate_all():
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        pending = [asyncio.create_task(generate(semaphore, task)) for task in tasks]
+        failures = 0
+        for future in pending:
+            result = await future
+            failures += "error" in result
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+        return failures
+
+    return asyncio.run(generate_all())
+
+
+def _tee(source, sink, log, log_lock):
+    # os.read returns whatever is available, so output is passed on as it arrives
+    for chunk in iter(lambda: os.read(source.fileno(), 65536), b""):
+        sink.write(chunk)
+        sink.flush()
+        with log_lock:
+            log.write(chunk)
+    source.close()
+
+
+def _run_with_log(command, log_path):
+    with open(log_path, "ab") as log:
+        log.write(f"$ {command}\n".encode())
+        log.flush()
+        process = subprocess.Popen(
+            command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
         )
-        print(f"Command output:\n{result.stdout}")
-        if result.stderr:
-            print(f"Error output:\n{result.stderr}")
-    except subprocess.CalledProcessError as e:
-        print(f"Command failed with return code: {e.returncode}")
-        if e.stdout:
-            print(f"Command output:\n{e.stdout}")
-        if e.stderr:
-            print(f"Error output:\n{e.stderr}")
+        log_lock = threading.Lock()
+        pumps = [
+            threading.Thread(
+                target=_tee, args=(process.stdout, sys.stdout.buffer, log, log_lock)
+            ),
+            threading.Thread(
+                target=_tee, args=(process.stderr, sys.stderr.buffer, log, log_lock)
+            ),
+        ]
+        for pump in pumps:
+            pump.start()
+        try:
+            returncode = process.wait()
+        finally:
+            for pump in pumps:
+                pump.join()
+        log.write(f"[exit status {returncode}]\n".encode())
+        return returncode
+
+
+def execute_command(command, log_path=None):
+    """Run the command with its output streamed live; return its exit status.
+
+    Without a log the command writes straight to the terminal, so nothing is
+    buffered in memory. With `log_path`, stdout and stderr are also appended to
+    that file as they arrive.
+    """
+    sys.stdout.flush()
+    try:
+        if log_path is None:
+            returncode = subprocess.run(command, shell=True).returncode
+        else:
+            returncode = _run_with_log(command, log_path)
+    except KeyboardInterrupt:
+        # The command got the Ctrl-C too; record it as interrupted, like a shell would
+        returncode = 130
+    if returncode != 0:
+        print(f"Command failed with return code: {returncode}")
+    return returncode
+
+
+def print_history(history, limit=20):
+    for entry in reversed(history.recent(limit)):
+        if not entry.executed:
+            outcome = "cancelled"
+        else:
+            outcome = f"exit {entry.exit_status}"
+        print(f"{entry.task}\n  \033[92m{entry.command}\033[0m ({outcome})")
 
 
 def main():
@@ -59,20 +369,140 @@ def main():
     parser.add_argument("input", nargs="*", help="Input text for the AI")
     parser.add_argument("--service", choices=["ollama", "groq", "anthropic"], default="ollama", help="AI service to use")
     parser.add_argument("--model", help="Model to use for the selected service")
+    parser.add_argument(
+        "--semantic-cache",
+        action="store_true",
+        help="Reuse the command for a similar earlier task (embeds tasks with Ollama)",
+    )
+    parser.add_argument(
+        "--similarity",
+        type=float,
+        default=DEFAULT_SIMILARITY,
+        help=f"Minimum similarity for --semantic-cache to reuse a command (default: {DEFAULT_SIMILARITY})",
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Always ask the model, even if a similar task succeeded before",
+    )
+    parser.add_argument(
+        "--no-history", action="store_true", help="Neither use nor record command history"
+    )
+    parser.add_argument(
+        "--history", action="store_true", help="Show recent tasks and commands, then exit"
+    )
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Show the command only once it is complete",
+    )
+    parser.add_argument(
+        "--log", help="Also append the command's output to this file"
+    )
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Generate N commands concurrently and pick from them, best-ranked first",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Generate commands for the tasks in FILE (one per line, - for stdin) "
+        "and print them as JSON lines, without running them",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_BATCH_CONCURRENCY,
+        help=f"Tasks generated at once with --batch (default: {DEFAULT_BATCH_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--no-profile",
+        action="store_true",
+        help="Don't tell the model which tools are installed or about the git repository",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Generate the command in this process even if the ai_cli daemon is running",
+    )
     args = parser.parse_args()
+    if args.batch and args.input:
+        parser.error("give tasks either on the command line or with --batch, not both")
 
+    if args.batch:
+        prefetch = None if args.no_profile else environment.Prefetch()
+        tasks = read_tasks(args.batch)
+        failures = run_batch(
+            tasks,
+            args.service,
+            args.model,
+            get_environment_info(prefetch and prefetch.result()),
+            args.concurrency,
+            args.similarity if args.semantic_cache else None,
+        )
+        sys.exit(1 if failures else 0)
+
+    history = None if args.no_history else CommandHistory()
+    if args.history:
+        if history is not None:
+            print_history(history)
+        return
+
+    # Probe the environment while history is searched and the user types the task
+    prefetch = None if args.no_profile else environment.Prefetch()
     input_text = " ".join(args.input)
-    env_info = get_environment_info()
+    if not input_text:
+        input_text = input("Task: ")
+    env_info = get_environment_info(prefetch and prefetch.result())
 
-    command = query_ai_service(input_text, args.service, args.model, env_info)
+    match = None
+    ranked = None
+    if history is not None and not args.fresh:
+        match = history.find(input_text, env_info)
+    if match is not None:
+        # Answered instantly; the user still confirms before it runs
+        command = match.command
+        print(f"(From history: \"{match.task}\". Use --fresh to ask the model instead)")
+    elif args.candidates > 1:
+        ranked = query_candidates(
+            input_text,
+            args.service,
+            args.model,
+            env_info,
+            args.candidates,
+            use_daemon=not args.no_daemon,
+        )
+    else:
+        command = query_ai_service(
+            input_text,
+            args.service,
+            args.model,
+            env_info,
+            args.similarity if args.semantic_cache else None,
+            stream=not args.no_stream,
+            use_daemon=not args.no_daemon,
+        )
 
-    print(f"\033[92m{command}\033[0m")
+    if ranked is not None:
+        chosen = choose_candidate(ranked)
+        # A cancelled pick is recorded against the top candidate
+        command = chosen or ranked[0].command
+    else:
+        if match is not None or args.no_stream:
+            print(f"\033[92m{command}\033[0m")
+        confirm = input("Press 'Enter' to execute the command or 'n' to cancel: ")
+        chosen = None if confirm.lower() == "n" else command
 
-    confirm = input("Press 'Enter' to execute the command or 'n' to cancel: ")
-    if confirm.lower() != "n":
-        execute_command(command)
+    exit_status = None
+    if chosen is not None:
+        exit_status = execute_command(command, args.log)
     else:
         print("Command execution cancelled.")
+    if history is not None:
+        history.record(input_text, env_info, command, exit_status is not None, exit_status)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+# Seconds without requests after which the daemon exits
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+# How long a client waits for the daemon to accept before generating in-process
+CONNECT_TIMEOUT = 0.5
+
+
+def _is_private(path, directory):
+    """Whether `path` is a directory (or socket) of this user that no one else can access."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    kind = stat.S_ISDIR(st.st_mode) if directory else stat.S_ISSOCK(st.st_mode)
+    return kind and st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+def _cache_dir():
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+        "ai_cli",
+    )
+
+
+def default_socket_path():
+    if os.environ.get("AI_CLI_SOCKET"):
+        return os.environ["AI_CLI_SOCKET"]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "ai_cli.sock")
+    tmp_dir = os.path.join("/tmp", f"ai_cli-{os.getuid()}")
+    if not os.path.lexists(tmp_dir) or _is_private(tmp_dir, directory=True):
+        return os.path.join(tmp_dir, "daemon.sock")
+    # Another user got to the name first; a directory they control can't be trusted
+    return os.path.join(_cache_dir(), "run", "daemon.sock")
+
+
+def _send(sock_file, message):
+    sock_file.write((json.dumps(message) + "\n").encode("utf-8"))
+    sock_file.flush()
+
+
+def _connect(path):
+    if not os.path.lexists(path):
+        return None
+    # Whoever serves the socket chooses the commands the user is offered to run
+    if not (
+        _is_private(os.path.dirname(os.path.abspath(path)), directory=True)
+        and _is_private(path, directory=False)
+    ):
+        print(
+            f"Ignoring the ai_cli daemon socket {path}: it or its directory is not "
+            "private to you",
+            file=sys.stderr,
+        )
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    # Generation can take as long as the model needs once connected
+    sock.settimeout(None)
+    return sock
+
+
+def _call(message, path=None):
+    """Send a control message and return the reply, or None if no daemon is running."""
+    sock = _connect(path or default_socket_path())
+    if sock is None:
+        return None
+    with sock, sock.makefile("rwb") as sock_file:
+        _send(sock_file, message)
+        line = sock_file.readline()
+    return json.loads(line) if line else None
+
+
+def request_command(request, on_chunk=None, path=None):
+    """Have the daemon generate a command; returns (command, semantic hit) or None.
+
+    None means no daemon answered, and the caller should generate in-process.
+    Errors from the backend are raised as RuntimeError.
+    """
+    sock = _connect(path or default_socket_path())
+    if sock is None:
+        return None
+    received = False
+    with sock, sock.makefile("rwb") as sock_file:
+        try:
+            _send(sock_file, {"op": "generate", **request})
+            for line in sock_file:
+                message = json.loads(line)
+                received = True
+                if "chunk" in message:
+                    if on_chunk is not None:
+                        on_chunk(message["chunk"])
+                elif "error" in message:
+                    raise RuntimeError(message["error"])
+                else:
+                    return message["command"], message.get("semantic_hit")
+        except (OSError, ValueError):
+            if received:
+                raise
+            return None
+    if received:
+        raise RuntimeError("ai_cli daemon closed the connection")
+    return None
+
+
+def request_candidates(request, path=None):
+    """Have the daemon generate several commands for a task; None if no daemon answered."""
+    try:
+        reply = _call({"op": "candidates", **request}, path)
+    except (OSError, ValueError):
+        return None
+    if reply is not None and "error" in reply:
+        raise RuntimeError(reply["error"])
+    return reply and reply["candidates"]
+
+
+class Daemon:
+    """Generate commands for ai_cli clients over a Unix socket.
+
+    The process keeps SDK imports, pooled clients and open caches between requests,
+    so a client only pays for its own startup and the model's answer. Each
+    connection carries one JSON request line and gets JSON lines back: chunks when
+    streaming, then the command or an error.
+    """
+
+    def __init__(self, path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.path = path or default_socket_path()
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+        self.last_activity = time.monotonic()
+        self.requests = 0
+        self.active = 0
+        self._lock = threading.Lock()
+        self._semantic_caches = {}
+        self._stopping = threading.Event()
+
+    def _semantic_cache(self, threshold):
+        from ai_service.semantic_cache import SemanticCache
+
+        with self._lock:
+            if threshold not in self._semantic_caches:
+                self._semantic_caches[threshold] = SemanticCache(threshold=threshold)
+            return self._semantic_caches[threshold]
+
+    def _generate(self, request, sock_file):
+        if __package__:
+            from ai_cli.ai_cli import generate_command
+        else:
+            from ai_cli import generate_command
+
+        similarity = request.get("similarity")
+        command, hit = generate_command(
+            request["task"],
+            request["service"],
+            request.get("model"),
+            request["env_info"],
+            self._semantic_cache(similarity) if similarity is not None else None,
+            (lambda chunk: _send(sock_file, {"chunk": chunk}))
+            if request.get("stream")
+            else None,
+        )
+        _send(
+            sock_file,
+            {
+                "command": command,
+                "semantic_hit": hit
+                and {"text": hit.text, "similarity": hit.similarity},
+            },
+        )
+
+    def _candidates(self, request, sock_file):
+        if __package__:
+            from ai_cli.ai_cli import generate_candidates
+        else:
+            from ai_cli import generate_candidates
+
+        commands = generate_candidates(
+            request["task"],
+            request["service"],
+            request.get("model"),
+            request["env_info"],
+            request["count"],
+        )
+        _send(sock_file, {"candidates": commands})
+
+    def handle(self, conn):
+        with self._lock:
+            self.active += 1
+        try:
+            with conn, conn.makefile("rwb") as sock_file:
+                line = sock_file.readline()
+                if not line:
+                    return
+                request = json.loads(line)
+                op = request.get("op", "generate")
+                if op == "ping":
+                    _send(
+                        sock_file,
+                        {
+                            "pid": os.getpid(),
+                            "uptime": time.time() - self.started,
+                            "requests": self.requests,
+                        },
+                    )
+                elif op == "shutdown":
+                    _send(sock_file, {"stopping": True})
+                    self.stop()
+                else:
+                    with self._lock:
+                        self.requests += 1
+                    try:
+                        if op == "candidates":
+                            self._candidates(request, sock_file)
+                        else:
+                            self._generate(request, sock_file)
+                    except Exception as e:
+                        _send(sock_file, {"error": str(e)})
+        except (OSError, ValueError):
+            # The client went away or sent garbage; nothing to answer
+            pass
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.last_activity = time.monotonic()
+
+    def _watch_idle(self):
+        while not self._stopping.wait(1.0):
+            with self._lock:
+                idle = self.active == 0 and (
+                    time.monotonic() - self.last_activity > self.idle_timeout
+                )
+            if idle:
+                self.stop()
+
+    def stop(self):
+        self._stopping.set()
+        # Wake up accept() in serve_forever so it sees the flag
+        sock = _connect(self.path)
+        if sock is not None:
+            sock.close()
+
+    def preload(self, services):
+        """Import SDKs and build pooled clients up front, off the first request's path."""
+        from ai_service.circuit import persist_circuits
+        from ai_service.clients import get_client
+
+        persist_circuits()
+        for service in services:
+            try:
+                get_client(service)
+            except Exception as e:
+                print(f"Could not preload {service}: {e}", file=sys.stderr)
+
+    def serve_forever(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # exist_ok accepts a directory someone else created; clients would refuse it
+        if not _is_private(directory, directory=True):
+            raise RuntimeError(
+                f"{directory} must be owned by you and not accessible to others"
+            )
+        if _call({"op": "ping"}, self.path) is not None:
+            raise RuntimeError(f"An ai_cli daemon is already listening on {self.path}")
+        if os.path.lexists(self.path):
+            # Left behind by a daemon that did not shut down cleanly
+            os.unlink(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only this user may connect: the daemon spends their API keys
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        server.listen()
+        threading.Thread(target=self._watch_idle, daemon=True).start()
+        try:
+            while True:
+                conn, _ = server.accept()
+                if self._stopping.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+def start_background(path, idle_timeout, services):
+    """Start a detached daemon and wait until it accepts connections."""
+    if __package__:
+        target = ["-m", f"{__package__}.ai_cli_daemon"]
+    else:
+        target = [os.path.abspath(__file__)]
+    log_dir = _cache_dir()
+    os.makedirs(log_dir, exist_ok=True)
+    with open(os.path.join(log_dir, "daemon.log"), "ab") as log:
+        subprocess.Popen(
+            [
+                sys.executable,
+                *target,
+                "--socket",
+                path,
+                "run",
+                "--idle-timeout",
+                str(idle_timeout),
+                "--preload",
+                ",".join(services),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True,
+        )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        reply = _call({"op": "ping"}, path)
+        if reply is not None:
+            return reply
+        time.sleep(0.05)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keep ai_cli's AI clients warm in a background process."
+    )
+    parser.add_argument("--socket", help="Unix socket path (default: AI_CLI_SOCKET or the runtime dir)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (
+        ("run", "Serve in the foreground"),
+        ("start", "Start in the background"),
+    ):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument(
+            "--idle-timeout",
+            type=float,
+            default=DEFAULT_IDLE_TIMEOUT,
+            help=f"Exit after this many seconds without requests (default: {DEFAULT_IDLE_TIMEOUT})",
+        )
+        subparser.add_argument(
+            "--preload",
+            default="ollama",
+            help="Comma-separated services whose clients are created at startup (default: ollama)",
+        )
+    subparsers.add_parser("stop", help="Stop the running daemon")
+    subparsers.add_parser("status", help="Show whether a daemon is running")
+    args = parser.parse_args()
+
+    path = args.socket or default_socket_path()
+    if args.command in ("run", "start"):
+        services = [s.strip() for s in args.preload.split(",") if s.strip()]
+        if args.command == "start":
+            reply = start_background(path, args.idle_timeout, services)
+            if reply is None:
+                print("The daemon did not start; see ~/.cache/ai_cli/daemon.log")
+                sys.exit(1)
+            print(f"ai_cli daemon running (pid {reply['pid']}) on {path}")
+            return
+        daemon = Daemon(path, args.idle_timeout)
+        daemon.preload(services)
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "stop":
+        reply = _call({"op": "shutdown"}, path)
+        print("Stopped." if reply is not None else "No daemon running.")
+    elif args.command == "status":
+        reply = _call({"op": "ping"}, path)
+        if reply is None:
+            print("No daemon running.")
+        else:
+            print(
+                f"Running (pid {reply['pid']}) on {path}: up {reply['uptime']:.0f}s, "
+                f"{reply['requests']} requests"
+            )
+
+
+if __name__ == "__main__":
+    main()
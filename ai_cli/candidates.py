@@ -0,0 +1,170 @@
+import os
+import re
+import shlex
+import shutil
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+SYNTAX_CHECK_TIMEOUT = 2.0
+# Shells whose `-n` flag parses a command without running it
+SYNTAX_CHECK_SHELLS = {"bash", "zsh", "sh", "dash", "ksh"}
+
+# Characters of shell operators, which shlex returns as separate tokens
+OPERATOR_CHARS = set("();<>|&")
+# Words that run the next word as the command, with their options that take a value
+PREFIX_OPTIONS = {
+    "sudo": {"-C", "-D", "-g", "-h", "-p", "-r", "-t", "-U", "-u"},
+    "env": {"-C", "-S", "-u"},
+    "time": {"-f", "-o"},
+    "nohup": set(),
+    "nice": {"-n"},
+    "exec": {"-a"},
+    "command": set(),
+    "builtin": set(),
+    "xargs": {"-a", "-d", "-E", "-I", "-L", "-n", "-P", "-s"},
+}
+KEYWORDS = {"if", "then", "else", "elif", "fi", "do", "done", "while", "until", "!", "function"}
+# Keywords whose segment contains no command at all, e.g. "for f in *.txt"
+DECLARATIONS = {"for", "select", "case", "esac", "in"}
+BUILTINS = {
+    ".", ":", "[", "[[", "alias", "bg", "bind", "break", "cd", "continue", "declare",
+    "dirs", "echo", "eval", "exit", "export", "false", "fg", "hash", "help", "history",
+    "jobs", "kill", "let", "local", "popd", "printf", "pushd", "pwd", "read", "readonly",
+    "return", "set", "shift", "shopt", "source", "test", "trap", "true", "type",
+    "typeset", "ulimit", "umask", "unalias", "unset", "wait",
+}
+
+
+@dataclass
+class Candidate:
+    command: str
+    # How many of the generated candidates were this command
+    votes: int = 1
+    # None when no syntax checker was available for the shell
+    syntax_ok: Optional[bool] = None
+    syntax_error: str = ""
+    missing: List[str] = field(default_factory=list)
+
+    @property
+    def problems(self) -> List[str]:
+        problems = []
+        if self.syntax_ok is False:
+            problems.append(f"syntax error: {self.syntax_error}" if self.syntax_error else "syntax error")
+        if self.missing:
+            problems.append(f"not found: {', '.join(self.missing)}")
+        return problems
+
+
+def command_names(command: str) -> List[str]:
+    """The programs a command line runs, best effort and without expanding anything."""
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        return []
+    names = []
+    expecting = True
+    after_prefix = None
+    skip_next = False
+    # One entry per open parenthesis: the state to resume after a "$(...)", or
+    # None for a subshell "(...)"
+    groups = []
+    for i, token in enumerate(tokens):
+        if skip_next:
+            skip_next = False
+            continue
+        if set(token) <= OPERATOR_CHARS:
+            # shlex joins adjacent operators, e.g. ")|", so take parentheses one at a time
+            expansion = i > 0 and tokens[i - 1].endswith("$")
+            # "((...))" and "$((...))" are arithmetic and run nothing
+            arithmetic = token.startswith("((")
+            for j, part in enumerate(re.findall(r"[()]|[^()]+", token)):
+                if part == "(":
+                    substitution = expansion and (j == 0 or arithmetic)
+                    groups.append((expecting, after_prefix) if substitution else None)
+                    expecting, after_prefix = not arithmetic, None
+                elif part == ")":
+                    resume = groups.pop() if groups else None
+                    # A substitution is part of the word around it, not a new command
+                    expecting, after_prefix = resume or (False, None)
+                elif part[-1] in "<>":
+                    # A redirection; the next word is its target, not a command
+                    skip_next = True
+                else:
+                    expecting, after_prefix = True, None
+            continue
+        if token.isdigit() and i + 1 < len(tokens) and tokens[i + 1][0] in "<>":
+            # The file descriptor of a redirection such as 2>/dev/null
+            continue
+        if not expecting or token in KEYWORDS:
+            continue
+        if token in DECLARATIONS:
+            expecting = False
+            continue
+        if after_prefix is not None and token in PREFIX_OPTIONS[after_prefix]:
+            # An option such as sudo -u, whose value is not the command either
+            skip_next = True
+            continue
+        if re.match(r"^\w+=", token) or (after_prefix is not None and token.startswith("-")):
+            continue
+        names.append(token)
+        after_prefix = token if token in PREFIX_OPTIONS else None
+        expecting = after_prefix is not None
+    return names
+
+
+def missing_programs(command: str) -> List[str]:
+    missing = []
+    for name in command_names(command):
+        if name in BUILTINS or name.startswith("$") or name in missing:
+            continue
+        if shutil.which(name) is None:
+            missing.append(name)
+    return missing
+
+
+def check_syntax(command: str, shell: Optional[str] = None):
+    """(ok, error) from parsing with the user's shell; ok is None if it can't be checked."""
+    name = os.path.basename(shell or os.environ.get("SHELL", "bash"))
+    if name not in SYNTAX_CHECK_SHELLS:
+        name = "bash"
+    if shutil.which(name) is None:
+        return None, ""
+    try:
+        result = subprocess.run(
+            [name, "-n", "-c", command],
+            capture_output=True,
+            text=True,
+            timeout=SYNTAX_CHECK_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None, ""
+    error = result.stderr.strip().splitlines()
+    return result.returncode == 0, error[-1] if error else ""
+
+
+def check(candidate: Candidate, shell: Optional[str] = None) -> Candidate:
+    candidate.syntax_ok, candidate.syntax_error = check_syntax(candidate.command, shell)
+    candidate.missing = missing_programs(candidate.command)
+    return candidate
+
+
+def rank_candidates(commands: Sequence[str], shell: Optional[str] = None) -> List[Candidate]:
+    """Deduplicate, check and order generated commands, most likely to work first.
+
+    Commands that parse come before ones that don't, then those whose programs are
+    all installed, then the ones the model produced most often.
+    """
+    votes = Counter(command.strip() for command in commands if command.strip())
+    candidates = [Candidate(command, count) for command, count in votes.items()]
+    with ThreadPoolExecutor(max_workers=max(1, len(candidates))) as pool:
+        candidates = list(pool.map(lambda c: check(c, shell), candidates))
+    order = {candidate.command: i for i, candidate in enumerate(candidates)}
+    return sorted(
+        candidates,
+        key=lambda c: (c.syntax_ok is False, len(c.missing), -c.votes, order[c.command]),
+    )
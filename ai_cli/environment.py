@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+# Commands whose presence changes the best answer to a task, e.g. rg over grep -r
+NOTABLE_TOOLS = (
+    "7z", "apt", "bat", "brew", "cargo", "curl", "dnf", "docker", "eza", "fd",
+    "fdfind", "ffmpeg", "fzf", "gawk", "gfind", "gh", "git", "go", "gsed", "htop",
+    "ip", "jq", "kubectl", "launchctl", "lsof", "magick", "make", "node", "npm",
+    "pacman", "parallel", "pbcopy", "pnpm", "podman", "psql", "python", "python3",
+    "rg", "rsync", "sqlite3", "ss", "systemctl", "tree", "unzip", "wget", "xclip",
+    "xdg-open", "yarn", "yq", "zip",
+)
+# Files that say what kind of project a directory holds
+PROJECT_MARKERS = (
+    "Cargo.toml", "CMakeLists.txt", "Dockerfile", "Gemfile", "Makefile",
+    "docker-compose.yml", "go.mod", "package.json", "pom.xml", "pyproject.toml",
+    "requirements.txt", "setup.py",
+)
+PROBE_TIMEOUT = 1.0
+# How long ai_cli waits for a prefetch before generating without the profile
+PREFETCH_WAIT = 2.0
+
+
+def default_profile_path():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "ai_cli", "environment.json")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _cache_key(path_var, shell):
+    # Installing or removing a program changes its PATH directory's mtime
+    return {
+        "path": path_var,
+        "mtimes": [_mtime(d) for d in path_var.split(os.pathsep) if d],
+        "shell": shell,
+        "shell_mtime": _mtime(shell) if shell else None,
+    }
+
+
+def installed_tools(path_var):
+    return [tool for tool in NOTABLE_TOOLS if shutil.which(tool, path=path_var)]
+
+
+def shell_version(shell):
+    if not shell or not os.path.isabs(shell):
+        return ""
+    try:
+        result = subprocess.run(
+            [shell, "--version"],
+            capture_output=True,
+            text=True,
+            timeout=PROBE_TIMEOUT,
+            stdin=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
+    lines = result.stdout.strip().splitlines()
+    return lines[0] if result.returncode == 0 and lines else ""
+
+
+def git_branch(cwd):
+    """The checked-out branch when `cwd` is in a git repository, else None."""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--abbrev-ref", "HEAD"],
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+            timeout=PROBE_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        # Not a repository, or one without commits yet
+        return None
+    return result.stdout.strip()
+
+
+def project_files(cwd):
+    try:
+        names = set(os.listdir(cwd))
+    except OSError:
+        return []
+    return [name for name in PROJECT_MARKERS if name in names]
+
+
+def _system_profile(path, path_var, shell, refresh=False):
+    """Installed tools and shell version, reused until PATH or the shell changes."""
+    key = _cache_key(path_var, shell)
+    if not refresh:
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                return cached["profile"]
+        except (OSError, ValueError, AttributeError, KeyError):
+            pass
+    profile = {"tools": installed_tools(path_var), "shell_version": shell_version(shell)}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"key": key, "profile": profile}, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return profile
+
+
+def load_profile(cwd=None, path=None, refresh=False):
+    """What the model should know about this machine and directory.
+
+    Only coarse facts are included: they go into the system prompt, and anything
+    that changed with every file edit would keep the semantic cache from matching.
+    """
+    cwd = cwd or os.getcwd()
+    profile = _system_profile(
+        path or default_profile_path(),
+        os.environ.get("PATH", os.defpath),
+        os.environ.get("SHELL", ""),
+        refresh,
+    )
+    profile["git_branch"] = git_branch(cwd)
+    profile["project_files"] = project_files(cwd)
+    return profile
+
+
+class Prefetch:
+    """Build the profile in a background thread while ai_cli does other work."""
+
+    def __init__(self, cwd=None):
+        self._profile = None
+        self._thread = threading.Thread(target=self._run, args=(cwd,), daemon=True)
+        self._thread.start()
+
+    def _run(self, cwd):
+        try:
+            self._profile = load_profile(cwd)
+        except Exception:
+            # The profile only improves the prompt; never fail a run over it
+            pass
+
+    def result(self, timeout=PREFETCH_WAIT):
+        """The profile, or None if it failed or isn't ready within `timeout`."""
+        self._thread.join(timeout)
+        return self._profile
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Show the environment profile ai_cli describes to the model."
+    )
+    parser.add_argument(
+        "--refresh", action="store_true", help="Probe again instead of using the cache"
+    )
+    args = parser.parse_args()
+    print(json.dumps(load_profile(refresh=args.refresh), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import json
+import os
+import re
+import shlex
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set
+
+# Share of task words two tasks must have in common to reuse a command
+DEFAULT_MIN_SIMILARITY = 0.8
+CANDIDATE_LIMIT = 50
+# Scanned instead of the full-text index when SQLite was built without FTS5
+FALLBACK_SCAN_LIMIT = 1000
+# Words that don't change what a task asks for
+STOPWORDS = {"a", "an", "the", "please", "me", "my", "can", "you", "i", "would", "like"}
+
+
+def default_history_path() -> str:
+    base = os.environ.get("XDG_DATA_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "share"
+    )
+    return os.environ.get("AI_CLI_HISTORY") or os.path.join(
+        base, "ai_cli", "history.sqlite3"
+    )
+
+
+def task_words(task: str) -> Set[str]:
+    """Normalised words of a task: lowercase, no punctuation, stopwords or plural s."""
+    words = set()
+    for word in re.findall(r"[\w.*/~-]+", task.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+
+def specific_words(words: Set[str]) -> Set[str]:
+    """Numbers, paths, file names and globs, which must match for a command to fit."""
+    return {word for word in words if re.search(r"[\d/~.*]", word)}
+
+
+def uses_relative_paths(command: str) -> bool:
+    """Whether the command refers to files relative to the directory it runs in."""
+    try:
+        words = shlex.split(command)
+    except ValueError:
+        return True
+    return any(
+        re.search(r"[/.*]", word) and not word.startswith(("/", "~", "$", "-"))
+        for word in words[1:]
+    )
+
+
+def similarity(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+@dataclass
+class HistoryEntry:
+    id: int
+    task: str
+    env_info: Dict[str, Any]
+    command: str
+    executed: bool
+    exit_status: Optional[int]
+    created: float
+    # Similarity to the task that was looked up
+    score: float = 1.0
+
+    @property
+    def succeeded(self) -> bool:
+        return self.executed and self.exit_status == 0
+
+
+class CommandHistory:
+    """Every task ai_cli was given, the command it ran and how that went.
+
+    Tasks are indexed with SQLite FTS5 (porter stemming), so lookups stay fast with
+    a long history: the index narrows candidates down, and they are then ranked by
+    the share of words they have in common with the new task.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_history_path()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY,
+                task TEXT NOT NULL,
+                env TEXT NOT NULL,
+                os_info TEXT,
+                shell TEXT,
+                command TEXT NOT NULL,
+                executed INTEGER NOT NULL,
+                exit_status INTEGER,
+                created REAL NOT NULL
+            )"""
+        )
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5("
+                "task, content='history', content_rowid='id', tokenize='porter unicode61')"
+            )
+            self.full_text = True
+        except sqlite3.OperationalError:
+            self.full_text = False
+        self._conn.commit()
+
+    def record(
+        self,
+        task: str,
+        env_info: Dict[str, Any],
+        command: str,
+        executed: bool,
+        exit_status: Optional[int] = None,
+    ) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO history (task, env, os_info, shell, command, executed, "
+                "exit_status, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    task,
+                    json.dumps(env_info, sort_keys=True),
+                    env_info.get("os_info"),
+                    env_info.get("shell"),
+                    command,
+                    int(executed),
+                    exit_status,
+                    time.time(),
+                ),
+            )
+            if self.full_text:
+                self._conn.execute(
+                    "INSERT INTO history_fts (rowid, task) VALUES (?, ?)",
+                    (cursor.lastrowid, task),
+                )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def _candidates(self, words: Set[str], env_info: Dict[str, Any]) -> List[tuple]:
+        columns = "h.id, h.task, h.env, h.command, h.executed, h.exit_status, h.created"
+        same_env = "h.os_info IS ? AND h.shell IS ?"
+        env = (env_info.get("os_info"), env_info.get("shell"))
+        if self.full_text:
+            match = " OR ".join('"{}"'.format(word.replace('"', '""')) for word in words)
+            # Every run of the best-matching tasks, so the latest outcome can be used
+            try:
+                return self._conn.execute(
+                    f"""SELECT {columns} FROM history h
+                    WHERE h.task IN (
+                        SELECT history.task FROM history_fts
+                        JOIN history ON history.id = history_fts.rowid
+                        WHERE history_fts MATCH ? ORDER BY bm25(history_fts) LIMIT ?
+                    ) AND {same_env}
+                    ORDER BY h.created DESC""",
+                    (match, CANDIDATE_LIMIT, *env),
+                ).fetchall()
+            except sqlite3.OperationalError:
+                # Words without any indexable characters make an invalid query
+                pass
+        return self._conn.execute(
+            f"SELECT {columns} FROM history h WHERE {same_env} "
+            "ORDER BY h.created DESC LIMIT ?",
+            (*env, FALLBACK_SCAN_LIMIT),
+        ).fetchall()
+
+    def find(
+        self,
+        task: str,
+        env_info: Dict[str, Any],
+        min_similarity: float = DEFAULT_MIN_SIMILARITY,
+    ) -> Optional[HistoryEntry]:
+        """The best command that last ran successfully for this or a similar task.
+
+        Only entries from the same OS and shell are considered, and a command whose
+        latest run failed or was declined is never suggested again. Numbers and paths
+        in the tasks must be identical, and a command with relative paths is only
+        reused in the directory it ran in. Among equally similar tasks, one run in the
+        same directory wins, then the most recent.
+        """
+        words = task_words(task)
+        if not words:
+            return None
+        specific = specific_words(words)
+        with self._lock:
+            rows = self._candidates(words, env_info)
+        best: Optional[HistoryEntry] = None
+        best_rank = None
+        seen = set()
+        for entry_id, entry_task, env, command, executed, exit_status, created in rows:
+            # Rows are newest first, so the first row per command is its latest outcome
+            if command in seen:
+                continue
+            seen.add(command)
+            entry_words = task_words(entry_task)
+            entry = HistoryEntry(
+                entry_id,
+                entry_task,
+                json.loads(env),
+                command,
+                bool(executed),
+                exit_status,
+                created,
+                similarity(words, entry_words),
+            )
+            if not entry.succeeded or entry.score < min_similarity:
+                continue
+            # "older than 7 days" and "older than 30 days" differ in one word only
+            if specific_words(entry_words) != specific:
+                continue
+            same_directory = entry.env_info.get("current_directory") == env_info.get(
+                "current_directory"
+            )
+            if not same_directory and uses_relative_paths(command):
+                continue
+            rank = (entry.score, same_directory, created)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = entry, rank
+        return best
+
+    def recent(self, limit: int = 20) -> List[HistoryEntry]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, task, env, command, executed, exit_status, created "
+                "FROM history ORDER BY created DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            HistoryEntry(i, task, json.loads(env), command, bool(executed), status, created)
+            for i, task, env, command, executed, status, created in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
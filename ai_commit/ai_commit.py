@@ -1,49 +1,667 @@
 #!/usr/bin/env python
 import argparse
+import fnmatch
+import hashlib
+import json
 import os
+import shlex
 import subprocess
 import sys
 import time
-from typing import List, Optional
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 from ai_service.ai_service import AIService
+from ai_service.budget import (
+    Section,
+    count_tokens,
+    fit_sections,
+    prompt_budget,
+    truncate_to_tokens,
+)
+from ai_service.cache import ResponseCache
+from ai_service.circuit import persist_circuits
+from ai_service.metrics import CallRecord
+from ai_service.structured import StructuredOutputError, extract_json
 
+# Three short commit messages, with room to spare
+RESERVED_OUTPUT_TOKENS = 300
+# A few bullet points per diff chunk, and how many chunks are summarized at once
+SUMMARY_OUTPUT_TOKENS = 200
+SUMMARY_CONCURRENCY = 4
 
-def get_git_diff() -> str:
-    """Get the git diff of staged changes, or unstaged if no staged changes."""
+SUMMARY_INSTRUCTIONS = """Summarize what this part of a git diff changes in at most three short bullet points.
+Name the files and functions involved. Only describe changes shown here.
+Here's the diff:\n\n"""
+
+COMMIT_MESSAGES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "messages": {
+            "type": "array",
+            "items": {"type": "string", "minLength": 1},
+            "minItems": 3,
+            "maxItems": 3,
+        }
+    },
+    "required": ["messages"],
+}
+
+
+# Lock files, build output and vendored code: long diffs that say little about a change
+DEFAULT_EXCLUDES = [
+    "*.lock",
+    "package-lock.json",
+    "pnpm-lock.yaml",
+    "go.sum",
+    "*.min.js",
+    "*.min.css",
+    "*.map",
+    "*_pb2.py",
+    "*.pb.go",
+    "dist/*",
+    "node_modules/*",
+    "vendor/*",
+    "third_party/*",
+]
+# Diff text read at most; longer diffs are cut off without reading the rest
+MAX_DIFF_CHARS = int(os.environ.get("AI_COMMIT_MAX_DIFF_CHARS", "1000000"))
+# Files listed by name in the summary of changed files
+MAX_STAT_FILES = 200
+# Plain git output whatever color.ui or diff.external say, so every file starts
+# with a "diff --git " line
+GIT_DIFF_FLAGS = ["--no-color", "--no-ext-diff"]
+
+
+@dataclass
+class FileStat:
+    path: str
+    # None for binary files
+    added: Optional[int]
+    deleted: Optional[int]
+    excluded: bool = False
+    # The path before a rename
+    old_path: Optional[str] = None
+
+    @property
+    def binary(self) -> bool:
+        return self.added is None
+
+
+def is_excluded(path: str, patterns: Sequence[str]) -> bool:
+    """Whether `path` matches a pattern, as a whole or from any directory down."""
+    parts = path.split("/")
+    tails = ["/".join(parts[i:]) for i in range(len(parts))]
+    return any(fnmatch.fnmatchcase(tail, pattern) for pattern in patterns for tail in tails)
+
+
+def git_numstat(diff_args: List[str], excludes: Sequence[str]) -> List[FileStat]:
+    """Lines added and deleted per file, which git computes without printing the diff."""
+    output = subprocess.check_output(
+        ["git", "diff", *GIT_DIFF_FLAGS, *diff_args, "--numstat", "-z"],
+        text=True,
+        errors="replace",
+    )
+    fields = output.split("\0")
+    stats = []
+    i = 0
+    while i < len(fields) and fields[i]:
+        added, deleted, path = fields[i].split("\t", 2)
+        old_path = None
+        i += 1
+        if not path:
+            # A rename: the old and the new path follow as separate fields
+            old_path, path = fields[i], fields[i + 1]
+            i += 2
+        stats.append(
+            FileStat(
+                path,
+                None if added == "-" else int(added),
+                None if deleted == "-" else int(deleted),
+                is_excluded(path, excludes),
+                old_path,
+            )
+        )
+    return stats
+
+
+def read_diff(
+    diff_args: List[str], stats: List[FileStat], max_chars: int
+) -> Tuple[str, bool]:
+    """Stream `git diff`, keeping only included text files; returns (diff, cut off).
+
+    Excluded and binary files are dropped as they stream past, so they never take up
+    memory, and git is stopped once `max_chars` have been read.
+    """
+    process = subprocess.Popen(
+        ["git", "diff", *GIT_DIFF_FLAGS, *diff_args],
+        stdout=subprocess.PIPE,
+        text=True,
+        errors="replace",
+    )
+    parts: List[str] = []
+    size = 0
+    index = -1
+    keep = True
+    truncated = False
     try:
-        diff = subprocess.check_output(["git", "diff", "--cached"], text=True)
-        if not diff:
-            diff = subprocess.check_output(["git", "diff"], text=True)
-        return diff[:5000]  # Limit to 5000 characters
-    except subprocess.CalledProcessError:
+        for line in process.stdout:
+            if line.startswith("diff --git "):
+                # git lists files in the same order for --numstat and the diff
+                index += 1
+                stat = stats[index] if index < len(stats) else None
+                keep = stat is None or not (stat.excluded or stat.binary)
+            if not keep:
+                continue
+            if size + len(line) > max_chars:
+                truncated = True
+                break
+            parts.append(line)
+            size += len(line)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+    return "".join(parts), truncated
+
+
+def format_stat(stats: List[FileStat]) -> str:
+    lines = ["Changed files:"]
+    for stat in stats[:MAX_STAT_FILES]:
+        if stat.binary:
+            detail = "binary, diff not shown"
+        else:
+            detail = f"+{stat.added} -{stat.deleted}"
+            if stat.excluded:
+                detail += ", generated or vendored, diff not shown"
+        name = f"{stat.old_path} -> {stat.path}" if stat.old_path else stat.path
+        lines.append(f"{name} ({detail})")
+    if len(stats) > MAX_STAT_FILES:
+        lines.append(f"... and {len(stats) - MAX_STAT_FILES} more files")
+    return "\n".join(lines) + "\n\n"
+
+
+def get_git_diff(
+    excludes: Sequence[str] = DEFAULT_EXCLUDES, max_chars: int = MAX_DIFF_CHARS
+) -> str:
+    """Get the git diff of staged changes, or unstaged if no staged changes.
+
+    It starts with a list of the changed files and their line counts. Files matching
+    `excludes` and binary files only appear in that list.
+    """
+    try:
+        diff_args = ["--cached"]
+        stats = git_numstat(diff_args, excludes)
+        if not stats:
+            diff_args = []
+            stats = git_numstat(diff_args, excludes)
+        if not stats:
+            return ""
+        diff, truncated = read_diff(diff_args, stats, max_chars)
+    except (subprocess.CalledProcessError, OSError):
         print("Error: Not a git repository or git is not installed.")
         sys.exit(1)
+    if truncated:
+        print(f"Note: only the first {max_chars} characters of the diff were read.")
+    return format_stat(stats) + diff
 
 
-def query_ai_service(
-    prompt: str, service_type: str, ollama_model: str, groq_model: str
+def commit_instructions(
+    max_chars: int, source: str = "git diff", heading: str = "Here's the diff"
 ) -> str:
-    """Query AI service with the given prompt."""
+    return f"""
+    Your task is to generate three concise, informative git commit messages based on the following {source}.
+    Be sure that each commit message reflects the entire diff.
+    It is very important that the entire commit is clear and understandable with each of the three options. 
+    Try to fit each commit message in {max_chars} characters.
+    Return the three messages as a JSON object of the form {{"messages": ["...", "...", "..."]}}.
+    {heading}:\n\n"""
+
+
+def fits_context(diff: str, max_chars: int, service_type: str, model: str) -> bool:
+    """Whether the whole diff fits in one generation prompt."""
+    budget = prompt_budget(service_type, model, reserved_output=RESERVED_OUTPUT_TOKENS)
+    return count_tokens(commit_instructions(max_chars)) + count_tokens(diff) <= budget
+
+
+def build_prompt(diff: str, max_chars: int, service_type: str, model: str) -> str:
+    """Build the generation prompt, truncating the diff to the model's context window."""
+    fit = fit_sections(
+        [
+            Section("instructions", commit_instructions(max_chars), priority=1),
+            Section("diff", diff),
+        ],
+        prompt_budget(service_type, model, reserved_output=RESERVED_OUTPUT_TOKENS),
+    )
+    if fit.was_truncated:
+        original, kept = fit.truncated["diff"]
+        print(
+            f"Note: the diff was truncated to {kept} of {original} tokens "
+            f"to fit the context window of {model}."
+        )
+    return fit.join(separator="")
+
+
+def _split_before(text: str, prefix: str) -> List[str]:
+    """Split `text` into parts that each start at a line beginning with `prefix`."""
+    parts: List[str] = []
+    current: List[str] = []
+    for line in text.splitlines(keepends=True):
+        if line.startswith(prefix) and current:
+            parts.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def split_diff(diff: str, max_tokens: int) -> List[str]:
+    """Split a diff into chunks of at most `max_tokens`, on file and then hunk boundaries.
+
+    A file too large for one chunk is split into its hunks, each repeating the file
+    header; small files are packed together so there are as few chunks as possible.
+    """
+    pieces = []
+    for file_diff in _split_before(diff, "diff --git "):
+        if count_tokens(file_diff) <= max_tokens:
+            pieces.append(file_diff)
+            continue
+        header, *hunks = _split_before(file_diff, "@@ ")
+        for hunk in hunks or [""]:
+            pieces.append(truncate_to_tokens(header + hunk, max_tokens))
+
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def summarize_diff(
+    diff: str,
+    service_type: str,
+    model: str,
+    cache: Optional[ResponseCache] = None,
+) -> List[str]:
+    """Summarize each chunk of the diff concurrently (the map step)."""
+    chunk_tokens = prompt_budget(
+        service_type, model, reserved_output=SUMMARY_OUTPUT_TOKENS
+    ) - count_tokens(SUMMARY_INSTRUCTIONS)
+    chunks = split_diff(diff, max(1, chunk_tokens))
+    print(f"Summarizing the diff in {len(chunks)} parts...", end="", flush=True)
+    # Cached per chunk, so after a small change only the chunks that differ are redone
+    ai_service = AIService(service_type, model=model, cache=cache)
+    summaries = ai_service.query_many(
+        [SUMMARY_INSTRUCTIONS + chunk for chunk in chunks],
+        concurrency=SUMMARY_CONCURRENCY,
+    )
+    print("Done!")
+    return summaries
+
+
+def build_summary_prompt(
+    summaries: List[str], max_chars: int, service_type: str, model: str
+) -> str:
+    """Build the generation prompt from chunk summaries (the reduce step)."""
+    parts = "\n\n".join(
+        f"Part {i}:\n{summary.strip()}" for i, summary in enumerate(summaries, 1)
+    )
+    fit = fit_sections(
+        [
+            Section(
+                "instructions",
+                commit_instructions(
+                    max_chars,
+                    "summaries of every part of a git diff",
+                    "Here are the summaries",
+                ),
+                priority=1,
+            ),
+            Section("summaries", parts),
+        ],
+        prompt_budget(service_type, model, reserved_output=RESERVED_OUTPUT_TOKENS),
+    )
+    if fit.was_truncated:
+        original, kept = fit.truncated["summaries"]
+        print(f"Note: the summaries were truncated to {kept} of {original} tokens.")
+    return fit.join(separator="")
+
+
+def query_ai_service(
+    prompt: str,
+    service_type: str,
+    ollama_model: str,
+    groq_model: str,
+    cache: Optional[ResponseCache] = None,
+    refresh: bool = False,
+    stream: bool = False,
+) -> Tuple[List[str], Optional[CallRecord]]:
+    """Generate commit messages in structured mode, optionally showing each as it completes.
+
+    Answers that don't match the schema fall back to parsing the raw text.
+    """
     try:
-        print("Generating commit messages...", end="", flush=True)
         ai_service = AIService(
-            service_type, model=ollama_model if service_type == "ollama" else groq_model
+            service_type,
+            model=ollama_model if service_type == "ollama" else groq_model,
+            cache=cache,
         )
-        response = ai_service.query(prompt)
-        print("Done!")
-        return response
+        try:
+            if not stream:
+                print("Generating commit messages...", end="", flush=True)
+                result = ai_service.query_structured(
+                    prompt, COMMIT_MESSAGES_SCHEMA, refresh=refresh
+                )
+                print("Done!")
+                return result["messages"], ai_service.last_call
+
+            print("Generating commit messages...\n", flush=True)
+            shown = 0
+            messages: List[str] = []
+            for result in ai_service.stream_structured(
+                prompt, COMMIT_MESSAGES_SCHEMA, refresh=refresh
+            ):
+                if isinstance(result.get("messages"), list):
+                    messages = result["messages"]
+                # Every message but the last is complete; the last may still be growing
+                while shown < len(messages) - 1:
+                    print(f"\033[2m{shown + 1}. {messages[shown]}\033[0m", flush=True)
+                    shown += 1
+            for message in messages[shown:]:
+                shown += 1
+                print(f"\033[2m{shown}. {message}\033[0m", flush=True)
+            print("")
+            return messages, ai_service.last_call
+        except StructuredOutputError as e:
+            if not stream:
+                print("Done!")
+            return parse_commit_messages(e.text), ai_service.last_call
     except Exception as e:
         print(f"\nError querying {service_type.capitalize()}: {e}")
         sys.exit(1)
 
 
+def prepare_prompt(
+    diff: str,
+    max_chars: int,
+    service_type: str,
+    model: str,
+    map_reduce: str = "never",
+    cache: Optional[ResponseCache] = None,
+) -> str:
+    """The generation prompt, built from chunk summaries when map_reduce asks for it."""
+    fits = map_reduce == "always" or fits_context(diff, max_chars, service_type, model)
+    if map_reduce == "always" or (map_reduce == "auto" and not fits):
+        try:
+            summaries = summarize_diff(diff, service_type, model, cache)
+        except Exception as e:
+            print(f"\nError querying {service_type.capitalize()}: {e}")
+            sys.exit(1)
+        return build_summary_prompt(summaries, max_chars, service_type, model)
+    prompt = build_prompt(diff, max_chars, service_type, model)
+    if not fits:
+        print("Use --map-reduce auto to summarize the whole diff in parts instead.")
+    return prompt
+
+
+# Set while pregenerating, so the git commands it runs don't trigger the hook again
+PREGENERATE_ENV = "AI_COMMIT_PREGENERATING"
+# Run by git whenever it writes the index, e.g. after `git add`
+HOOK_NAME = "post-index-change"
+HOOK_MARKER = "# Installed by ai_commit --install-hook"
+# A pregeneration lock older than this was left by a run that died
+PREGENERATE_LOCK_TIMEOUT = 600
+MAX_PREGENERATED = 20
+WATCH_INTERVAL = 1.0
+
+
+def _git(*args: str) -> str:
+    return subprocess.check_output(["git", *args], text=True).strip()
+
+
+def staged_key() -> Optional[str]:
+    """Hash of the staged index entries, or None if nothing is staged.
+
+    Only read-only plumbing is used: write-tree would take .git/index.lock, which
+    makes a git command the user runs at the same time fail.
+    """
+    try:
+        entries = subprocess.check_output(
+            ["git", "ls-files", "--stage", "-z"], stderr=subprocess.DEVNULL
+        )
+    except (subprocess.CalledProcessError, OSError):
+        # Not a repository
+        return None
+    for entry in entries.split(b"\0"):
+        if entry and entry.split(b"\t", 1)[0].split(b" ")[2] != b"0":
+            # Unresolved merge conflicts
+            return None
+    unchanged = subprocess.run(
+        ["git", "diff-index", "--cached", "--quiet", "HEAD", "--"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    ).returncode == 0
+    if unchanged or not entries:
+        # Without a HEAD commit yet diff-index fails, and anything in the index is staged
+        return None
+    return hashlib.sha1(entries).hexdigest()
+
+
+def pregenerated_dir() -> str:
+    return os.path.abspath(_git("rev-parse", "--git-path", "ai_commit"))
+
+
+def load_pregenerated(key: str, settings: Dict[str, Any]) -> Optional[List[str]]:
+    """Messages pregenerated for these staged changes with the same settings, if any."""
+    try:
+        with open(os.path.join(pregenerated_dir(), f"{key}.json")) as f:
+            entry = json.load(f)
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return None
+    if not isinstance(entry, dict) or entry.get("settings") != settings:
+        return None
+    return entry.get("messages") or None
+
+
+def save_pregenerated(key: str, settings: Dict[str, Any], messages: List[str]):
+    directory = pregenerated_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{key}.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"settings": settings, "messages": messages, "created": time.time()}, f)
+    os.replace(tmp, path)
+    # Keep the messages for the latest few staged states only
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".json"):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                # Already pruned by a concurrent run
+                pass
+    entries.sort(reverse=True)
+    for _, entry_path in entries[MAX_PREGENERATED:]:
+        try:
+            os.unlink(entry_path)
+        except FileNotFoundError:
+            pass
+
+
+def pregenerate(
+    settings: Dict[str, Any],
+    ollama_model: str,
+    groq_model: str,
+    cache: Optional[ResponseCache] = None,
+) -> bool:
+    """Generate and store messages for the staged changes unless already done.
+
+    Returns whether messages for the current staged changes are available.
+    """
+    os.environ[PREGENERATE_ENV] = "1"
+    key = staged_key()
+    if key is None:
+        return False
+    if load_pregenerated(key, settings) is not None:
+        return True
+    lock = os.path.join(pregenerated_dir(), f"{key}.lock")
+    os.makedirs(os.path.dirname(lock), exist_ok=True)
+    try:
+        if time.time() - os.stat(lock).st_mtime > PREGENERATE_LOCK_TIMEOUT:
+            os.unlink(lock)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        # Another run is already generating messages for these changes
+        return False
+    try:
+        diff = get_git_diff(settings["excludes"])
+        if not diff:
+            return False
+        prompt = prepare_prompt(
+            diff,
+            settings["max_chars"],
+            settings["service"],
+            settings["model"],
+            settings["map_reduce"],
+            cache,
+        )
+        messages, _ = query_ai_service(
+            prompt, settings["service"], ollama_model, groq_model, cache=cache
+        )
+        # Files staged while generating make these messages stale
+        if messages and staged_key() == key:
+            save_pregenerated(key, settings, messages)
+            return True
+        return False
+    finally:
+        os.unlink(lock)
+
+
+def watch(
+    settings: Dict[str, Any],
+    ollama_model: str,
+    groq_model: str,
+    cache: Optional[ResponseCache] = None,
+):
+    """Pregenerate messages each time the index changes, until interrupted."""
+    index = os.path.abspath(_git("rev-parse", "--git-path", "index"))
+
+    def mtime() -> Optional[float]:
+        try:
+            return os.stat(index).st_mtime
+        except OSError:
+            return None
+
+    print("Pregenerating commit messages whenever the index changes (Ctrl-C to stop)...")
+    seen = None
+    try:
+        while True:
+            current = mtime()
+            if current != seen:
+                # Wait for a series of `git add`s to settle before generating
+                time.sleep(WATCH_INTERVAL)
+                if mtime() != current:
+                    continue
+                seen = current
+                try:
+                    pregenerate(settings, ollama_model, groq_model, cache)
+                except SystemExit:
+                    print("Will try again when the index changes.")
+                # Our own git calls may have rewritten the index
+                seen = mtime()
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+
+
+def install_hook(pregenerate_args: List[str]) -> bool:
+    """Install a post-index-change hook that pregenerates messages in the background."""
+    path = os.path.join(os.path.abspath(_git("rev-parse", "--git-path", "hooks")), HOOK_NAME)
+    command = shlex.join(
+        [sys.executable, os.path.abspath(__file__), "--pregenerate", *pregenerate_args]
+    )
+    log = os.path.abspath(_git("rev-parse", "--git-path", "ai_commit.log"))
+    if os.path.exists(path):
+        with open(path) as f:
+            if HOOK_MARKER not in f.read():
+                print(f"{path} already exists. Add this line to it instead:")
+                print(f"{command} </dev/null >>{shlex.quote(log)} 2>&1 &")
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(
+            f"""#!/bin/sh
+{HOOK_MARKER}
+# Pregenerates commit messages for the staged changes whenever the index changes
+[ -n "${PREGENERATE_ENV}" ] && exit 0
+{command} </dev/null >>{shlex.quote(log)} 2>&1 &
+"""
+        )
+    os.chmod(path, 0o755)
+    print(f"Installed {path}")
+    return True
+
+
+def print_call_analytics(call: Optional[CallRecord]):
+    """Print latency, token usage and cost figures for a generation."""
+    if call is None:
+        return
+    if call.cached:
+        print("Served from cache")
+        return
+    if call.time_to_first_token is not None:
+        print(f"Time to first token: {call.time_to_first_token:.2f} seconds")
+    if call.tokens_per_second is not None:
+        print(f"Generation speed: {call.tokens_per_second:.1f} tokens/second")
+    if call.prompt_tokens is not None or call.completion_tokens is not None:
+        print(
+            f"Tokens: {call.prompt_tokens or 0} prompt, "
+            f"{call.completion_tokens or 0} completion"
+        )
+    if call.cold_start:
+        print(f"Model load (cold start): {call.load_time:.2f} seconds")
+    if call.retries:
+        print(f"Retries: {call.retries}")
+    if call.cost is not None:
+        print(f"Estimated cost: ${call.cost:.5f}")
+
+
 def parse_commit_messages(response: str) -> List[str]:
-    """Parse the LLM response into a list of commit messages."""
+    """Parse an answer that didn't match the schema into a list of commit messages.
+
+    JSON answers (e.g. with the wrong number of messages) keep whatever messages they
+    have; only text that isn't JSON is split into lines.
+    """
+    try:
+        value = extract_json(response)
+    except ValueError:
+        pass
+    else:
+        found = value.get("messages") if isinstance(value, dict) else value
+        if not isinstance(found, list):
+            return []
+        return [m.strip() for m in found if isinstance(m, str) and m.strip()][:3]
     messages = []
     for line in response.split("\n"):
         if line.strip().startswith(("1.", "2.", "3.")):
             messages.append(line.split(".", 1)[1].strip())
+    if not messages:
+        # Unnumbered answers: one message per line
+        lines = [line.strip().lstrip("-*").strip().strip('"') for line in response.split("\n")]
+        messages = [line for line in lines if line][:3]
     return messages
 
 
@@ -131,27 +749,108 @@ def main():
         default=75,
         help="Suggested maximum number of characters for each commit message (default: 75)",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Show the model output as it is generated",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse cached messages for an identical diff (regenerate always queries the model)",
+    )
+    parser.add_argument(
+        "--map-reduce",
+        choices=["auto", "always", "never"],
+        default="never",
+        help="Summarize parts of the diff concurrently and generate the messages from "
+        "the summaries; auto does so when the diff doesn't fit the model's context, "
+        "at the cost of one extra model call per part (default: never)",
+    )
+    parser.add_argument(
+        "--pregenerate",
+        action="store_true",
+        help="Generate messages for the staged changes and store them for the next run, "
+        "without committing",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Pregenerate messages every time the staged changes change",
+    )
+    parser.add_argument(
+        "--install-hook",
+        action="store_true",
+        help="Install a git hook that pregenerates messages in the background after "
+        "each `git add`, using the other options given",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="Leave files matching PATTERN (e.g. '*.svg' or 'generated/*') out of the "
+        "diff sent to the model; can be repeated",
+    )
+    parser.add_argument(
+        "--no-default-excludes",
+        action="store_true",
+        help="Send the diffs of lock files, minified and vendored files too",
+    )
     args = parser.parse_args()
 
+    # Remember backend outages between runs, so they fail fast instead of retrying
+    persist_circuits()
+    cache = ResponseCache() if args.cache else None
+    service_type = "groq" if args.groq else "ollama"
+
     start_time = time.time()
 
-    diff = get_git_diff()
-    if not diff:
-        print("No changes to commit.")
-        sys.exit(0)
+    excludes = [] if args.no_default_excludes else list(DEFAULT_EXCLUDES)
+    excludes += [p for p in os.getenv("AI_COMMIT_EXCLUDE", "").split(",") if p.strip()]
+    excludes += args.exclude
+    model = GROQ_MODEL if args.groq else OLLAMA_MODEL
+    # Pregenerated messages are only used when they were made with the same settings
+    settings = {
+        "service": service_type,
+        "model": model,
+        "max_chars": args.max_chars,
+        "excludes": excludes,
+        "map_reduce": args.map_reduce,
+    }
 
-    prompt = f"""
-    Your task is to generate three concise, informative git commit messages based on the following git diff.
-    Be sure that each commit message reflects the entire diff.
-    It is very important that the entire commit is clear and understandable with each of the three options. 
-    Try to fit each commit message in {args.max_chars} characters.
-    Each message should be on a new line, starting with a number and a period (e.g., '1.', '2.', '3.').
-    Here's the diff:\n\n{diff}"""
+    if args.install_hook:
+        hook_args = ["--max_chars", str(args.max_chars), "--map-reduce", args.map_reduce]
+        hook_args += ["--groq"] if args.groq else []
+        hook_args += ["--cache"] if args.cache else []
+        hook_args += ["--no-default-excludes"] if args.no_default_excludes else []
+        for pattern in args.exclude:
+            hook_args += ["--exclude", pattern]
+        sys.exit(0 if install_hook(hook_args) else 1)
+    if args.pregenerate:
+        sys.exit(0 if pregenerate(settings, OLLAMA_MODEL, GROQ_MODEL, cache) else 1)
+    if args.watch:
+        watch(settings, OLLAMA_MODEL, GROQ_MODEL, cache)
+        return
 
-    if args.groq:
-        response = query_ai_service(prompt, "groq", OLLAMA_MODEL, GROQ_MODEL)
+    prompt = None
+    call = None
+    key = staged_key()
+    commit_messages = key and load_pregenerated(key, settings)
+    if commit_messages:
+        print("Using messages pregenerated for the staged changes.\n")
     else:
-        response = query_ai_service(prompt, "ollama", OLLAMA_MODEL, GROQ_MODEL)
+        diff = get_git_diff(excludes)
+        if not diff:
+            print("No changes to commit.")
+            sys.exit(0)
+        # Regenerating reuses this prompt, so large diffs are only summarized once
+        prompt = prepare_prompt(
+            diff, args.max_chars, service_type, model, args.map_reduce, cache
+        )
+        commit_messages, call = query_ai_service(
+            prompt, service_type, OLLAMA_MODEL, GROQ_MODEL, cache=cache, stream=args.stream
+        )
 
     end_time = time.time()
 
@@ -162,9 +861,12 @@ def main():
         )
         print(f"Inference used: {'Groq' if args.groq else 'Ollama'}")
         print(f"Model name: {GROQ_MODEL if args.groq else OLLAMA_MODEL}")
+        print_call_analytics(call)
+        if cache:
+            stats = cache.stats()
+            print(f"Cache: {stats['hits']} hits, {stats['misses']} misses")
         print("")  # Add a blank line for better readability
 
-    commit_messages = parse_commit_messages(response)
     if not commit_messages:
         print("Error: Could not generate commit messages.")
         sys.exit(1)
@@ -175,10 +877,24 @@ def main():
         )
         if selected_message == "regenerate":
             start_time = time.time()
-            if args.groq:
-                response = query_ai_service(prompt, "groq", OLLAMA_MODEL, GROQ_MODEL)
-            else:
-                response = query_ai_service(prompt, "ollama", OLLAMA_MODEL, GROQ_MODEL)
+            if prompt is None:
+                prompt = prepare_prompt(
+                    get_git_diff(excludes),
+                    args.max_chars,
+                    service_type,
+                    model,
+                    args.map_reduce,
+                    cache,
+                )
+            commit_messages, call = query_ai_service(
+                prompt,
+                service_type,
+                OLLAMA_MODEL,
+                GROQ_MODEL,
+                cache=cache,
+                refresh=True,
+                stream=args.stream,
+            )
             end_time = time.time()
 
             if args.analytics:
@@ -186,9 +902,9 @@ def main():
                 print(
                     f"Time taken to regenerate commit messages: {end_time - start_time:.2f} seconds"
                 )
+                print_call_analytics(call)
                 print("")  # Add a blank line for better readability
 
-            commit_messages = parse_commit_messages(response)
             if not commit_messages:
                 print("Error: Could not generate commit messages.")
                 sys.exit(1)
@@ -1,53 +1,815 @@
+import dataclasses
+import logging
 import os
-from typing import Optional
-from anthropic import Anthropic
-from groq import Groq
-import ollama
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+)
+
+from ai_service.batch import (
+    DEFAULT_MAX_PACK_CHARS,
+    AsyncSingleFlight,
+    SingleFlight,
+    build_packed_prompt,
+    parse_packed_response,
+)
+from ai_service.backends import Completion, Request, get_backend
+from ai_service.budget import (
+    DEFAULT_RESERVED_OUTPUT,
+    context_window,
+    count_tokens,
+    prompt_budget,
+)
+from ai_service.cache import ResponseCache, make_cache_key
+from ai_service.circuit import CircuitBreaker, get_breaker
+from ai_service.keep_alive import is_cold_start
+from ai_service.lazy import lazy_import
+from ai_service.metrics import (
+    CallRecord,
+    MetricsRecorder,
+    default_recorder,
+    estimate_cost,
+)
+from ai_service.retry import (
+    RetryPolicy,
+    RetryState,
+    arun_with_retry,
+    get_rate_limiter,
+    run_with_retry,
+)
+from ai_service.semantic_cache import SemanticCache, SemanticHit
+from ai_service.structured import (
+    IncrementalJSONParser,
+    StructuredOutputError,
+    as_json_schema,
+    parse_structured,
+)
+
+asyncio = lazy_import("asyncio")
+logger = logging.getLogger("ai_service")
+
+T = TypeVar("T")
+
+DEFAULT_CONCURRENCY = 4
+
+# Identical requests in flight anywhere in the process share one backend call
+_inflight = SingleFlight()
+_ainflight = AsyncSingleFlight()
+
+
+async def gather_bounded(
+    aws: Iterable[Awaitable[T]], concurrency: int = DEFAULT_CONCURRENCY
+) -> List[T]:
+    """Await all awaitables with at most `concurrency` running at once, preserving order."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws))
+
+
+@dataclass
+class StreamStats:
+    """Perceived-latency measurements for one streamed completion."""
+
+    service_type: str
+    model: Optional[str]
+    start: float = field(default_factory=time.perf_counter)
+    first_token_at: Optional[float] = None
+    end: Optional[float] = None
+    chunks: int = 0
+    # Exact counts reported by the backend, when available
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    load_time: Optional[float] = None
+    cached: bool = False
+
+    def mark_chunk(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.chunks += 1
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.start
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    @property
+    def tokens(self) -> int:
+        return self.completion_tokens if self.completion_tokens is not None else self.chunks
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        # Generation rate after the first token, so it isn't skewed by queueing/load time
+        if self.first_token_at is None or self.end is None:
+            return None
+        elapsed = self.end - self.first_token_at
+        return self.tokens / elapsed if elapsed > 0 else None
 
 
 class AIService:
-    def __init__(self, service_type: str, model: Optional[str] = None):
+    def __init__(
+        self,
+        service_type: str,
+        model: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        cache: Optional[ResponseCache] = None,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        coalesce: bool = False,
+        metrics: Optional[MetricsRecorder] = None,
+        call_site: Optional[str] = None,
+        system: Optional[str] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+    ):
         self.service_type = service_type.lower()
+        self.backend = get_backend(self.service_type)(
+            self.service_type, api_key, base_url
+        )
         self.model = model
-        if self.service_type == "groq":
-            self.client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-        elif self.service_type == "anthropic":
-            self.client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
-        elif self.service_type == "ollama":
-            self.client = ollama
-
-    def query(self, prompt: str, max_retries: int = 3) -> str:
-        for _ in range(max_retries):
-            try:
-                if self.service_type == "ollama":
-                    return self._query_ollama(prompt)
-                elif self.service_type == "groq":
-                    return self._query_groq(prompt)
-                elif self.service_type == "anthropic":
-                    return self._query_anthropic(prompt)
+        self.system = system
+        # Sampling parameters shared by all backends: "temperature" and "max_tokens"
+        self.options = options or {}
+        self.cache = cache
+        # Serves near-duplicate prompts; consulted after an exact-cache miss
+        self.semantic_cache = semantic_cache
+        self.api_key = api_key
+        self.base_url = base_url
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Share in-flight calls for identical requests; off by default because callers
+        # that sample the same prompt several times expect independent answers
+        self.coalesce = coalesce
+        self.metrics = metrics or default_recorder
+        # Label for grouping metrics; defaults to the running script, e.g. "ai_commit.py"
+        self.call_site = call_site or os.path.basename(sys.argv[0] or "") or None
+        self.last_stream_stats: Optional[StreamStats] = None
+        self.last_call: Optional[CallRecord] = None
+        self.last_semantic_hit: Optional[SemanticHit] = None
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        """Circuit breaker shared by every AIService using this backend and endpoint."""
+        name = self.service_type
+        if self.base_url is not None:
+            name = f"{name}@{self.base_url}"
+        return get_breaker(name, self.backend.health_check)
+
+    @property
+    def client(self):
+        return self.backend.client
+
+    @property
+    def resolved_model(self) -> Optional[str]:
+        return self.model or self.backend.default_model
+
+    def cache_key(self, prompt: str, schema: Optional[Dict[str, Any]] = None) -> str:
+        params = self.options
+        if self.system:
+            params = {**params, "system": self.system}
+        if schema is not None:
+            params = {**params, "schema": schema}
+        return make_cache_key(self.service_type, self.resolved_model, prompt, params)
+
+    @staticmethod
+    def _cacheable(response: str, schema: Optional[Dict[str, Any]]) -> bool:
+        """Structured answers are cached only once they validate, so a bad one isn't
+        served again on the next call."""
+        if schema is None:
+            return True
+        try:
+            parse_structured(response, schema)
+        except StructuredOutputError:
+            return False
+        return True
+
+    def _semantic_lookup(
+        self, prompt: str, schema: Optional[Dict[str, Any]], refresh: bool
+    ) -> Optional[str]:
+        self.last_semantic_hit = None
+        if self.semantic_cache is None or refresh:
+            return None
+        # Everything but the prompt must match, so the rest of the key is the namespace
+        hit = self.semantic_cache.get(self.cache_key("", schema), prompt)
+        if hit is None:
+            return None
+        logger.info(
+            "Semantic cache hit for %r (similarity %.3f to %r)",
+            prompt,
+            hit.similarity,
+            hit.text,
+        )
+        self.last_semantic_hit = hit
+        return hit.response
+
+    def _semantic_store(
+        self, prompt: str, schema: Optional[Dict[str, Any]], response: str
+    ):
+        if self.semantic_cache is not None:
+            self.semantic_cache.set(self.cache_key("", schema), prompt, response)
+
+    def _request(
+        self,
+        prompt: str,
+        schema: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Request:
+        return Request(
+            prompt, self.resolved_model, self.system, self.options, schema, timeout
+        )
+
+    @property
+    def context_window(self) -> int:
+        return context_window(self.service_type, self.resolved_model)
+
+    def prompt_budget(self, reserved_output: Optional[int] = None) -> int:
+        """Tokens a prompt can use, leaving room for the system prompt and the response."""
+        if reserved_output is None:
+            reserved_output = self.options.get("max_tokens", DEFAULT_RESERVED_OUTPUT)
+        budget = prompt_budget(self.service_type, self.resolved_model, reserved_output)
+        if self.system:
+            budget -= count_tokens(self.system)
+        return max(0, budget)
+
+    def _check_prompt_size(self, prompt: str):
+        tokens = count_tokens(prompt) + (count_tokens(self.system) if self.system else 0)
+        if tokens > self.context_window:
+            logger.warning(
+                "Prompt of ~%d tokens exceeds the %d-token context window of %s; "
+                "it may be truncated or rejected. Fit it with ai_service.budget.",
+                tokens,
+                self.context_window,
+                self.resolved_model,
+            )
+
+    def _guarded(self, fn: Callable[[], T]) -> T:
+        """Make one backend attempt through the circuit breaker."""
+        breaker = self.breaker
+        breaker.before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            breaker.record_failure(e)
+            raise
+        breaker.record_success()
+        return result
+
+    async def _aguarded(self, fn: Callable[[], Awaitable[T]]) -> T:
+        breaker = self.breaker
+        await breaker.abefore_call()
+        try:
+            result = await fn()
+        except Exception as e:
+            breaker.record_failure(e)
+            raise
+        breaker.record_success()
+        return result
+
+    def _policy(self, max_retries: Optional[int]) -> RetryPolicy:
+        # An explicit max_retries keeps the old call signature working
+        if max_retries is None:
+            return self.retry_policy
+        return dataclasses.replace(self.retry_policy, max_attempts=max_retries)
+
+    def _record(
+        self,
+        start: float,
+        completion: Optional[Completion] = None,
+        retries: int = 0,
+        error: Optional[BaseException] = None,
+        cached: bool = False,
+        stream_stats: Optional[StreamStats] = None,
+    ):
+        prompt_tokens = completion.prompt_tokens if completion else None
+        completion_tokens = completion.completion_tokens if completion else None
+        load_time = completion.load_time if completion else None
+        if is_cold_start(load_time):
+            logger.info(
+                "Cold start: %s took %.1fs to load. Preload it with "
+                "`python -m ai_service.keep_alive warmup %s`.",
+                self.resolved_model,
+                load_time,
+                self.resolved_model,
+            )
+        record = CallRecord(
+            service_type=self.service_type,
+            model=self.resolved_model,
+            latency=time.perf_counter() - start,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            retries=retries,
+            cost=0.0
+            if cached
+            else estimate_cost(
+                self.service_type, self.resolved_model, prompt_tokens, completion_tokens
+            ),
+            cached=cached,
+            streamed=stream_stats is not None,
+            time_to_first_token=stream_stats.time_to_first_token
+            if stream_stats
+            else None,
+            error=f"{type(error).__name__}: {error}" if error else None,
+            call_site=self.call_site,
+            load_time=load_time,
+            cold_start=is_cold_start(load_time),
+        )
+        self.last_call = record
+        self.metrics.record(record)
+
+    def query(
+        self, prompt: str, max_retries: Optional[int] = None, refresh: bool = False
+    ) -> str:
+        """Query the backend, serving from the cache when enabled.
+
+        `refresh` skips the cache lookup but still stores the new response.
+        """
+        return self._query_cached(prompt, max_retries, refresh, self.coalesce)
+
+    def _query_cached(
+        self,
+        prompt: str,
+        max_retries: Optional[int],
+        refresh: bool,
+        coalesce: bool,
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        if self.cache is None and self.semantic_cache is None and not coalesce:
+            return self._query(prompt, max_retries, schema)
+        key = self.cache_key(prompt, schema)
+        start = time.perf_counter()
+        if self.cache is not None and not refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record(start, cached=True)
+                return cached
+        similar = self._semantic_lookup(prompt, schema, refresh)
+        if similar is not None:
+            self._record(start, cached=True)
+            return similar
+        if coalesce:
+            response = _inflight.do(
+                key, lambda: self._query(prompt, max_retries, schema)
+            )
+        else:
+            response = self._query(prompt, max_retries, schema)
+        if not self._cacheable(response, schema):
+            return response
+        if self.cache is not None:
+            self.cache.set(key, response)
+        self._semantic_store(prompt, schema, response)
+        return response
+
+    def _query(
+        self,
+        prompt: str,
+        max_retries: Optional[int],
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        self._check_prompt_size(prompt)
+        policy = self._policy(max_retries)
+        state = RetryState(policy, self.service_type)
+        start = time.perf_counter()
+        try:
+            completion = run_with_retry(
+                lambda: self._guarded(
+                    lambda: self.backend.complete(
+                        self._request(prompt, schema, state.remaining())
+                    )
+                ),
+                policy,
+                self.service_type,
+                get_rate_limiter(self.service_type),
+                state,
+            )
+        except Exception as e:
+            self._record(start, retries=max(0, state.attempts - 1), error=e)
+            raise
+        self._record(start, completion, retries=state.attempts)
+        return completion.text
+
+    async def aquery(
+        self, prompt: str, max_retries: Optional[int] = None, refresh: bool = False
+    ) -> str:
+        return await self._aquery_cached(prompt, max_retries, refresh, self.coalesce)
+
+    async def _aquery_cached(
+        self,
+        prompt: str,
+        max_retries: Optional[int],
+        refresh: bool,
+        coalesce: bool,
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        if self.cache is None and self.semantic_cache is None and not coalesce:
+            return await self._aquery(prompt, max_retries, schema)
+        key = self.cache_key(prompt, schema)
+        start = time.perf_counter()
+        if self.cache is not None and not refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record(start, cached=True)
+                return cached
+        # Embedding is a blocking HTTP call to Ollama
+        similar = await asyncio.to_thread(self._semantic_lookup, prompt, schema, refresh)
+        if similar is not None:
+            self._record(start, cached=True)
+            return similar
+        if coalesce:
+            response = await _ainflight.do(
+                key, lambda: self._aquery(prompt, max_retries, schema)
+            )
+        else:
+            response = await self._aquery(prompt, max_retries, schema)
+        if not self._cacheable(response, schema):
+            return response
+        if self.cache is not None:
+            self.cache.set(key, response)
+        if self.semantic_cache is not None:
+            await asyncio.to_thread(self._semantic_store, prompt, schema, response)
+        return response
+
+    async def _aquery(
+        self,
+        prompt: str,
+        max_retries: Optional[int],
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        self._check_prompt_size(prompt)
+        policy = self._policy(max_retries)
+        state = RetryState(policy, self.service_type)
+        start = time.perf_counter()
+        try:
+            completion = await arun_with_retry(
+                lambda: self._aguarded(
+                    lambda: self.backend.acomplete(
+                        self._request(prompt, schema, state.remaining())
+                    )
+                ),
+                policy,
+                self.service_type,
+                get_rate_limiter(self.service_type),
+                state,
+            )
+        except Exception as e:
+            self._record(start, retries=max(0, state.attempts - 1), error=e)
+            raise
+        self._record(start, completion, retries=state.attempts)
+        return completion.text
+
+    async def aquery_many(
+        self,
+        prompts: Iterable[str],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: Optional[int] = None,
+    ) -> List[str]:
+        """Run independent prompts concurrently; results are returned in prompt order."""
+        return await gather_bounded(
+            (self.aquery(prompt, max_retries) for prompt in prompts), concurrency
+        )
+
+    def query_many(
+        self,
+        prompts: Iterable[str],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: Optional[int] = None,
+    ) -> List[str]:
+        """Synchronous entry point for aquery_many, for callers without an event loop."""
+        return asyncio.run(self.aquery_many(prompts, concurrency, max_retries))
+
+    async def aquery_batch(
+        self,
+        prompts: Iterable[str],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        pack_size: int = 1,
+        max_pack_chars: int = DEFAULT_MAX_PACK_CHARS,
+        max_retries: Optional[int] = None,
+    ) -> List[str]:
+        """Answer many prompts with as few backend calls as possible, in prompt order.
+
+        Duplicate prompts are sent once and share in-flight calls with other callers.
+        With `pack_size` > 1, prompts of up to `max_pack_chars` characters are packed
+        into combined requests; a pack whose answer cannot be parsed is retried prompt
+        by prompt.
+        """
+        prompts = list(prompts)
+        unique = list(dict.fromkeys(prompts))
+        results: Dict[str, str] = {}
+
+        async def run_single(prompt: str):
+            results[prompt] = await self._aquery_cached(
+                prompt, max_retries, refresh=False, coalesce=True
+            )
+
+        async def run_pack(pack: List[str]):
+            response = await self._aquery(build_packed_prompt(pack), max_retries)
+            answers = parse_packed_response(response, len(pack))
+            if answers is None:
+                await gather_bounded((run_single(prompt) for prompt in pack), concurrency)
+                return
+            for prompt, answer in zip(pack, answers):
+                results[prompt] = answer
+                if self.cache is not None:
+                    self.cache.set(self.cache_key(prompt), answer)
+
+        singles = unique
+        packs: List[List[str]] = []
+        if pack_size > 1:
+            singles, packable = [], []
+            for prompt in unique:
+                cached = (
+                    self.cache.get(self.cache_key(prompt))
+                    if self.cache is not None
+                    else None
+                )
+                if cached is not None:
+                    results[prompt] = cached
+                elif len(prompt) <= max_pack_chars:
+                    packable.append(prompt)
                 else:
-                    raise ValueError(f"Unsupported service type: {self.service_type}")
-            except Exception as e:
-                print(f"Error occurred: {e}. Retrying...")
-        raise Exception(
-            f"Failed to query {self.service_type} after {max_retries} attempts"
+                    singles.append(prompt)
+            packs = [
+                packable[i : i + pack_size] for i in range(0, len(packable), pack_size)
+            ]
+            # A pack of one gains nothing from the packing instructions
+            singles += [pack[0] for pack in packs if len(pack) == 1]
+            packs = [pack for pack in packs if len(pack) > 1]
+
+        await gather_bounded(
+            [run_single(prompt) for prompt in singles]
+            + [run_pack(pack) for pack in packs],
+            concurrency,
         )
+        return [results[prompt] for prompt in prompts]
 
-    def _query_ollama(self, prompt: str) -> str:
-        response = self.client.generate(model=self.model or "llama2", prompt=prompt)
-        return response["response"]
+    def query_batch(
+        self,
+        prompts: Iterable[str],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        pack_size: int = 1,
+        max_pack_chars: int = DEFAULT_MAX_PACK_CHARS,
+        max_retries: Optional[int] = None,
+    ) -> List[str]:
+        """Synchronous entry point for aquery_batch."""
+        return asyncio.run(
+            self.aquery_batch(
+                prompts, concurrency, pack_size, max_pack_chars, max_retries
+            )
+        )
 
-    def _query_groq(self, prompt: str) -> str:
-        completion = self.client.chat.completions.create(
-            model=self.model or "mixtral-8x7b-32768",
-            messages=[{"role": "user", "content": prompt}],
+    def stream(
+        self, prompt: str, max_retries: Optional[int] = None, refresh: bool = False
+    ) -> Iterator[str]:
+        """Yield the completion in chunks as the backend produces them.
+
+        Timing is recorded in `last_stream_stats` once the stream is exhausted.
+        A failed attempt is only retried if nothing has been yielded yet.
+        """
+        return self._stream(prompt, max_retries, refresh)
+
+    def _stream(
+        self,
+        prompt: str,
+        max_retries: Optional[int],
+        refresh: bool,
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        stats = StreamStats(self.service_type, self.resolved_model)
+        key = self.cache_key(prompt, schema) if self.cache is not None else None
+        if not refresh:
+            cached = self.cache.get(key) if key is not None else None
+            if cached is None:
+                cached = self._semantic_lookup(prompt, schema, refresh)
+            if cached is not None:
+                stats.cached = True
+                stats.mark_chunk()
+                stats.finish()
+                self.last_stream_stats = stats
+                self._record(stats.start, cached=True, stream_stats=stats)
+                yield cached
+                return
+
+        self._check_prompt_size(prompt)
+        chunks: List[str] = []
+        state = RetryState(self._policy(max_retries), self.service_type)
+        rate_limiter = get_rate_limiter(self.service_type)
+        breaker = self.breaker
+        while True:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            try:
+                breaker.before_call()
+                for chunk in self.backend.stream(
+                    self._request(prompt, schema, state.remaining()), stats
+                ):
+                    stats.mark_chunk()
+                    chunks.append(chunk)
+                    yield chunk
+                breaker.record_success()
+                break
+            except Exception as e:
+                breaker.record_failure(e)
+                try:
+                    if chunks:
+                        raise
+                    delay = state.next_delay(e)
+                except Exception as final:
+                    self._record(
+                        stats.start,
+                        retries=max(0, state.attempts - 1),
+                        error=final,
+                        stream_stats=stats,
+                    )
+                    raise
+                time.sleep(delay)
+        stats.finish()
+        self.last_stream_stats = stats
+        self._record_stream(stats, state.attempts)
+        response = "".join(chunks)
+        if not self._cacheable(response, schema):
+            return
+        if key is not None:
+            self.cache.set(key, response)
+        self._semantic_store(prompt, schema, response)
+
+    def astream(
+        self, prompt: str, max_retries: Optional[int] = None, refresh: bool = False
+    ) -> AsyncIterator[str]:
+        return self._astream(prompt, max_retries, refresh)
+
+    async def _astream(
+        self,
+        prompt: str,
+        max_retries: Optional[int],
+        refresh: bool,
+        schema: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        stats = StreamStats(self.service_type, self.resolved_model)
+        key = self.cache_key(prompt, schema) if self.cache is not None else None
+        if not refresh:
+            cached = self.cache.get(key) if key is not None else None
+            if cached is None and self.semantic_cache is not None:
+                cached = await asyncio.to_thread(
+                    self._semantic_lookup, prompt, schema, refresh
+                )
+            if cached is not None:
+                stats.cached = True
+                stats.mark_chunk()
+                stats.finish()
+                self.last_stream_stats = stats
+                self._record(stats.start, cached=True, stream_stats=stats)
+                yield cached
+                return
+
+        self._check_prompt_size(prompt)
+        chunks: List[str] = []
+        state = RetryState(self._policy(max_retries), self.service_type)
+        rate_limiter = get_rate_limiter(self.service_type)
+        breaker = self.breaker
+        while True:
+            if rate_limiter is not None:
+                await rate_limiter.aacquire()
+            try:
+                await breaker.abefore_call()
+                async for chunk in self.backend.astream(
+                    self._request(prompt, schema, state.remaining()), stats
+                ):
+                    stats.mark_chunk()
+                    chunks.append(chunk)
+                    yield chunk
+                breaker.record_success()
+                break
+            except Exception as e:
+                breaker.record_failure(e)
+                try:
+                    if chunks:
+                        raise
+                    delay = state.next_delay(e)
+                except Exception as final:
+                    self._record(
+                        stats.start,
+                        retries=max(0, state.attempts - 1),
+                        error=final,
+                        stream_stats=stats,
+                    )
+                    raise
+                await asyncio.sleep(delay)
+        stats.finish()
+        self.last_stream_stats = stats
+        self._record_stream(stats, state.attempts)
+        response = "".join(chunks)
+        if not self._cacheable(response, schema):
+            return
+        if key is not None:
+            self.cache.set(key, response)
+        if self.semantic_cache is not None:
+            await asyncio.to_thread(self._semantic_store, prompt, schema, response)
+
+    @staticmethod
+    def _object_schema(schema) -> Dict[str, Any]:
+        json_schema = as_json_schema(schema)
+        # Anthropic tool inputs and the JSON modes of Ollama and Groq are objects
+        if json_schema.get("type") != "object":
+            raise ValueError("Structured output needs a schema of type 'object'")
+        return json_schema
+
+    def query_structured(
+        self,
+        prompt: str,
+        schema,
+        max_retries: Optional[int] = None,
+        refresh: bool = False,
+    ) -> Any:
+        """Query in the backend's JSON/tool mode and return the validated answer.
+
+        `schema` is a JSON Schema dict for an object or a pydantic model class, in which
+        case a model instance is returned. Validation is local: an invalid answer raises
+        StructuredOutputError, with the raw text, instead of spending another request.
+        """
+        text = self._query_cached(
+            prompt, max_retries, refresh, self.coalesce, self._object_schema(schema)
         )
-        return completion.choices[0].message.content
+        return parse_structured(text, schema)
+
+    async def aquery_structured(
+        self,
+        prompt: str,
+        schema,
+        max_retries: Optional[int] = None,
+        refresh: bool = False,
+    ) -> Any:
+        text = await self._aquery_cached(
+            prompt, max_retries, refresh, self.coalesce, self._object_schema(schema)
+        )
+        return parse_structured(text, schema)
+
+    def stream_structured(
+        self,
+        prompt: str,
+        schema,
+        max_retries: Optional[int] = None,
+        refresh: bool = False,
+    ) -> Iterator[Any]:
+        """Yield the partial answer each time it grows, then the validated answer.
+
+        Partial values are plain dicts holding every field received so far; the last
+        item is the same as query_structured would return.
+        """
+        parser = IncrementalJSONParser()
+        chunks: List[str] = []
+        last = None
+        for chunk in self._stream(prompt, max_retries, refresh, self._object_schema(schema)):
+            chunks.append(chunk)
+            value = parser.feed(chunk)
+            if value is not None and value != last:
+                last = value
+                yield value
+        yield parse_structured("".join(chunks), schema)
+
+    async def astream_structured(
+        self,
+        prompt: str,
+        schema,
+        max_retries: Optional[int] = None,
+        refresh: bool = False,
+    ) -> AsyncIterator[Any]:
+        parser = IncrementalJSONParser()
+        chunks: List[str] = []
+        last = None
+        async for chunk in self._astream(
+            prompt, max_retries, refresh, self._object_schema(schema)
+        ):
+            chunks.append(chunk)
+            value = parser.feed(chunk)
+            if value is not None and value != last:
+                last = value
+                yield value
+        yield parse_structured("".join(chunks), schema)
 
-    def _query_anthropic(self, prompt: str) -> str:
-        completion = self.client.completions.create(
-            model=self.model or "claude-3-5-sonnet-20240620",
-            prompt=prompt,
-            max_tokens_to_sample=1000,
+    def _record_stream(self, stats: StreamStats, retries: int):
+        completion = Completion(
+            "", stats.prompt_tokens, stats.completion_tokens, stats.load_time
         )
-        return completion.completion
+        self._record(stats.start, completion, retries=retries, stream_stats=stats)
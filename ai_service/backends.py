@@ -0,0 +1,432 @@
+import concurrent.futures
+import importlib
+import json
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Type,
+)
+
+from ai_service.clients import get_async_client, get_client
+from ai_service.keep_alive import get_keep_alive, load_seconds
+from ai_service.lazy import lazy_import
+from ai_service.structured import schema_instructions
+
+asyncio = lazy_import("asyncio")
+
+
+@dataclass
+class Completion:
+    """A backend response with the token usage it reported."""
+
+    text: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    # Seconds the backend spent loading the model for this request (Ollama only)
+    load_time: Optional[float] = None
+
+
+@dataclass
+class Request:
+    """Everything a backend needs to produce one completion."""
+
+    prompt: str
+    model: Optional[str]
+    system: Optional[str] = None
+    # Sampling parameters shared by all backends: "temperature" and "max_tokens"
+    options: Dict[str, Any] = field(default_factory=dict)
+    # JSON Schema the answer must match; backends use their JSON or tool mode for it
+    schema: Optional[Dict[str, Any]] = None
+    # Seconds this attempt may take, so one hung call can't outlive the retry deadline
+    timeout: Optional[float] = None
+
+    @property
+    def prompt_with_schema(self) -> str:
+        """The prompt, plus the schema for backends that cannot be given it directly."""
+        if self.schema is None:
+            return self.prompt
+        return self.prompt + schema_instructions(self.schema)
+
+
+class Backend:
+    """Transport for one service type.
+
+    Subclasses implement `complete`; the async and streaming methods fall back to it,
+    so a minimal backend only needs one method. Streaming backends report token usage
+    by setting `prompt_tokens`, `completion_tokens` and `load_time` on `stats`.
+    """
+
+    default_model: Optional[str] = None
+
+    def __init__(
+        self,
+        service_type: str,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ):
+        self.service_type = service_type
+        self.api_key = api_key
+        self.base_url = base_url
+
+    @property
+    def client(self):
+        # Clients come from the process-wide registry, so constructing a backend
+        # per call site is cheap and reuses pooled keep-alive connections.
+        return get_client(self.service_type, self.api_key, self.base_url)
+
+    def async_client(self):
+        return get_async_client(self.service_type, self.api_key, self.base_url)
+
+    def complete(self, request: Request) -> Completion:
+        raise NotImplementedError
+
+    # A cheap call that raises while the service is down, run before the trial request
+    # of a half-open circuit breaker. None: the trial request itself is the probe.
+    health_check: Optional[Callable[[], None]] = None
+
+    async def acomplete(self, request: Request) -> Completion:
+        return await asyncio.to_thread(self.complete, request)
+
+    def stream(self, request: Request, stats) -> Iterator[str]:
+        completion = self.complete(request)
+        _set_usage(stats, completion)
+        yield completion.text
+
+    async def astream(self, request: Request, stats) -> AsyncIterator[str]:
+        completion = await self.acomplete(request)
+        _set_usage(stats, completion)
+        yield completion.text
+
+
+def _set_usage(stats, completion: Completion):
+    stats.prompt_tokens = completion.prompt_tokens
+    stats.completion_tokens = completion.completion_tokens
+    stats.load_time = completion.load_time
+
+
+def run_in_daemon_thread(fn: Callable[[], Any]) -> concurrent.futures.Future:
+    """Run `fn` in a daemon thread and return a future for its result.
+
+    Calls that are given up on cannot be cancelled; daemon threads let them finish in
+    the background without holding up interpreter exit the way executor threads would.
+    """
+    future: concurrent.futures.Future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def _deadline(timeout: Optional[float]) -> Optional[float]:
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def _time_left(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def _timed_out(request: Request) -> TimeoutError:
+    return TimeoutError(f"no response within {request.timeout:.1f}s")
+
+
+def _chat_messages(request: Request) -> List[Dict[str, str]]:
+    messages = []
+    if request.system:
+        messages.append({"role": "system", "content": request.system})
+    messages.append({"role": "user", "content": request.prompt_with_schema})
+    return messages
+
+
+class OllamaBackend(Backend):
+    default_model = "llama2"
+
+    def kwargs(self, request: Request) -> Dict[str, Any]:
+        kwargs = {
+            "model": request.model,
+            "prompt": request.prompt_with_schema,
+            "keep_alive": get_keep_alive(request.model),
+        }
+        if request.system:
+            kwargs["system"] = request.system
+        if request.schema is not None:
+            kwargs["format"] = "json"
+        options = {}
+        if "temperature" in request.options:
+            options["temperature"] = request.options["temperature"]
+        if "max_tokens" in request.options:
+            options["num_predict"] = request.options["max_tokens"]
+        if options:
+            kwargs["options"] = options
+        return kwargs
+
+    @staticmethod
+    def completion(response) -> Completion:
+        return Completion(
+            response["response"],
+            response.get("prompt_eval_count"),
+            response.get("eval_count"),
+            load_seconds(response),
+        )
+
+    @staticmethod
+    def _stream_part(part, stats) -> Optional[str]:
+        if part.get("done"):
+            stats.prompt_tokens = part.get("prompt_eval_count")
+            stats.completion_tokens = part.get("eval_count")
+            stats.load_time = load_seconds(part)
+        return part.get("response")
+
+    def health_check(self):
+        self.client.list()
+
+    # The Ollama clients take a timeout only when they are created, and are shared, so
+    # request.timeout is enforced by waiting at most that long for each call instead.
+
+    def complete(self, request: Request) -> Completion:
+        if request.timeout is None:
+            return self.completion(self.client.generate(**self.kwargs(request)))
+        future = run_in_daemon_thread(lambda: self.client.generate(**self.kwargs(request)))
+        try:
+            return self.completion(future.result(timeout=request.timeout))
+        except concurrent.futures.TimeoutError:
+            raise _timed_out(request) from None
+
+    async def acomplete(self, request: Request) -> Completion:
+        try:
+            response = await asyncio.wait_for(
+                self.async_client().generate(**self.kwargs(request)), request.timeout
+            )
+        except asyncio.TimeoutError:
+            raise _timed_out(request) from None
+        return self.completion(response)
+
+    def stream(self, request: Request, stats) -> Iterator[str]:
+        if request.timeout is None:
+            parts = self.client.generate(**self.kwargs(request), stream=True)
+        else:
+            parts = self._stream_parts(request)
+        for part in parts:
+            text = self._stream_part(part, stats)
+            if text:
+                yield text
+
+    def _stream_parts(self, request: Request) -> Iterator[Any]:
+        # Parts are read in a daemon thread, so a stalled stream can be given up on
+        deadline = _deadline(request.timeout)
+        parts: "queue.Queue[tuple]" = queue.Queue()
+
+        def read():
+            try:
+                for part in self.client.generate(**self.kwargs(request), stream=True):
+                    parts.put((part, None))
+                parts.put((None, None))
+            except BaseException as e:
+                parts.put((None, e))
+
+        threading.Thread(target=read, daemon=True).start()
+        while True:
+            try:
+                part, error = parts.get(timeout=_time_left(deadline))
+            except queue.Empty:
+                raise _timed_out(request) from None
+            if error is not None:
+                raise error
+            if part is None:
+                return
+            yield part
+
+    async def astream(self, request: Request, stats) -> AsyncIterator[str]:
+        deadline = _deadline(request.timeout)
+        try:
+            parts = await asyncio.wait_for(
+                self.async_client().generate(**self.kwargs(request), stream=True),
+                _time_left(deadline),
+            )
+            parts = parts.__aiter__()
+            while True:
+                try:
+                    part = await asyncio.wait_for(parts.__anext__(), _time_left(deadline))
+                except StopAsyncIteration:
+                    return
+                text = self._stream_part(part, stats)
+                if text:
+                    yield text
+        except asyncio.TimeoutError:
+            raise _timed_out(request) from None
+
+
+class GroqBackend(Backend):
+    default_model = "mixtral-8x7b-32768"
+
+    def kwargs(self, request: Request, stream: bool = False) -> Dict[str, Any]:
+        kwargs = {"model": request.model, "messages": _chat_messages(request)}
+        for name in ("temperature", "max_tokens"):
+            if name in request.options:
+                kwargs[name] = request.options[name]
+        # Groq's JSON mode can't be streamed; streams rely on the prompt instructions
+        if request.schema is not None and not stream:
+            kwargs["response_format"] = {"type": "json_object"}
+        if request.timeout is not None:
+            kwargs["timeout"] = request.timeout
+        return kwargs
+
+    @staticmethod
+    def completion(completion) -> Completion:
+        usage = completion.usage
+        return Completion(
+            completion.choices[0].message.content,
+            usage.prompt_tokens if usage else None,
+            usage.completion_tokens if usage else None,
+        )
+
+    @staticmethod
+    def _stream_chunk(chunk, stats) -> Optional[str]:
+        usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+        if usage is not None:
+            stats.prompt_tokens = usage.prompt_tokens
+            stats.completion_tokens = usage.completion_tokens
+        return chunk.choices[0].delta.content if chunk.choices else None
+
+    def health_check(self):
+        self.client.models.list()
+
+    def complete(self, request: Request) -> Completion:
+        return self.completion(
+            self.client.chat.completions.create(**self.kwargs(request))
+        )
+
+    async def acomplete(self, request: Request) -> Completion:
+        completion = await self.async_client().chat.completions.create(
+            **self.kwargs(request)
+        )
+        return self.completion(completion)
+
+    def stream(self, request: Request, stats) -> Iterator[str]:
+        for chunk in self.client.chat.completions.create(
+            **self.kwargs(request, stream=True), stream=True
+        ):
+            text = self._stream_chunk(chunk, stats)
+            if text:
+                yield text
+
+    async def astream(self, request: Request, stats) -> AsyncIterator[str]:
+        async for chunk in await self.async_client().chat.completions.create(
+            **self.kwargs(request, stream=True), stream=True
+        ):
+            text = self._stream_chunk(chunk, stats)
+            if text:
+                yield text
+
+
+class AnthropicBackend(Backend):
+    default_model = "claude-3-5-sonnet-20240620"
+    # Structured answers are requested as a forced call of this tool
+    TOOL_NAME = "respond"
+
+    def kwargs(self, request: Request) -> Dict[str, Any]:
+        kwargs = {
+            "model": request.model,
+            "messages": [{"role": "user", "content": request.prompt}],
+            "max_tokens": request.options.get("max_tokens", 1000),
+        }
+        if request.system:
+            kwargs["system"] = request.system
+        if "temperature" in request.options:
+            kwargs["temperature"] = request.options["temperature"]
+        if request.timeout is not None:
+            kwargs["timeout"] = request.timeout
+        if request.schema is not None:
+            kwargs["tools"] = [
+                {
+                    "name": self.TOOL_NAME,
+                    "description": "Respond with the requested structured answer.",
+                    "input_schema": request.schema,
+                }
+            ]
+            kwargs["tool_choice"] = {"type": "tool", "name": self.TOOL_NAME}
+        return kwargs
+
+    @staticmethod
+    def completion(message) -> Completion:
+        block = message.content[0]
+        text = json.dumps(block.input) if block.type == "tool_use" else block.text
+        return Completion(text, message.usage.input_tokens, message.usage.output_tokens)
+
+    @staticmethod
+    def _stream_event(event, request: Request) -> Optional[str]:
+        if event.type != "content_block_delta":
+            return None
+        if request.schema is not None:
+            return getattr(event.delta, "partial_json", None)
+        return getattr(event.delta, "text", None)
+
+    def complete(self, request: Request) -> Completion:
+        return self.completion(self.client.messages.create(**self.kwargs(request)))
+
+    async def acomplete(self, request: Request) -> Completion:
+        message = await self.async_client().messages.create(**self.kwargs(request))
+        return self.completion(message)
+
+    def stream(self, request: Request, stats) -> Iterator[str]:
+        with self.client.messages.stream(**self.kwargs(request)) as stream:
+            for event in stream:
+                text = self._stream_event(event, request)
+                if text:
+                    yield text
+            usage = stream.get_final_message().usage
+            stats.prompt_tokens = usage.input_tokens
+            stats.completion_tokens = usage.output_tokens
+
+    async def astream(self, request: Request, stats) -> AsyncIterator[str]:
+        async with self.async_client().messages.stream(**self.kwargs(request)) as stream:
+            async for event in stream:
+                text = self._stream_event(event, request)
+                if text:
+                    yield text
+            message = await stream.get_final_message()
+            stats.prompt_tokens = message.usage.input_tokens
+            stats.completion_tokens = message.usage.output_tokens
+
+
+_backends: Dict[str, Type[Backend]] = {
+    "ollama": OllamaBackend,
+    "groq": GroqBackend,
+    "anthropic": AnthropicBackend,
+}
+# Backends in their own modules, which register themselves when first imported
+_lazy_backends = {"mock": "ai_service.mock"}
+
+
+def register_backend(service_type: str, backend: Type[Backend]):
+    """Make `AIService(service_type)` use `backend`; replaces any existing registration."""
+    _backends[service_type.lower()] = backend
+
+
+def get_backend(service_type: str) -> Type[Backend]:
+    service_type = service_type.lower()
+    if service_type not in _backends and service_type in _lazy_backends:
+        importlib.import_module(_lazy_backends[service_type])
+    try:
+        return _backends[service_type]
+    except KeyError:
+        raise ValueError(f"Unsupported service type: {service_type}") from None
+
+
+def registered_backends() -> List[str]:
+    return sorted(set(_backends) | set(_lazy_backends))
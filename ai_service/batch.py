@@ -0,0 +1,109 @@
+import json
+import re
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from ai_service.lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+T = TypeVar("T")
+
+DEFAULT_MAX_PACK_CHARS = 2000
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls sharing a key into one execution (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight; calls are only shared within one event loop."""
+
+    def __init__(self):
+        self._calls: Dict[Tuple[int, str], asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        future = self._calls.get(call_key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._calls[call_key] = loop.create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark as retrieved so a leader without followers doesn't log a warning
+            future.exception()
+            raise
+        finally:
+            del self._calls[call_key]
+
+
+def build_packed_prompt(prompts: List[str]) -> str:
+    """Combine several small independent prompts into one request."""
+    parts = [
+        f"Answer each of the following {len(prompts)} prompts independently.",
+        'Respond with only a JSON object of the form {"answers": ["...", "..."]}, '
+        f"where the answers array has exactly {len(prompts)} strings and element N "
+        "is the complete answer to prompt N. Do not add any other text.",
+    ]
+    for i, prompt in enumerate(prompts, 1):
+        parts.append(f"Prompt {i}:\n{prompt}")
+    return "\n\n".join(parts)
+
+
+def parse_packed_response(response: str, expected: int) -> Optional[List[str]]:
+    """Extract the answers from a packed response, or None if it is malformed."""
+    match = re.search(r"\{.*\}", response, re.DOTALL)
+    if not match:
+        return None
+    try:
+        answers = json.loads(match.group(0)).get("answers")
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    if (
+        not isinstance(answers, list)
+        or len(answers) != expected
+        or not all(isinstance(answer, str) for answer in answers)
+    ):
+        return None
+    return answers
@@ -0,0 +1,153 @@
+import math
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Rough characters per token for English text and code when no tokenizer is installed
+CHARS_PER_TOKEN = 4
+DEFAULT_CONTEXT_WINDOW = 4096
+# Ollama serves every model with this context length unless the server is configured
+# otherwise, silently dropping the start of longer prompts
+OLLAMA_CONTEXT_LENGTH = int(os.environ.get("OLLAMA_CONTEXT_LENGTH", "2048"))
+DEFAULT_RESERVED_OUTPUT = 1000
+
+# Context windows in tokens; matched on the model name without an Ollama ":tag"
+CONTEXT_WINDOWS: Dict[str, int] = {
+    "llama2": 4096,
+    "llama3": 8192,
+    "llama3.1": 131072,
+    "llama-3.1-70b-versatile": 131072,
+    "llama-3.1-8b-instant": 131072,
+    "mixtral-8x7b-32768": 32768,
+    "gemma2-9b-it": 8192,
+    "claude-3-5-sonnet-20240620": 200000,
+    "claude-3-opus-20240229": 200000,
+    "claude-3-haiku-20240307": 200000,
+}
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken's cl100k_base if tiktoken is installed, else None.
+
+    No backend here uses that exact vocabulary, but it is much closer than a
+    character ratio for code and non-English text.
+    """
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except ImportError:
+                _encoding = False
+        return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` to at most `max_tokens`, at a line boundary when one is close."""
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens])
+    else:
+        if len(text) <= max_tokens * CHARS_PER_TOKEN:
+            return text
+        cut = text[: max_tokens * CHARS_PER_TOKEN]
+    newline = cut.rfind("\n")
+    # Don't throw away more than a fifth of the allowance to end on a full line
+    return cut[: newline + 1] if newline >= len(cut) * 0.8 else cut
+
+
+def context_window(service_type: Optional[str], model: Optional[str]) -> int:
+    window = CONTEXT_WINDOWS.get((model or "").split(":")[0], DEFAULT_CONTEXT_WINDOW)
+    if service_type == "ollama":
+        return min(window, OLLAMA_CONTEXT_LENGTH)
+    return window
+
+
+def prompt_budget(
+    service_type: Optional[str],
+    model: Optional[str],
+    reserved_output: int = DEFAULT_RESERVED_OUTPUT,
+) -> int:
+    """Tokens available for the prompt once room is left for the response."""
+    return max(0, context_window(service_type, model) - reserved_output)
+
+
+@dataclass
+class Section:
+    """One part of a prompt; higher-priority sections get their tokens first."""
+
+    name: str
+    text: str
+    priority: int = 0
+    # Drop the section rather than keep less than this many tokens of it
+    min_tokens: int = 1
+
+
+@dataclass
+class FitResult:
+    sections: Dict[str, str]
+    tokens: int
+    budget: int
+    # name -> (original tokens, kept tokens) for every shortened or dropped section
+    truncated: Dict[str, Tuple[int, int]] = field(default_factory=dict)
+
+    @property
+    def was_truncated(self) -> bool:
+        return bool(self.truncated)
+
+    def join(self, names: Optional[Sequence[str]] = None, separator: str = "\n\n") -> str:
+        """Concatenate the kept sections, in input order unless `names` is given."""
+        names = list(self.sections) if names is None else names
+        return separator.join(self.sections[name] for name in names if self.sections.get(name))
+
+    def report(self) -> List[str]:
+        return [
+            f"{name}: kept {kept} of {original} tokens"
+            for name, (original, kept) in self.truncated.items()
+        ]
+
+
+def fit_sections(sections: Sequence[Section], budget: int) -> FitResult:
+    """Fit sections into `budget` tokens, shortening the lowest-priority ones first.
+
+    Sections of equal priority are filled in input order. The result keeps the input
+    order, so callers can join it straight into a prompt.
+    """
+    remaining = budget
+    kept: Dict[str, str] = {}
+    truncated: Dict[str, Tuple[int, int]] = {}
+    for section in sorted(sections, key=lambda s: -s.priority):
+        tokens = count_tokens(section.text)
+        if tokens <= remaining:
+            kept[section.name] = section.text
+            remaining -= tokens
+            continue
+        if remaining >= section.min_tokens:
+            text = truncate_to_tokens(section.text, remaining)
+            used = count_tokens(text)
+            kept[section.name] = text
+            remaining -= used
+            truncated[section.name] = (tokens, used)
+        else:
+            kept[section.name] = ""
+            truncated[section.name] = (tokens, 0)
+    ordered = {section.name: kept[section.name] for section in sections}
+    return FitResult(ordered, budget - remaining, budget, truncated)
@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from ai_service.cache import default_cache_dir
+from ai_service.lazy import lazy_import
+from ai_service.retry import CONNECTION, SERVER_ERROR, TIMEOUT, classify_error
+
+asyncio = lazy_import("asyncio")
+
+logger = logging.getLogger("ai_service")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Consecutive outage errors that open a circuit, and seconds it stays open
+DEFAULT_FAILURE_THRESHOLD = int(os.environ.get("AI_SERVICE_CIRCUIT_THRESHOLD", "5"))
+DEFAULT_RECOVERY_TIMEOUT = float(os.environ.get("AI_SERVICE_CIRCUIT_RECOVERY", "30"))
+# Only errors that say the service is down count; a 4xx or 429 means it answered
+OUTAGE_KINDS = {SERVER_ERROR, TIMEOUT, CONNECTION}
+
+
+def default_circuit_file() -> str:
+    return os.environ.get("AI_SERVICE_CIRCUIT_FILE") or os.path.join(
+        default_cache_dir(), "circuits.json"
+    )
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit is open.
+
+    It is not retryable, so a query fails in milliseconds and an AIRouter moves
+    straight on to its next backend.
+    """
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(
+            f"Circuit for {name} is open; not calling it for another {retry_in:.1f}s"
+        )
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker for one backend, shared by every caller of it.
+
+    After `failure_threshold` consecutive outage errors the circuit opens and calls
+    fail fast for `recovery_timeout` seconds. Then it is half-open: one caller runs
+    the health `probe` (if any) and its own request as a trial, while the others
+    keep failing fast; the trial's outcome closes or re-opens the circuit.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        recovery_timeout: float = DEFAULT_RECOVERY_TIMEOUT,
+        probe: Optional[Callable[[], None]] = None,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        # Wall-clock time, so the state can be shared with later processes
+        self.opened_at: Optional[float] = None
+        self._trial_started: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def retry_in(self) -> float:
+        """Seconds until an open circuit lets a trial call through."""
+        if self.state != OPEN or self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.recovery_timeout - time.time())
+
+    def _claim(self) -> bool:
+        """Let the call through; True when it is the half-open trial."""
+        with self._lock:
+            if not self.enabled or self.state == CLOSED:
+                return False
+            now = time.time()
+            if self.state == OPEN:
+                remaining = self.retry_in()
+                if remaining > 0:
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = HALF_OPEN
+            # A trial abandoned without an outcome (e.g. a stream that was never
+            # consumed) must not hold the circuit half-open forever
+            if (
+                self._trial_started is not None
+                and now - self._trial_started < self.recovery_timeout
+            ):
+                raise CircuitOpenError(self.name, 0.0)
+            self._trial_started = now
+            return True
+
+    def _probe_failed(self, exc: Exception):
+        self.record_failure(exc)
+        if self.state == OPEN:
+            raise CircuitOpenError(self.name, self.retry_in()) from exc
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may be sent to the backend now."""
+        if self._claim() and self.probe is not None:
+            try:
+                self.probe()
+            except Exception as e:
+                self._probe_failed(e)
+
+    async def abefore_call(self):
+        if self._claim() and self.probe is not None:
+            try:
+                await asyncio.to_thread(self.probe)
+            except Exception as e:
+                self._probe_failed(e)
+
+    def record_success(self):
+        with self._lock:
+            if self.state == CLOSED and self.failures == 0:
+                return
+            if self.state != CLOSED:
+                logger.info("Circuit for %s closed; backend recovered", self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._trial_started = None
+        _persist(self)
+
+    def record_failure(self, exc: BaseException):
+        """Count an outage error; any other error shows the backend is answering."""
+        if isinstance(exc, CircuitOpenError):
+            return
+        if classify_error(exc) not in OUTAGE_KINDS:
+            self.record_success()
+            return
+        with self._lock:
+            self.failures += 1
+            self._trial_started = None
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED
+                and self.enabled
+                and self.failures >= self.failure_threshold
+            ):
+                logger.warning(
+                    "Circuit for %s opened after %d consecutive failures (%s); "
+                    "failing fast for %gs",
+                    self.name,
+                    self.failures,
+                    exc,
+                    self.recovery_timeout,
+                )
+                self.state = OPEN
+                self.opened_at = time.time()
+        _persist(self)
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._trial_started = None
+        _persist(self)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"state": self.state, "failures": self.failures, "opened_at": self.opened_at}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_circuit_file: Optional[str] = os.environ.get("AI_SERVICE_CIRCUIT_FILE") or None
+_file_lock = threading.Lock()
+
+
+def _read_states(path: str) -> Dict[str, Dict[str, object]]:
+    try:
+        with open(path) as f:
+            states = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return states if isinstance(states, dict) else {}
+
+
+def _persist(breaker: CircuitBreaker):
+    path = _circuit_file
+    if path is None:
+        return
+    # Read-modify-write, so breakers of other backends (and other processes) are kept
+    with _file_lock:
+        states = _read_states(path)
+        states[breaker.name] = breaker.to_dict()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(states, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.debug("Could not save circuit state to %s: %s", path, e)
+
+
+def _restore(breaker: CircuitBreaker):
+    if _circuit_file is None:
+        return
+    state = _read_states(_circuit_file).get(breaker.name)
+    if not isinstance(state, dict) or state.get("state") not in (CLOSED, OPEN, HALF_OPEN):
+        return
+    breaker.failures = int(state.get("failures") or 0)
+    if state["state"] != CLOSED and state.get("opened_at") is not None:
+        # A half-open trial from a process that has exited is re-run here
+        breaker.state = OPEN
+        breaker.opened_at = float(state["opened_at"])
+
+
+def persist_circuits(path: Optional[str] = None):
+    """Share breaker states with later runs through a JSON file.
+
+    Defaults to AI_SERVICE_CIRCUIT_FILE or circuits.json in the cache directory, so a
+    CLI started during an outage fails fast instead of rediscovering it.
+    """
+    global _circuit_file
+    with _breakers_lock:
+        _circuit_file = path or default_circuit_file()
+        for breaker in _breakers.values():
+            _restore(breaker)
+
+
+def get_breaker(
+    name: str, probe: Optional[Callable[[], None]] = None
+) -> CircuitBreaker:
+    """Breaker shared by all AIService instances talking to the backend `name`."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, probe=probe)
+            _restore(breaker)
+        elif breaker.probe is None:
+            breaker.probe = probe
+        return breaker
+
+
+def configure_breaker(
+    name: str,
+    failure_threshold: Optional[int] = None,
+    recovery_timeout: Optional[float] = None,
+) -> CircuitBreaker:
+    """Change the thresholds for one backend; a threshold of 0 disables its breaker."""
+    breaker = get_breaker(name)
+    if failure_threshold is not None:
+        breaker.failure_threshold = failure_threshold
+    if recovery_timeout is not None:
+        breaker.recovery_timeout = recovery_timeout
+    return breaker
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Show or reset the circuit breaker states shared by CLI runs."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("status", help="List persisted circuit states")
+    reset_parser = subparsers.add_parser("reset", help="Close circuits")
+    reset_parser.add_argument(
+        "names", nargs="*", help="Backends to reset, e.g. groq (default: all)"
+    )
+    parser.add_argument(
+        "--file", help="State file (default: AI_SERVICE_CIRCUIT_FILE or the cache dir)"
+    )
+    args = parser.parse_args()
+
+    path = args.file or default_circuit_file()
+    states = _read_states(path)
+    if args.command == "status":
+        if not states:
+            print("No circuit state recorded.")
+        for name, state in sorted(states.items()):
+            line = f"{name}: {state.get('state')} ({state.get('failures', 0)} failures)"
+            if state.get("state") == OPEN and state.get("opened_at"):
+                remaining = float(state["opened_at"]) + DEFAULT_RECOVERY_TIMEOUT - time.time()
+                if remaining > 0:
+                    line += f", trial call in {remaining:.0f}s"
+            print(line)
+    elif args.command == "reset":
+        persist_circuits(path)
+        for name in args.names or list(states):
+            get_breaker(name).reset()
+            print(f"{name}: closed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import hashlib
+import importlib
+import os
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+from ai_service.lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+DEFAULT_MAX_CONNECTIONS = int(os.environ.get("AI_SERVICE_MAX_CONNECTIONS", "20"))
+DEFAULT_MAX_KEEPALIVE = int(os.environ.get("AI_SERVICE_MAX_KEEPALIVE", "10"))
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+API_KEY_ENV = {
+    "groq": "GROQ_API_KEY",
+    "anthropic": "ANTHROPIC_API_KEY",
+}
+BASE_URL_ENV = {
+    "ollama": "OLLAMA_BASE_URL",
+    "groq": "GROQ_BASE_URL",
+    "anthropic": "ANTHROPIC_BASE_URL",
+}
+
+
+def import_sdk(name: str):
+    """Import a backend SDK on first use, so only the backend in use pays its import."""
+    try:
+        return importlib.import_module(name)
+    except ImportError as e:
+        raise ImportError(
+            f"The '{name}' package is required for this backend: pip install {name}"
+        ) from e
+
+
+class ClientRegistry:
+    """Process-wide pool of SDK clients keyed on (service, api key, base URL).
+
+    Every client is built on a shared-limits httpx connection pool, so keep-alive
+    connections and TLS sessions are reused by all AIService instances in the process.
+    Async clients are additionally tied to the event loop they were created on, and
+    are dropped together with it.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+    ):
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str, Optional[str]], Any] = {}
+        # loop -> key -> client. asyncio.run and worker threads each bring a new loop,
+        # and a loop's clients (and their connection pools) go when the loop does.
+        self._async_clients: "weakref.WeakKeyDictionary[Any, Dict[Any, Any]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.configure(max_connections, max_keepalive_connections, keepalive_expiry)
+
+    def configure(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+    ):
+        """Set pool sizes; applies to clients created after the call."""
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+
+    def _limits(self):
+        return import_sdk("httpx").Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _resolve(
+        self, service_type: str, api_key: Optional[str], base_url: Optional[str]
+    ) -> Tuple[Tuple[str, str, Optional[str]], Optional[str], Optional[str]]:
+        service_type = service_type.lower()
+        if api_key is None and service_type in API_KEY_ENV:
+            api_key = os.environ.get(API_KEY_ENV[service_type])
+        if base_url is None and service_type in BASE_URL_ENV:
+            base_url = os.environ.get(BASE_URL_ENV[service_type])
+        # Never keep raw API keys in the registry key
+        key_digest = hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+        return (service_type, key_digest, base_url), api_key, base_url
+
+    def get(
+        self,
+        service_type: str,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ):
+        key, api_key, base_url = self._resolve(service_type, api_key, base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._create(key[0], api_key, base_url)
+                self._clients[key] = client
+            return client
+
+    def get_async(
+        self,
+        service_type: str,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ):
+        """Return an async client for the running event loop."""
+        loop = asyncio.get_running_loop()
+        key, api_key, base_url = self._resolve(service_type, api_key, base_url)
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                client = clients[key] = self._create_async(key[0], api_key, base_url)
+            return client
+
+    def _create(self, service_type: str, api_key: Optional[str], base_url: Optional[str]):
+        if service_type == "groq":
+            return import_sdk("groq").Groq(
+                api_key=api_key,
+                base_url=base_url,
+                # RetryPolicy retries; SDK retries underneath would multiply attempts
+                max_retries=0,
+                http_client=import_sdk("httpx").Client(limits=self._limits()),
+            )
+        elif service_type == "anthropic":
+            return import_sdk("anthropic").Anthropic(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=import_sdk("httpx").Client(limits=self._limits()),
+            )
+        elif service_type == "ollama":
+            return import_sdk("ollama").Client(host=base_url, limits=self._limits())
+        raise ValueError(f"Unsupported service type: {service_type}")
+
+    def _create_async(
+        self, service_type: str, api_key: Optional[str], base_url: Optional[str]
+    ):
+        if service_type == "groq":
+            return import_sdk("groq").AsyncGroq(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=import_sdk("httpx").AsyncClient(limits=self._limits()),
+            )
+        elif service_type == "anthropic":
+            return import_sdk("anthropic").AsyncAnthropic(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=import_sdk("httpx").AsyncClient(limits=self._limits()),
+            )
+        elif service_type == "ollama":
+            return import_sdk("ollama").AsyncClient(host=base_url, limits=self._limits())
+        raise ValueError(f"Unsupported service type: {service_type}")
+
+    def close(self):
+        """Close pooled sync clients; async clients are dropped with their loops."""
+        with self._lock:
+            for client in self._clients.values():
+                close = getattr(client, "close", None)
+                if close is not None:
+                    close()
+                elif hasattr(client, "_client"):
+                    client._client.close()
+            self._clients.clear()
+            self._async_clients.clear()
+
+
+default_registry = ClientRegistry()
+
+
+def get_client(
+    service_type: str, api_key: Optional[str] = None, base_url: Optional[str] = None
+):
+    return default_registry.get(service_type, api_key, base_url)
+
+
+def get_async_client(
+    service_type: str, api_key: Optional[str] = None, base_url: Optional[str] = None
+):
+    return default_registry.get_async(service_type, api_key, base_url)
+
+
+def configure_pool(
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE,
+    keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+):
+    default_registry.configure(
+        max_connections, max_keepalive_connections, keepalive_expiry
+    )
@@ -0,0 +1,133 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Set, Tuple
+
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_budget.json")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Interactive entry points whose startup we care about
+MODULES = ["ai_service.ai_service", "ai_cli.ai_cli", "ai_commit.ai_commit"]
+# Backend SDKs must only be imported when a backend is first used
+LAZY_MODULES = ["anthropic", "groq", "ollama", "httpx"]
+DEFAULT_RUNS = 7
+HEADROOM = 1.5
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(module: str) -> Tuple[int, Set[str]]:
+    """Import `module` in a fresh interpreter; returns its cumulative import time (us)
+    and the names of all top-level packages that got imported."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    cumulative, imported = None, set()
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        imported.add(name.split(".")[0])
+        if name == module:
+            cumulative = int(match.group(2))
+    if cumulative is None:
+        raise RuntimeError(f"No import time reported for {module}")
+    return cumulative, imported
+
+
+def measure_median(module: str, runs: int = DEFAULT_RUNS) -> Tuple[int, Set[str]]:
+    times, imported = [], set()
+    for _ in range(runs):
+        cumulative, names = measure(module)
+        times.append(cumulative)
+        imported |= names
+    return int(statistics.median(times)), imported
+
+
+def load_budget(path: str = BUDGET_FILE) -> Dict[str, int]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def check(
+    modules: List[str] = MODULES, runs: int = DEFAULT_RUNS, path: str = BUDGET_FILE
+) -> List[str]:
+    """Measure every module against its budget; returns a list of failures."""
+    budget = load_budget(path)
+    failures = []
+    for module in modules:
+        median, imported = measure_median(module, runs)
+        eager = sorted(imported.intersection(LAZY_MODULES))
+        limit = budget.get(module)
+        status = "no budget" if limit is None else f"budget {limit / 1000:.1f}ms"
+        print(f"{module}: {median / 1000:.1f}ms ({status})")
+        if eager:
+            failures.append(f"{module} eagerly imports {', '.join(eager)}")
+        if limit is not None and median > limit:
+            failures.append(
+                f"{module} took {median / 1000:.1f}ms, over its {limit / 1000:.1f}ms budget"
+            )
+    return failures
+
+
+def update(
+    modules: List[str] = MODULES,
+    runs: int = DEFAULT_RUNS,
+    path: str = BUDGET_FILE,
+    headroom: float = HEADROOM,
+):
+    """Re-measure and write budgets with headroom for noisy machines."""
+    budget = load_budget(path)
+    for module in modules:
+        median, _ = measure_median(module, runs)
+        budget[module] = int(median * headroom)
+        print(f"{module}: {median / 1000:.1f}ms -> budget {budget[module] / 1000:.1f}ms")
+    with open(path, "w") as f:
+        json.dump(budget, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Check the import time of ai_service and the CLIs against a tracked budget."
+    )
+    parser.add_argument(
+        "modules", nargs="*", default=MODULES, help="Modules to measure (default: the CLIs)"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=DEFAULT_RUNS,
+        help=f"Fresh interpreters per module; the median is used (default: {DEFAULT_RUNS})",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help=f"Write the measured medians times {HEADROOM} to {os.path.basename(BUDGET_FILE)}",
+    )
+    args = parser.parse_args()
+
+    if args.update:
+        update(args.modules, args.runs)
+        return
+    failures = check(args.modules, args.runs)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
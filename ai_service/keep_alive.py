@@ -0,0 +1,117 @@
+import os
+import threading
+from typing import Dict, List, Optional, Union
+
+from ai_service.clients import get_client
+
+KeepAlive = Union[str, int, float]
+
+# How long Ollama keeps a model in memory after a request; Ollama's own default is 5m,
+# short enough that interactive tools keep paying the model load between invocations
+DEFAULT_KEEP_ALIVE: KeepAlive = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+# A load longer than this means the request had to bring the model into memory
+COLD_START_THRESHOLD = 0.5
+
+_keep_alive: Dict[str, KeepAlive] = {}
+_keep_alive_lock = threading.Lock()
+
+
+def _parse_model_overrides(value: str) -> Dict[str, str]:
+    """Parse OLLAMA_KEEP_ALIVE_MODELS, e.g. "llama3.1=1h,codestral=10m"."""
+    overrides = {}
+    for item in value.split(","):
+        model, _, keep_alive = item.partition("=")
+        if model.strip() and keep_alive.strip():
+            overrides[model.strip()] = keep_alive.strip()
+    return overrides
+
+
+_keep_alive.update(_parse_model_overrides(os.environ.get("OLLAMA_KEEP_ALIVE_MODELS", "")))
+
+
+def set_keep_alive(model: str, keep_alive: Optional[KeepAlive]):
+    """Set the keep-alive for one model (None restores the default)."""
+    with _keep_alive_lock:
+        if keep_alive is None:
+            _keep_alive.pop(model, None)
+        else:
+            _keep_alive[model] = keep_alive
+
+
+def get_keep_alive(model: str) -> KeepAlive:
+    with _keep_alive_lock:
+        return _keep_alive.get(model, DEFAULT_KEEP_ALIVE)
+
+
+def load_seconds(response) -> Optional[float]:
+    """Model load time reported by Ollama (nanoseconds in the response)."""
+    load_duration = response.get("load_duration")
+    return load_duration / 1e9 if load_duration is not None else None
+
+
+def is_cold_start(load_time: Optional[float]) -> bool:
+    return load_time is not None and load_time >= COLD_START_THRESHOLD
+
+
+def warm_up(
+    model: str, keep_alive: Optional[KeepAlive] = None, base_url: Optional[str] = None
+) -> Optional[float]:
+    """Load a model into memory without generating; returns the load time in seconds."""
+    response = get_client("ollama", base_url=base_url).generate(
+        model=model,
+        prompt="",
+        keep_alive=keep_alive if keep_alive is not None else get_keep_alive(model),
+    )
+    return load_seconds(response)
+
+
+def unload(model: str, base_url: Optional[str] = None):
+    get_client("ollama", base_url=base_url).generate(model=model, prompt="", keep_alive=0)
+
+
+def loaded_models(base_url: Optional[str] = None) -> List[Dict]:
+    """Models currently held in memory by the Ollama server."""
+    return list(get_client("ollama", base_url=base_url).ps().get("models", []))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Preload, inspect and unload Ollama models used by AIService."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    warmup_parser = subparsers.add_parser("warmup", help="Load models into memory")
+    warmup_parser.add_argument("models", nargs="+", help="Models to load")
+    warmup_parser.add_argument(
+        "--keep-alive",
+        help=f"How long to keep the models loaded, e.g. 1h or -1 for ever (default: {DEFAULT_KEEP_ALIVE})",
+    )
+    subparsers.add_parser("status", help="List loaded models")
+    unload_parser = subparsers.add_parser("unload", help="Evict models from memory")
+    unload_parser.add_argument("models", nargs="+", help="Models to unload")
+    parser.add_argument("--base-url", help="Ollama server URL (default: OLLAMA_HOST)")
+    args = parser.parse_args()
+
+    if args.command == "warmup":
+        keep_alive = args.keep_alive
+        if keep_alive is not None and keep_alive.lstrip("-").isdigit():
+            keep_alive = int(keep_alive)
+        for model in args.models:
+            load_time = warm_up(model, keep_alive, args.base_url)
+            state = "loaded" if is_cold_start(load_time) else "already warm"
+            print(f"{model}: {state} ({load_time or 0:.2f}s)")
+    elif args.command == "status":
+        models = loaded_models(args.base_url)
+        if not models:
+            print("No models loaded.")
+        for model in models:
+            print(f"{model.get('name')}: expires {model.get('expires_at')}")
+    elif args.command == "unload":
+        for model in args.models:
+            unload(model, args.base_url)
+            print(f"{model}: unloaded")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import importlib
+
+
+class _LazyModule:
+    """Stand-in for a module, importing it when an attribute is first accessed."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        module = self._module
+        if module is None:
+            # import_module holds the import lock, so concurrent first uses are safe
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}>"
+
+
+def lazy_import(name: str):
+    """Return a module whose import is deferred until an attribute is first accessed.
+
+    Used for heavy standard-library modules (asyncio alone is ~45ms) that only some
+    code paths need, keeping `import ai_service.ai_service` cheap for the CLIs. The
+    deferral is local to the caller: sys.modules only ever holds the real module, so
+    other importers are unaffected.
+    """
+    return _LazyModule(name)
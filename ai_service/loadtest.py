@@ -0,0 +1,240 @@
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field, fields
+from typing import Dict, List, Optional, Sequence
+
+from ai_service.ai_service import AIService
+from ai_service.cache import ResponseCache
+from ai_service.lazy import lazy_import
+from ai_service.metrics import MetricsRecorder
+from ai_service.retry import RetryPolicy
+
+asyncio = lazy_import("asyncio")
+
+DEFAULT_QPS = 10.0
+DEFAULT_DURATION = 10.0
+DEFAULT_MAX_INFLIGHT = 256
+
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile, matching LatencyTracker.percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+@dataclass
+class LoadTestResult:
+    target_qps: float
+    requests: int
+    succeeded: int
+    failed: int
+    elapsed: float
+    p50: Optional[float]
+    p95: Optional[float]
+    p99: Optional[float]
+    retries: int
+    cache_hits: int
+    # Requests that could not start on schedule because max_inflight was reached
+    delayed: int = 0
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def throughput(self) -> float:
+        """Successful requests per second over the whole run."""
+        return self.succeeded / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, object]:
+        return {**asdict(self), "throughput": self.throughput}
+
+
+async def arun_load_test(
+    service: AIService,
+    prompts: Sequence[str],
+    qps: float = DEFAULT_QPS,
+    duration: float = DEFAULT_DURATION,
+    max_inflight: int = DEFAULT_MAX_INFLIGHT,
+    stream: bool = False,
+) -> LoadTestResult:
+    """Send `prompts` round-robin at a fixed arrival rate (open loop) for `duration` seconds.
+
+    Arrivals don't wait for earlier requests to finish, so queueing shows up in the
+    latency percentiles instead of silently lowering the offered load.
+    """
+    metrics = MetricsRecorder()
+    service.metrics = metrics
+    semaphore = asyncio.Semaphore(max(1, max_inflight))
+    latencies: List[float] = []
+    errors: Counter = Counter()
+    delayed = 0
+
+    async def send(prompt: str):
+        start = time.perf_counter()
+        try:
+            if stream:
+                async for _ in service.astream(prompt):
+                    pass
+            else:
+                await service.aquery(prompt)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        else:
+            latencies.append(time.perf_counter() - start)
+        finally:
+            semaphore.release()
+
+    total = max(1, int(qps * duration))
+    tasks = []
+    start = time.perf_counter()
+    for i in range(total):
+        wait = start + i / qps - time.perf_counter()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if semaphore.locked():
+            delayed += 1
+        await semaphore.acquire()
+        tasks.append(asyncio.ensure_future(send(prompts[i % len(prompts)])))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    records = list(metrics.records)
+    return LoadTestResult(
+        target_qps=qps,
+        requests=total,
+        succeeded=len(latencies),
+        failed=sum(errors.values()),
+        elapsed=elapsed,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+        retries=sum(record.retries for record in records),
+        cache_hits=sum(1 for record in records if record.cached),
+        delayed=delayed,
+        errors=dict(errors),
+    )
+
+
+def run_load_test(
+    service: AIService,
+    prompts: Sequence[str],
+    qps: float = DEFAULT_QPS,
+    duration: float = DEFAULT_DURATION,
+    max_inflight: int = DEFAULT_MAX_INFLIGHT,
+    stream: bool = False,
+) -> LoadTestResult:
+    return asyncio.run(
+        arun_load_test(service, prompts, qps, duration, max_inflight, stream)
+    )
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}ms"
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Drive AIService at a target request rate and report latency percentiles."
+    )
+    parser.add_argument(
+        "--service", default="mock", help="Service type to load (default: mock, no API calls)"
+    )
+    parser.add_argument("--model", help="Model to use (default: the service's default)")
+    parser.add_argument(
+        "--qps", type=float, default=DEFAULT_QPS, help=f"Target requests per second (default: {DEFAULT_QPS})"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=DEFAULT_DURATION,
+        help=f"Seconds to send requests for (default: {DEFAULT_DURATION})",
+    )
+    parser.add_argument(
+        "--max-inflight",
+        type=int,
+        default=DEFAULT_MAX_INFLIGHT,
+        help=f"Upper bound on concurrent requests (default: {DEFAULT_MAX_INFLIGHT})",
+    )
+    parser.add_argument(
+        "--unique-prompts",
+        type=int,
+        default=0,
+        help="Cycle through this many distinct prompts (default: every request is unique)",
+    )
+    parser.add_argument("--prompts", help="File with one prompt per line to cycle through")
+    parser.add_argument("--stream", action="store_true", help="Use astream instead of aquery")
+    parser.add_argument("--cache", action="store_true", help="Enable the response cache")
+    parser.add_argument("--coalesce", action="store_true", help="Share in-flight identical requests")
+    parser.add_argument("--max-retries", type=int, help="Attempts per request (default: the retry policy's)")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    mock = parser.add_argument_group("mock backend")
+    mock.add_argument("--latency", type=float, help="Median time to first token in seconds")
+    mock.add_argument("--latency-sigma", type=float, help="Log-normal spread of the latency")
+    mock.add_argument("--tokens-per-second", type=float, help="Generation speed")
+    mock.add_argument("--completion-tokens", type=int, help="Tokens per response")
+    mock.add_argument("--error-rate", type=float, help="Fraction of calls failing with a 500")
+    mock.add_argument("--rate-limit-rate", type=float, help="Fraction of calls failing with a 429")
+    mock.add_argument("--retry-after", type=float, help="Retry-After seconds sent with 429s")
+    mock.add_argument("--seed", type=int, help="Seed for latencies, outputs and injected errors")
+    args = parser.parse_args()
+
+    if args.service == "mock":
+        from ai_service.mock import MockConfig, configure_mock
+
+        settings = {
+            f.name: getattr(args, f.name)
+            for f in fields(MockConfig)
+            if getattr(args, f.name) is not None
+        }
+        configure_mock(**settings)
+
+    if args.prompts:
+        with open(args.prompts) as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    else:
+        count = args.unique_prompts or max(1, int(args.qps * args.duration))
+        prompts = [f"Load test prompt {i}" for i in range(count)]
+
+    retry_policy = None
+    if args.max_retries is not None:
+        retry_policy = RetryPolicy(max_attempts=args.max_retries)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # A fresh cache per run, so hits only come from repeats within the run
+        cache = ResponseCache(os.path.join(cache_dir, "cache.sqlite")) if args.cache else None
+        service = AIService(
+            args.service,
+            args.model,
+            cache=cache,
+            retry_policy=retry_policy,
+            coalesce=args.coalesce,
+        )
+        result = run_load_test(
+            service, prompts, args.qps, args.duration, args.max_inflight, args.stream
+        )
+        if cache is not None:
+            cache.close()
+
+    if args.json:
+        print(json.dumps(result.to_dict()))
+        return
+    print(f"Target: {result.target_qps:g} req/s for {args.duration:g}s ({result.requests} requests)")
+    print(f"Throughput: {result.throughput:.1f} req/s over {result.elapsed:.1f}s")
+    print(
+        f"Latency: p50={_format_seconds(result.p50)} p95={_format_seconds(result.p95)} "
+        f"p99={_format_seconds(result.p99)}"
+    )
+    print(
+        f"Succeeded: {result.succeeded} Failed: {result.failed} Retries: {result.retries} "
+        f"Cache hits: {result.cache_hits} Delayed starts: {result.delayed}"
+    )
+    for name, count in sorted(result.errors.items()):
+        print(f"  {name}: {count}")
+
+
+if __name__ == "__main__":
+    main()
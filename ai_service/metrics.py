@@ -0,0 +1,259 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+# USD per million (input, output) tokens; local Ollama models and the mock backend
+# cost nothing per call
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "llama-3.1-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    "mixtral-8x7b-32768": (0.24, 0.24),
+    "gemma2-9b-it": (0.20, 0.20),
+    "claude-3-5-sonnet-20240620": (3.00, 15.00),
+    "claude-3-opus-20240229": (15.00, 75.00),
+    "claude-3-haiku-20240307": (0.25, 1.25),
+}
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+MAX_RECORDS = 10_000
+
+
+def estimate_cost(
+    service_type: str,
+    model: Optional[str],
+    prompt_tokens: Optional[int],
+    completion_tokens: Optional[int],
+) -> Optional[float]:
+    if service_type in ("ollama", "mock"):
+        return 0.0
+    prices = MODEL_PRICES.get(model or "")
+    if prices is None or prompt_tokens is None or completion_tokens is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+@dataclass
+class CallRecord:
+    service_type: str
+    model: Optional[str]
+    latency: float
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    retries: int = 0
+    cost: Optional[float] = None
+    cached: bool = False
+    streamed: bool = False
+    time_to_first_token: Optional[float] = None
+    error: Optional[str] = None
+    call_site: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+    # Ollama model load time; a cold start means the model was not in memory
+    load_time: Optional[float] = None
+    cold_start: bool = False
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        if not self.completion_tokens:
+            return None
+        generation = self.latency - (self.time_to_first_token or 0.0)
+        return self.completion_tokens / generation if generation > 0 else None
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self) -> List[int]:
+        total, result = 0, []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+@dataclass
+class _Series:
+    latency: Histogram = field(default_factory=Histogram)
+    calls: int = 0
+    errors: int = 0
+    cache_hits: int = 0
+    retries: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    cold_starts: int = 0
+
+
+def _label(value: Optional[str]) -> str:
+    return (value or "").replace("\\", "\\\\").replace('"', '\\"')
+
+
+class MetricsRecorder:
+    """Collects a CallRecord per AIService call and aggregates it per (call site, service, model).
+
+    Hooks are called with every record; if `jsonl_path` is set, records are also
+    appended to that file as they happen.
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None):
+        self.jsonl_path = jsonl_path
+        self.records: Deque[CallRecord] = deque(maxlen=MAX_RECORDS)
+        self._series: Dict[Tuple[str, str, str], _Series] = {}
+        self._hooks: List[Callable[[CallRecord], None]] = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[CallRecord], None]):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[CallRecord], None]):
+        self._hooks.remove(hook)
+
+    def record(self, record: CallRecord):
+        with self._lock:
+            self.records.append(record)
+            key = (record.call_site or "", record.service_type, record.model or "")
+            series = self._series.setdefault(key, _Series())
+            series.calls += 1
+            series.latency.observe(record.latency)
+            series.retries += record.retries
+            series.prompt_tokens += record.prompt_tokens or 0
+            series.completion_tokens += record.completion_tokens or 0
+            series.cost += record.cost or 0.0
+            if record.error:
+                series.errors += 1
+            if record.cached:
+                series.cache_hits += 1
+            if record.cold_start:
+                series.cold_starts += 1
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a") as f:
+                    f.write(json.dumps(asdict(record)) + "\n")
+        for hook in list(self._hooks):
+            hook(record)
+
+    def export_jsonl(self, path: str):
+        with self._lock:
+            records = list(self.records)
+        with open(path, "a") as f:
+            for record in records:
+                f.write(json.dumps(asdict(record)) + "\n")
+
+    def to_prometheus(self) -> str:
+        """Render the aggregates in the Prometheus text exposition format."""
+        lines = [
+            "# HELP ai_service_request_duration_seconds Latency of AIService calls.",
+            "# TYPE ai_service_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+        for (site, service, model), s in series:
+            labels = f'call_site="{_label(site)}",service="{_label(service)}",model="{_label(model)}"'
+            for bound, count in zip(s.latency.buckets, s.latency.cumulative()):
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f'ai_service_request_duration_seconds_bucket{{{labels},le="{le}"}} {count}'
+                )
+            lines.append(f"ai_service_request_duration_seconds_sum{{{labels}}} {s.latency.sum}")
+            lines.append(f"ai_service_request_duration_seconds_count{{{labels}}} {s.latency.count}")
+        counters = [
+            ("ai_service_requests_total", "Calls, including cache hits.", "calls"),
+            ("ai_service_errors_total", "Calls that raised.", "errors"),
+            ("ai_service_cache_hits_total", "Calls served from the cache.", "cache_hits"),
+            ("ai_service_retries_total", "Retried attempts.", "retries"),
+            ("ai_service_prompt_tokens_total", "Prompt tokens reported by backends.", "prompt_tokens"),
+            ("ai_service_completion_tokens_total", "Completion tokens reported by backends.", "completion_tokens"),
+            ("ai_service_cost_usd_total", "Estimated cost in USD.", "cost"),
+            ("ai_service_cold_starts_total", "Calls that had to load the model.", "cold_starts"),
+        ]
+        for name, help_text, attribute in counters:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (site, service, model), s in series:
+                labels = f'call_site="{_label(site)}",service="{_label(service)}",model="{_label(model)}"'
+                lines.append(f"{name}{{{labels}}} {getattr(s, attribute)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> List[Dict[str, object]]:
+        """Per-series totals, most expensive first then slowest."""
+        with self._lock:
+            series = list(self._series.items())
+        rows = []
+        for (site, service, model), s in series:
+            rows.append(
+                {
+                    "call_site": site,
+                    "service": service,
+                    "model": model,
+                    "calls": s.calls,
+                    "errors": s.errors,
+                    "cache_hits": s.cache_hits,
+                    "retries": s.retries,
+                    "mean_latency": s.latency.sum / s.latency.count if s.latency.count else 0.0,
+                    "prompt_tokens": s.prompt_tokens,
+                    "completion_tokens": s.completion_tokens,
+                    "cost": s.cost,
+                    "cold_starts": s.cold_starts,
+                }
+            )
+        return sorted(rows, key=lambda row: (-row["cost"], -row["mean_latency"]))
+
+
+default_recorder = MetricsRecorder(os.environ.get("AI_SERVICE_METRICS_FILE"))
+
+
+def load_jsonl(path: str) -> MetricsRecorder:
+    recorder = MetricsRecorder()
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                recorder.record(CallRecord(**json.loads(line)))
+    return recorder
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Summarize AIService metrics recorded with AI_SERVICE_METRICS_FILE."
+    )
+    parser.add_argument("path", help="JSON lines file written by AIService")
+    parser.add_argument(
+        "--format",
+        choices=["summary", "prometheus"],
+        default="summary",
+        help="Output format (default: summary)",
+    )
+    args = parser.parse_args()
+
+    recorder = load_jsonl(args.path)
+    if args.format == "prometheus":
+        sys.stdout.write(recorder.to_prometheus())
+        return
+    for row in recorder.summary():
+        print(
+            f"{row['call_site'] or '-'} {row['service']}:{row['model']} "
+            f"calls={row['calls']} errors={row['errors']} cache_hits={row['cache_hits']} "
+            f"retries={row['retries']} mean_latency={row['mean_latency']:.2f}s "
+            f"tokens={row['prompt_tokens']}+{row['completion_tokens']} cost=${row['cost']:.4f} "
+            f"cold_starts={row['cold_starts']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, fields, replace
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from ai_service.backends import Backend, Completion, Request, register_backend
+from ai_service.lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+
+
+class MockError(Exception):
+    """An injected failure; carries a status code so it is classified like an SDK error."""
+
+    def __init__(self, status_code: int, retry_after: Optional[float] = None):
+        super().__init__(f"Mock backend error {status_code}")
+        self.status_code = status_code
+        self.headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+
+
+@dataclass
+class MockConfig:
+    # Median time to first token in seconds; samples are log-normal around it
+    latency: float = 0.2
+    # Log-normal shape; 0 makes every call take exactly `latency`
+    latency_sigma: float = 0.5
+    tokens_per_second: float = 100.0
+    completion_tokens: int = 50
+    # Fraction of calls failing with a 500 / with a 429
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    # Retry-After sent with injected 429s, in seconds
+    retry_after: Optional[float] = None
+    seed: int = 0
+
+
+def _parse_config(value: str) -> Dict[str, object]:
+    """Parse AI_SERVICE_MOCK, e.g. "latency=0.5,error_rate=0.05,seed=1"."""
+    types = {f.name: f.type for f in fields(MockConfig)}
+    overrides = {}
+    for item in value.split(","):
+        name, _, setting = item.partition("=")
+        name, setting = name.strip(), setting.strip()
+        if name in types and setting:
+            overrides[name] = int(setting) if types[name] is int else float(setting)
+    return overrides
+
+
+_config = MockConfig(**_parse_config(os.environ.get("AI_SERVICE_MOCK", "")))
+_config_lock = threading.Lock()
+_occurrences: Dict[str, int] = {}
+
+
+def configure_mock(**settings) -> MockConfig:
+    """Change the behaviour of every mock backend in the process; returns the new config."""
+    global _config
+    with _config_lock:
+        _config = replace(_config, **settings)
+        _occurrences.clear()
+        return _config
+
+
+def get_mock_config() -> MockConfig:
+    return _config
+
+
+def _example(schema: Dict[str, Any], words: Iterator[str]) -> Any:
+    """A value matching the common JSON Schema keywords, with strings drawn from `words`."""
+    if "const" in schema:
+        return schema["const"]
+    if schema.get("enum"):
+        return schema["enum"][0]
+    kind = schema.get("type", "string")
+    kind = kind[0] if isinstance(kind, list) else kind
+    if kind == "object":
+        return {
+            name: _example(item, words)
+            for name, item in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        count = max(schema.get("minItems", 1), 1)
+        if "maxItems" in schema:
+            count = min(count, schema["maxItems"])
+        return [_example(schema.get("items", {}), words) for _ in range(count)]
+    if kind in ("integer", "number"):
+        return schema.get("minimum", 0)
+    if kind == "boolean":
+        return True
+    if kind == "null":
+        return None
+    return " ".join(next(words) for _ in range(max(1, schema.get("minLength", 3) // 6)))
+
+
+@dataclass
+class _Plan:
+    first_token_delay: float
+    token_interval: float
+    words: List[str]
+    prompt_tokens: int
+    error: Optional[MockError] = None
+
+
+class MockBackend(Backend):
+    """Local stand-in for a real backend, for benchmarks and tests that must not spend quota.
+
+    Latency, output and injected errors are derived from the seed, the prompt and how
+    many times that prompt has been sent, so a run is reproducible regardless of how
+    concurrent calls are scheduled.
+    """
+
+    default_model = "mock"
+
+    def _plan(self, request: Request) -> _Plan:
+        with _config_lock:
+            config = _config
+            occurrence = _occurrences.get(request.prompt, 0)
+            _occurrences[request.prompt] = occurrence + 1
+        digest = hashlib.sha256(
+            f"{config.seed}:{occurrence}:{request.prompt}".encode()
+        ).digest()
+        rng = random.Random(digest)
+        delay = config.latency * (
+            rng.lognormvariate(0, config.latency_sigma) if config.latency_sigma > 0 else 1
+        )
+        roll = rng.random()
+        error = None
+        if roll < config.rate_limit_rate:
+            error = MockError(429, config.retry_after)
+        elif roll < config.rate_limit_rate + config.error_rate:
+            error = MockError(500)
+        count = min(
+            config.completion_tokens,
+            request.options.get("max_tokens", config.completion_tokens),
+        )
+        words = [rng.choice(WORDS) for _ in range(count)]
+        if request.schema is not None:
+            # Answer in valid JSON, streamed in word-sized pieces like free text
+            text = json.dumps(_example(request.schema, iter(words + WORDS * count)))
+            words = text.split(" ")
+        interval = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        return _Plan(delay, interval, words, max(1, len(request.prompt) // 4), error)
+
+    @staticmethod
+    def _completion(plan: _Plan) -> Completion:
+        return Completion(" ".join(plan.words), plan.prompt_tokens, len(plan.words))
+
+    def complete(self, request: Request) -> Completion:
+        plan = self._plan(request)
+        time.sleep(plan.first_token_delay)
+        if plan.error is not None:
+            raise plan.error
+        time.sleep(plan.token_interval * len(plan.words))
+        return self._completion(plan)
+
+    async def acomplete(self, request: Request) -> Completion:
+        plan = self._plan(request)
+        await asyncio.sleep(plan.first_token_delay)
+        if plan.error is not None:
+            raise plan.error
+        await asyncio.sleep(plan.token_interval * len(plan.words))
+        return self._completion(plan)
+
+    @staticmethod
+    def _chunks(plan: _Plan) -> Iterator[Tuple[float, str]]:
+        for i, word in enumerate(plan.words):
+            yield (0.0 if i == 0 else plan.token_interval), (word if i == 0 else " " + word)
+
+    def stream(self, request: Request, stats) -> Iterator[str]:
+        plan = self._plan(request)
+        time.sleep(plan.first_token_delay)
+        if plan.error is not None:
+            raise plan.error
+        for delay, chunk in self._chunks(plan):
+            time.sleep(delay)
+            yield chunk
+        stats.prompt_tokens = plan.prompt_tokens
+        stats.completion_tokens = len(plan.words)
+
+    async def astream(self, request: Request, stats) -> AsyncIterator[str]:
+        plan = self._plan(request)
+        await asyncio.sleep(plan.first_token_delay)
+        if plan.error is not None:
+            raise plan.error
+        for delay, chunk in self._chunks(plan):
+            await asyncio.sleep(delay)
+            yield chunk
+        stats.prompt_tokens = plan.prompt_tokens
+        stats.completion_tokens = len(plan.words)
+
+
+register_backend("mock", MockBackend)
@@ -0,0 +1,275 @@
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from ai_service.lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+logger = logging.getLogger("ai_service")
+
+T = TypeVar("T")
+
+RATE_LIMITED = "rate_limited"
+SERVER_ERROR = "server_error"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+FATAL = "fatal"
+
+RETRYABLE_KINDS = {RATE_LIMITED, SERVER_ERROR, TIMEOUT, CONNECTION}
+# Status codes that are worth retrying besides 429 and 5xx
+RETRYABLE_STATUS = {408, 409, 425}
+
+
+class RetryError(Exception):
+    """Raised when every attempt allowed by the retry policy has failed."""
+
+    def __init__(self, message: str, attempts: int, last_error: BaseException):
+        super().__init__(message)
+        self.attempts = attempts
+        self.last_error = last_error
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(exc: BaseException) -> str:
+    """Map SDK/HTTP exceptions from any backend onto a small set of error kinds."""
+    status = _status_code(exc)
+    if status == 429:
+        return RATE_LIMITED
+    if status is not None and (status >= 500 or status in RETRYABLE_STATUS):
+        return SERVER_ERROR
+    if status is not None:
+        # Remaining 4xx: auth, validation, unknown model... retrying will not help
+        return FATAL
+    # The SDKs wrap httpx errors in their own types, so match on names through the MRO
+    names = [cls.__name__ for cls in type(exc).__mro__]
+    if isinstance(exc, TimeoutError) or any("Timeout" in name for name in names):
+        return TIMEOUT
+    if isinstance(exc, ConnectionError) or any(
+        name in ("ConnectError", "APIConnectionError", "RemoteProtocolError", "NetworkError")
+        for name in names
+    ):
+        return CONNECTION
+    return FATAL
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait, from Retry-After(-Ms) headers."""
+    headers = getattr(exc, "headers", None) or getattr(
+        getattr(exc, "response", None), "headers", None
+    )
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        import email.utils
+
+        try:
+            parsed = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            # A malformed header must not replace the API error being classified
+            return None
+        if parsed is None:
+            return None
+        return max(0.0, parsed.timestamp() - time.time())
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by a per-call deadline.
+
+    Any object with the same attributes and `is_retryable` / `delay` methods can be
+    passed to AIService in its place.
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    multiplier: float = 2.0
+    jitter: bool = True
+    # Total seconds a single query may spend across attempts and waits; None = unbounded
+    deadline: Optional[float] = 120.0
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        return classify_error(exc) in RETRYABLE_KINDS
+
+    def delay(self, attempt: int, exc: BaseException) -> float:
+        """Seconds to wait after the given (1-based) failed attempt."""
+        server_delay = retry_after(exc)
+        if server_delay is not None:
+            return server_delay
+        backoff = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return random.uniform(0, backoff) if self.jitter else backoff
+
+
+class TokenBucket:
+    """Client-side rate limiter: `rate` requests per second with bursts of `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Take tokens now and return how long the caller must wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 1.0):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+_rate_limiters: Dict[str, Optional[TokenBucket]] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def _bucket_for_rpm(
+    requests_per_minute: float, burst: Optional[float] = None
+) -> TokenBucket:
+    # Default burst: six seconds' worth of requests, and at least one
+    if burst is None:
+        burst = max(1.0, requests_per_minute / 10)
+    return TokenBucket(requests_per_minute / 60, burst)
+
+
+def set_rate_limit(
+    service_type: str, requests_per_minute: Optional[float], burst: Optional[float] = None
+):
+    """Configure (or with None, remove) the process-wide limiter for a service."""
+    with _rate_limiters_lock:
+        _rate_limiters[service_type] = (
+            None
+            if requests_per_minute is None
+            else _bucket_for_rpm(requests_per_minute, burst)
+        )
+
+
+def get_rate_limiter(service_type: str) -> Optional[TokenBucket]:
+    """Limiter shared by all AIService instances of a service, seeded from AI_SERVICE_RPM_<SERVICE>."""
+    with _rate_limiters_lock:
+        if service_type not in _rate_limiters:
+            rpm = os.environ.get(f"AI_SERVICE_RPM_{service_type.upper()}")
+            _rate_limiters[service_type] = _bucket_for_rpm(float(rpm)) if rpm else None
+        return _rate_limiters[service_type]
+
+
+class RetryState:
+    """Tracks attempts and the deadline for one call under a policy."""
+
+    def __init__(self, policy: RetryPolicy, description: str):
+        self.policy = policy
+        self.description = description
+        self.attempts = 0
+        self.start = time.monotonic()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, the most one attempt may take."""
+        if self.policy.deadline is None:
+            return None
+        return max(0.0, self.policy.deadline - (time.monotonic() - self.start))
+
+    def next_delay(self, exc: BaseException) -> float:
+        """Record a failed attempt; return the wait before the next one or raise."""
+        self.attempts += 1
+        kind = classify_error(exc)
+        if not self.policy.is_retryable(exc):
+            raise exc
+        if self.attempts >= self.policy.max_attempts:
+            raise RetryError(
+                f"Failed to query {self.description} after {self.attempts} attempts: {exc}",
+                self.attempts,
+                exc,
+            ) from exc
+        delay = self.policy.delay(self.attempts, exc)
+        if self.policy.deadline is not None:
+            remaining = self.policy.deadline - (time.monotonic() - self.start)
+            if delay >= remaining:
+                raise RetryError(
+                    f"Deadline of {self.policy.deadline:.0f}s exceeded querying "
+                    f"{self.description} after {self.attempts} attempts: {exc}",
+                    self.attempts,
+                    exc,
+                ) from exc
+        logger.warning(
+            "%s error from %s (%s). Retrying in %.1f seconds...",
+            kind,
+            self.description,
+            exc,
+            delay,
+        )
+        return delay
+
+
+def run_with_retry(
+    fn: Callable[[], T],
+    policy: RetryPolicy,
+    description: str,
+    rate_limiter: Optional[TokenBucket] = None,
+    state: Optional[RetryState] = None,
+) -> T:
+    """Call `fn` under the policy, pacing every attempt through the rate limiter.
+
+    Pass a `state` to inspect the number of attempts afterwards.
+    """
+    state = state or RetryState(policy, description)
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return fn()
+        except Exception as e:
+            time.sleep(state.next_delay(e))
+
+
+async def arun_with_retry(
+    fn: Callable[[], Awaitable[T]],
+    policy: RetryPolicy,
+    description: str,
+    rate_limiter: Optional[TokenBucket] = None,
+    state: Optional[RetryState] = None,
+) -> T:
+    state = state or RetryState(policy, description)
+    while True:
+        if rate_limiter is not None:
+            await rate_limiter.aacquire()
+        try:
+            return await fn()
+        except Exception as e:
+            await asyncio.sleep(state.next_delay(e))
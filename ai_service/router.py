@@ -0,0 +1,303 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence
+
+from ai_service.ai_service import AIService
+from ai_service.backends import run_in_daemon_thread
+from ai_service.circuit import OPEN
+
+logger = logging.getLogger("ai_service")
+
+FALLBACK = "fallback"
+HEDGE = "hedge"
+
+DEFAULT_HEDGE_DELAY = 2.0
+DEFAULT_WINDOW = 100
+MIN_SAMPLES = 5
+
+
+class RouterError(Exception):
+    """Raised when every backend behind an AIRouter failed."""
+
+    def __init__(self, errors: Dict[str, BaseException]):
+        details = "; ".join(f"{name}: {error}" for name, error in errors.items())
+        super().__init__(f"All backends failed ({details})")
+        self.errors = errors
+
+
+class LatencyTracker:
+    """Rolling window of successful-call latencies and recent failures for one backend."""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._latencies: Deque[float] = deque(maxlen=window)
+        # Whether each of the last `window` calls failed
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.successes = 0
+        self.failures = 0
+
+    def record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+            self._outcomes.append(False)
+            self.successes += 1
+
+    def record_failure(self):
+        with self._lock:
+            self._outcomes.append(True)
+            self.failures += 1
+
+    @property
+    def samples(self) -> int:
+        return len(self._latencies)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self._latencies:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def failure_rate(self) -> float:
+        """Share of the last `window` calls that failed."""
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return sum(outcomes) / len(outcomes) if outcomes else 0.0
+
+
+def _backend_names(services: Sequence[AIService]) -> List[str]:
+    """A distinct name per router entry, even for entries with the same backend."""
+    names: List[str] = []
+    for service in services:
+        name = f"{service.service_type}:{service.resolved_model}"
+        if service.base_url is not None:
+            name = f"{name}@{service.base_url}"
+        if name in names:
+            name = f"{name}#{sum(n.split('#')[0] == name for n in names) + 1}"
+        names.append(name)
+    return names
+
+
+class _Outcome:
+    """Lets exactly one of a caller that gave up and its worker record a call's outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claimed = False
+
+    def claim(self) -> bool:
+        with self._lock:
+            claimed, self._claimed = self._claimed, True
+            return not claimed
+
+
+class AIRouter:
+    """Route prompts across several AIService backends.
+
+    "fallback" mode tries backends in order, moving on after an error or `timeout`.
+    "hedge" mode starts the next backend whenever the ones in flight have not answered
+    within the current backend's observed p95 latency, and returns the first success.
+    With `adaptive`, backends are reordered by observed p95 once each has enough samples.
+    """
+
+    def __init__(
+        self,
+        services: Sequence[AIService],
+        mode: str = FALLBACK,
+        timeout: Optional[float] = None,
+        hedge_delay: float = DEFAULT_HEDGE_DELAY,
+        adaptive: bool = False,
+        window: int = DEFAULT_WINDOW,
+    ):
+        if not services:
+            raise ValueError("AIRouter needs at least one backend")
+        if mode not in (FALLBACK, HEDGE):
+            raise ValueError(f"Unsupported routing mode: {mode}")
+        self.services = list(services)
+        self.mode = mode
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.adaptive = adaptive
+        # Keyed per entry, so two entries with the same backend keep separate stats
+        self._names = dict(zip(map(id, self.services), _backend_names(self.services)))
+        self.trackers = {name: LatencyTracker(window) for name in self._names.values()}
+
+    def name(self, service: AIService) -> str:
+        return self._names[id(service)]
+
+    def tracker(self, service: AIService) -> LatencyTracker:
+        return self.trackers[self.name(service)]
+
+    def ordered_services(self) -> List[AIService]:
+        services = list(self.services)
+        if self.adaptive and all(
+            self.tracker(s).samples >= MIN_SAMPLES for s in self.services
+        ):
+
+            def score(service: AIService) -> float:
+                tracker = self.tracker(service)
+                # Treat failures as costing a full timeout/hedge interval on top of p95
+                penalty = self.timeout or self.hedge_delay
+                return tracker.percentile(95) + tracker.failure_rate() * penalty
+
+            services.sort(key=score)
+        # Backends with an open circuit go last: they would only fail fast, and in
+        # hedge mode they would otherwise delay the healthy ones by a hedge interval
+        return sorted(services, key=lambda s: s.breaker.state == OPEN)
+
+    def _hedge_delay_for(self, service: AIService) -> float:
+        tracker = self.tracker(service)
+        if tracker.samples < MIN_SAMPLES:
+            return self.hedge_delay
+        return tracker.percentile(95)
+
+    def _timed_query(
+        self, service: AIService, prompt: str, outcome: Optional[_Outcome] = None
+    ) -> str:
+        start = time.perf_counter()
+        try:
+            response = service.query(prompt)
+        except Exception:
+            if outcome is None or outcome.claim():
+                self.tracker(service).record_failure()
+            raise
+        if outcome is None or outcome.claim():
+            self.tracker(service).record(time.perf_counter() - start)
+        return response
+
+    async def _timed_aquery(self, service: AIService, prompt: str) -> str:
+        start = time.perf_counter()
+        try:
+            response = await service.aquery(prompt)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.tracker(service).record_failure()
+            raise
+        self.tracker(service).record(time.perf_counter() - start)
+        return response
+
+    def query(self, prompt: str) -> str:
+        if self.mode == HEDGE:
+            return self._query_hedged(prompt)
+        return self._query_fallback(prompt)
+
+    async def aquery(self, prompt: str) -> str:
+        if self.mode == HEDGE:
+            return await self._aquery_hedged(prompt)
+        return await self._aquery_fallback(prompt)
+
+    def _query_fallback(self, prompt: str) -> str:
+        errors: Dict[str, BaseException] = {}
+        for service in self.ordered_services():
+            name = self.name(service)
+            outcome = _Outcome()
+            try:
+                if self.timeout is None:
+                    return self._timed_query(service, prompt)
+                future = run_in_daemon_thread(
+                    lambda service=service, outcome=outcome: self._timed_query(
+                        service, prompt, outcome
+                    )
+                )
+                return future.result(timeout=self.timeout)
+            except concurrent.futures.TimeoutError:
+                # Counted as a failure here, unless the call finished just now and
+                # recorded itself; the abandoned call records nothing later
+                if outcome.claim():
+                    self.tracker(service).record_failure()
+                errors[name] = TimeoutError(f"no response after {self.timeout}s")
+            except Exception as e:
+                errors[name] = e
+            logger.warning("Backend %s failed (%s); falling back", name, errors[name])
+        raise RouterError(errors)
+
+    async def _aquery_fallback(self, prompt: str) -> str:
+        errors: Dict[str, BaseException] = {}
+        for service in self.ordered_services():
+            name = self.name(service)
+            try:
+                return await asyncio.wait_for(
+                    self._timed_aquery(service, prompt), self.timeout
+                )
+            except asyncio.TimeoutError:
+                self.tracker(service).record_failure()
+                errors[name] = TimeoutError(f"no response after {self.timeout}s")
+            except Exception as e:
+                errors[name] = e
+            logger.warning("Backend %s failed (%s); falling back", name, errors[name])
+        raise RouterError(errors)
+
+    def _query_hedged(self, prompt: str) -> str:
+        pending_services = self.ordered_services()
+        in_flight: Dict[concurrent.futures.Future, AIService] = {}
+        errors: Dict[str, BaseException] = {}
+        while pending_services or in_flight:
+            # Reached on the first pass, and whenever nothing in flight answered within
+            # the hedge delay or a backend failed: start the next backend
+            if pending_services:
+                service = pending_services.pop(0)
+                future = run_in_daemon_thread(
+                    lambda service=service: self._timed_query(service, prompt)
+                )
+                in_flight[future] = service
+            wait_for = (
+                self._hedge_delay_for(in_flight[next(reversed(in_flight))])
+                if pending_services
+                else None
+            )
+            done, _ = concurrent.futures.wait(
+                in_flight,
+                timeout=wait_for,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                service = in_flight.pop(future)
+                if future.exception() is None:
+                    return future.result()
+                errors[self.name(service)] = future.exception()
+        raise RouterError(errors)
+
+    async def _aquery_hedged(self, prompt: str) -> str:
+        pending_services = self.ordered_services()
+        in_flight: Dict[asyncio.Task, AIService] = {}
+        errors: Dict[str, BaseException] = {}
+        try:
+            while pending_services or in_flight:
+                if pending_services:
+                    service = pending_services.pop(0)
+                    task = asyncio.ensure_future(self._timed_aquery(service, prompt))
+                    in_flight[task] = service
+                wait_for = (
+                    self._hedge_delay_for(in_flight[next(reversed(in_flight))])
+                    if pending_services
+                    else None
+                )
+                done, _ = await asyncio.wait(
+                    in_flight, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    service = in_flight.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors[self.name(service)] = task.exception()
+            raise RouterError(errors)
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Dict[str, Optional[float]]]:
+        return {
+            name: {
+                "p50": tracker.percentile(50),
+                "p95": tracker.percentile(95),
+                "successes": tracker.successes,
+                "failures": tracker.failures,
+            }
+            for name, tracker in self.trackers.items()
+        }
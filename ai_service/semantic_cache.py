@@ -0,0 +1,332 @@
+import logging
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from ai_service.cache import DEFAULT_MAX_ENTRIES, DEFAULT_TTL, default_cache_dir
+from ai_service.clients import get_client
+from ai_service.keep_alive import get_keep_alive
+
+logger = logging.getLogger("ai_service")
+
+DEFAULT_EMBED_MODEL = os.environ.get("AI_SERVICE_EMBED_MODEL", "nomic-embed-text")
+# Cosine similarity above which a cached answer is reused. Paraphrases of a short
+# task usually score 0.9+, while tasks differing in one verb ("list" / "delete
+# big files") can still reach the high 0.8s, so err on the side of a miss.
+DEFAULT_THRESHOLD = 0.92
+# Embeddings kept in memory per cache, so a miss followed by `set` embeds once
+EMBEDDING_MEMO_SIZE = 256
+
+Vector = List[float]
+
+_numpy = None
+_numpy_lock = threading.Lock()
+
+
+def _get_numpy():
+    """numpy if installed, else None; lookups fall back to pure Python dot products."""
+    global _numpy
+    with _numpy_lock:
+        if _numpy is None:
+            try:
+                import numpy
+
+                _numpy = numpy
+            except ImportError:
+                _numpy = False
+        return _numpy or None
+
+
+class OllamaEmbedder:
+    """Embed text with a local Ollama embedding model, through the pooled client."""
+
+    def __init__(self, model: str = DEFAULT_EMBED_MODEL, base_url: Optional[str] = None):
+        self.model = model
+        self.base_url = base_url
+
+    @property
+    def name(self) -> str:
+        return f"ollama:{self.model}"
+
+    def __call__(self, text: str) -> Vector:
+        response = get_client("ollama", base_url=self.base_url).embeddings(
+            model=self.model, prompt=text, keep_alive=get_keep_alive(self.model)
+        )
+        return list(response["embedding"])
+
+
+def _normalize(vector: Sequence[float]) -> Vector:
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else list(vector)
+
+
+def _pack(vector: Sequence[float]) -> bytes:
+    # Unit vectors in half precision: 2 bytes per dimension, and cosine similarities
+    # stay within ~1e-3 of the float32 ones
+    return struct.pack(f"<{len(vector)}e", *vector)
+
+
+def _unpack(blob: bytes) -> Vector:
+    return list(struct.unpack(f"<{len(blob) // 2}e", blob))
+
+
+@dataclass
+class SemanticHit:
+    response: str
+    # The cached text that matched, and its cosine similarity to the query
+    text: str
+    similarity: float
+
+
+class _Index:
+    """Vectors of one namespace, held in memory for brute-force nearest-neighbour search."""
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.vectors: List[Vector] = []
+        self._matrix = None
+
+    def add(self, entry_id: int, vector: Vector):
+        self.ids.append(entry_id)
+        self.vectors.append(vector)
+        self._matrix = None
+
+    def remove(self, entry_ids):
+        keep = [(i, v) for i, v in zip(self.ids, self.vectors) if i not in entry_ids]
+        self.ids = [i for i, _ in keep]
+        self.vectors = [v for _, v in keep]
+        self._matrix = None
+
+    def nearest(self, vector: Vector) -> Optional[Tuple[int, float]]:
+        if not self.ids:
+            return None
+        numpy = _get_numpy()
+        if numpy is not None:
+            if self._matrix is None:
+                self._matrix = numpy.array(self.vectors, dtype=numpy.float32)
+            scores = self._matrix @ numpy.array(vector, dtype=numpy.float32)
+            best = int(scores.argmax())
+            return self.ids[best], float(scores[best])
+        best_id, best_score = None, -1.0
+        for entry_id, candidate in zip(self.ids, self.vectors):
+            score = sum(a * b for a, b in zip(candidate, vector))
+            if score > best_score:
+                best_id, best_score = entry_id, score
+        return best_id, best_score
+
+
+class SemanticCache:
+    """Reuse responses for prompts that mean the same thing as an earlier one.
+
+    Prompts are embedded (by default with Ollama's nomic-embed-text) and compared by
+    cosine similarity with earlier prompts of the same namespace; AIService uses one
+    namespace per service, model, system prompt and options. Vectors are stored as
+    half-precision blobs in SQLite next to the responses, and searched in memory.
+    Embedding errors are logged and treated as misses, so a missing embedding model
+    never fails a query.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        embedder: Optional[Callable[[str], Vector]] = None,
+        threshold: float = DEFAULT_THRESHOLD,
+        ttl: Optional[float] = DEFAULT_TTL,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.path = path or os.path.join(default_cache_dir(), "semantic.sqlite3")
+        self.embedder = embedder or OllamaEmbedder()
+        # Vectors from different embedding models are not comparable
+        self.embedder_name = getattr(self.embedder, "name", type(self.embedder).__name__)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, _Index] = {}
+        self._embed_failed = False
+        self._memo: "OrderedDict[str, Vector]" = OrderedDict()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                text TEXT NOT NULL,
+                response TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_namespace ON entries (namespace)"
+        )
+        if not self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'entries_text'"
+        ).fetchone():
+            # Caches written before entries were unique per text keep the latest one
+            self._conn.execute(
+                "DELETE FROM entries WHERE id NOT IN "
+                "(SELECT MAX(id) FROM entries GROUP BY namespace, text)"
+            )
+            self._conn.execute(
+                "CREATE UNIQUE INDEX entries_text ON entries (namespace, text)"
+            )
+        self._conn.commit()
+        # Changes when another connection commits, e.g. the ai_cli daemon
+        self._data_version = None
+
+    def _namespace(self, namespace: str) -> str:
+        return f"{self.embedder_name}/{namespace}"
+
+    def embed(self, text: str) -> Optional[Vector]:
+        with self._lock:
+            if text in self._memo:
+                self._memo.move_to_end(text)
+                return self._memo[text]
+        try:
+            vector = _normalize(self.embedder(text))
+        except Exception as e:
+            # Warn once; an unreachable embedding model fails every call the same way
+            log = logger.debug if self._embed_failed else logger.warning
+            log("Semantic cache skipped: embedding failed (%s)", e)
+            self._embed_failed = True
+            return None
+        with self._lock:
+            self._memo[text] = vector
+            if len(self._memo) > EMBEDDING_MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return vector
+
+    def _index(self, namespace: str) -> _Index:
+        # Caller holds the lock
+        (data_version,) = self._conn.execute("PRAGMA data_version").fetchone()
+        if data_version != self._data_version:
+            # Another process wrote to the cache; reload the vectors when next used
+            self._indexes.clear()
+            self._data_version = data_version
+        index = self._indexes.get(namespace)
+        if index is None:
+            index = self._indexes[namespace] = _Index()
+            for entry_id, blob in self._conn.execute(
+                "SELECT id, vector FROM entries WHERE namespace = ? ORDER BY id",
+                (namespace,),
+            ):
+                index.add(entry_id, _unpack(blob))
+        return index
+
+    def get(self, namespace: str, text: str) -> Optional[SemanticHit]:
+        """The cached response for the most similar earlier text, if similar enough."""
+        vector = self.embed(text)
+        if vector is None:
+            return None
+        namespace = self._namespace(namespace)
+        now = time.time()
+        with self._lock:
+            nearest = self._index(namespace).nearest(vector)
+            row = None
+            if nearest is not None and nearest[1] >= self.threshold:
+                row = self._conn.execute(
+                    "SELECT text, response, created FROM entries WHERE id = ?",
+                    (nearest[0],),
+                ).fetchone()
+            if row is not None and self.ttl is not None and now - row[2] > self.ttl:
+                self._delete([nearest[0]])
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed = ? WHERE id = ?", (now, nearest[0])
+            )
+            self._conn.commit()
+            self.hits += 1
+        # Half-precision rounding can push an exact match slightly above 1
+        return SemanticHit(row[1], row[0], min(1.0, nearest[1]))
+
+    def set(self, namespace: str, text: str, response: str):
+        vector = self.embed(text)
+        if vector is None:
+            return
+        namespace = self._namespace(namespace)
+        now = time.time()
+        with self._lock:
+            index = self._index(namespace)
+            self._conn.execute(
+                "INSERT INTO entries (namespace, text, response, vector, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (namespace, text) DO UPDATE SET "
+                "response = excluded.response, vector = excluded.vector, "
+                "created = excluded.created, accessed = excluded.accessed",
+                (namespace, text, response, _pack(vector), now, now),
+            )
+            (entry_id,) = self._conn.execute(
+                "SELECT id FROM entries WHERE namespace = ? AND text = ?",
+                (namespace, text),
+            ).fetchone()
+            index.remove({entry_id})
+            index.add(entry_id, _unpack(_pack(vector)))
+            self._evict(now)
+            self._conn.commit()
+
+    def _delete(self, entry_ids: List[int]):
+        self._conn.executemany(
+            "DELETE FROM entries WHERE id = ?", [(entry_id,) for entry_id in entry_ids]
+        )
+        removed = set(entry_ids)
+        for index in self._indexes.values():
+            index.remove(removed)
+
+    def _evict(self, now: float):
+        stale = []
+        if self.ttl is not None:
+            stale += [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT id FROM entries WHERE created < ?", (now - self.ttl,)
+                )
+            ]
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        excess = count - len(stale) - self.max_entries
+        if excess > 0:
+            stale += [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT id FROM entries WHERE created >= ? ORDER BY accessed ASC LIMIT ?",
+                    (now - self.ttl if self.ttl is not None else 0, excess),
+                )
+            ]
+        if stale:
+            self._delete(stale)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._indexes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM entries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "vector_bytes": total,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,244 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+class StructuredOutputError(Exception):
+    """The backend's answer was not JSON matching the schema; `text` holds the raw answer."""
+
+    def __init__(self, message: str, text: str, errors: Optional[List[str]] = None):
+        super().__init__(message)
+        self.text = text
+        self.errors = errors or []
+
+
+def as_json_schema(schema) -> Dict[str, Any]:
+    """Accept a JSON Schema dict or a pydantic model class."""
+    if hasattr(schema, "model_json_schema"):
+        return schema.model_json_schema()
+    return schema
+
+
+def schema_instructions(schema: Dict[str, Any]) -> str:
+    """Prompt suffix for backends whose JSON mode does not take the schema itself."""
+    return (
+        "\n\nRespond with only a JSON object that matches this JSON Schema, "
+        f"with no other text:\n{json.dumps(schema)}"
+    )
+
+
+def _matches_type(value: Any, expected: str) -> bool:
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    python_type = _TYPES.get(expected)
+    return python_type is None or isinstance(value, python_type)
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """Check `value` against the commonly used subset of JSON Schema; returns the errors.
+
+    Supports type, enum, const, properties, required, additionalProperties, items,
+    minItems/maxItems, minLength/maxLength and minimum/maximum.
+    """
+    errors: List[str] = []
+    expected = schema.get("type")
+    if expected is not None:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_matches_type(value, t) for t in types):
+            return [f"{path}: expected {' or '.join(types)}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']!r}")
+    if "const" in schema and value != schema["const"]:
+        errors.append(f"{path}: expected {schema['const']!r}")
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for name in schema.get("required", []):
+            if name not in value:
+                errors.append(f"{path}: missing required property {name!r}")
+        for name, item in value.items():
+            if name in properties:
+                errors += validate(item, properties[name], f"{path}.{name}")
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected property {name!r}")
+    if isinstance(value, list):
+        if "minItems" in schema and len(value) < schema["minItems"]:
+            errors.append(f"{path}: expected at least {schema['minItems']} items")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: expected at most {schema['maxItems']} items")
+        if isinstance(schema.get("items"), dict):
+            for i, item in enumerate(value):
+                errors += validate(item, schema["items"], f"{path}[{i}]")
+    if isinstance(value, str):
+        if "minLength" in schema and len(value) < schema["minLength"]:
+            errors.append(f"{path}: shorter than {schema['minLength']} characters")
+        if "maxLength" in schema and len(value) > schema["maxLength"]:
+            errors.append(f"{path}: longer than {schema['maxLength']} characters")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: less than {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: greater than {schema['maximum']}")
+    return errors
+
+
+def extract_json(text: str) -> Any:
+    """Parse a JSON answer, tolerating code fences and prose around the object."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    if fenced:
+        try:
+            return json.loads(fenced.group(1))
+        except json.JSONDecodeError:
+            pass
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("no JSON object in the response")
+    value, _ = json.JSONDecoder().raw_decode(text[start:])
+    return value
+
+
+def parse_structured(text: str, schema) -> Any:
+    """Parse and validate locally, returning a pydantic instance when given a model."""
+    json_schema = as_json_schema(schema)
+    try:
+        value = extract_json(text)
+    except ValueError as e:
+        raise StructuredOutputError(f"Response is not valid JSON: {e}", text) from None
+    errors = validate(value, json_schema)
+    if errors:
+        raise StructuredOutputError(
+            f"Response does not match the schema: {'; '.join(errors)}", text, errors
+        )
+    if hasattr(schema, "model_validate"):
+        return schema.model_validate(value)
+    return value
+
+
+class IncrementalJSONParser:
+    """Parse a JSON object as it streams in, exposing the part received so far.
+
+    `feed` returns the best current value: complete keys and array items, plus the
+    string being received, so early fields are usable before the response ends.
+    Values are only ever extended, never revised, except for that trailing string.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.value: Any = None
+        self.done = False
+        self._pos = 0
+        self._started = False
+        # One entry per open container: [kind, expecting], kind "{" or "["
+        self._stack: List[List[str]] = []
+        self._in_string = False
+        self._string_is_key = False
+        self._escape = False
+        self._literal_start: Optional[int] = None
+        # Longest prefix that becomes valid JSON once the open containers are closed
+        self._safe: Tuple[int, str] = (0, "")
+
+    def _closers(self) -> str:
+        return "".join("}" if kind == "{" else "]" for kind, _ in reversed(self._stack))
+
+    def _mark_safe(self, end: int):
+        self._safe = (end, self._closers())
+
+    def _value_done(self, end: int):
+        if not self._stack:
+            self.done = True
+            self._safe = (end, "")
+            return
+        self._stack[-1][1] = "comma"
+        self._mark_safe(end)
+
+    def _scan(self):
+        text = self.buffer
+        i = self._pos
+        while i < len(text) and not self.done:
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._string_is_key:
+                        self._stack[-1][1] = "colon"
+                    else:
+                        self._value_done(i + 1)
+                i += 1
+                continue
+            if self._literal_start is not None:
+                if c in ",}] \t\r\n":
+                    self._literal_start = None
+                    self._value_done(i)
+                    continue
+                i += 1
+                continue
+            if not self._started:
+                if c in "{[":
+                    self._started = True
+                    # Drop anything before the value, e.g. a ```json fence
+                    self.buffer = text = text[i:]
+                    i = 0
+                else:
+                    i += 1
+                    continue
+            expecting = self._stack[-1][1] if self._stack else "value"
+            if c in " \t\r\n":
+                pass
+            elif c in "{[" and expecting == "value":
+                self._stack.append([c, "key" if c == "{" else "value"])
+                self._mark_safe(i + 1)
+            elif c in "}]":
+                self._stack.pop()
+                self._value_done(i + 1)
+            elif c == ",":
+                self._stack[-1][1] = "key" if self._stack[-1][0] == "{" else "value"
+            elif c == ":":
+                self._stack[-1][1] = "value"
+            elif c == '"':
+                self._in_string = True
+                self._string_is_key = expecting == "key"
+            else:
+                self._literal_start = i
+            i += 1
+        self._pos = i
+
+    def _candidate(self) -> str:
+        if self._in_string and not self._string_is_key:
+            text = self.buffer
+            if self._escape:
+                text = text[:-1]
+            # A \\u escape cut short cannot be decoded yet
+            text = re.sub(r"\\u[0-9a-fA-F]{0,3}$", "", text)
+            return text + '"' + self._closers()
+        end, closers = self._safe
+        return self.buffer[:end] + closers
+
+    def feed(self, chunk: str) -> Any:
+        if self.done:
+            return self.value
+        self.buffer += chunk
+        self._scan()
+        if not self._started:
+            return None
+        try:
+            self.value = json.loads(self._candidate())
+        except json.JSONDecodeError:
+            pass
+        return self.value
@@ -10,20 +10,26 @@ import urllib.parse
 import urllib.request
 import xml.etree.ElementTree as ET
 
-import anthropic
 from bs4 import BeautifulSoup
 from exa_py import Exa
-from groq import Groq
-import ollama
 import PyPDF2
 import requests
 
+from ai_service.ai_service import AIService
+from ai_service.budget import Section, count_tokens, fit_sections, truncate_to_tokens
+
 # Default values and constants
 DEFAULT_VAULT_PATH = "path/to/vault"
 DEFAULT_FIRECRAWL_BASE_URL = "http://localhost:3002"
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1")
 GROQ_MODEL = "llama-3.1-70b-versatile"
 ANTHROPIC_MODEL = "claude-3-5-sonnet-20240620"
+MODELS = {
+    "ollama": OLLAMA_MODEL,
+    "groq": GROQ_MODEL,
+    "anthropic": ANTHROPIC_MODEL,
+}
+SYSTEM_PROMPT = "You are a research assistant specialized in synthesizing information and providing comprehensive insights."
 
 # Exa search configuration
 EXCLUDED_DOMAINS = [
@@ -37,76 +43,6 @@ EXCLUDED_DOMAINS = [
 START_PUBLISHED_DATE = "2021-01-01"
 
 
-class AIService:
-    def __init__(self, service_type: str, model: str = None):
-        self.service_type = service_type
-        self.model = model
-
-    def query(self, prompt: str, model: str = None) -> str:
-        if self.service_type == "ollama":
-            return self.query_ollama(prompt)
-        elif self.service_type == "groq":
-            return self.query_groq(prompt)
-        elif self.service_type == "anthropic":
-            return self.query_anthropic(prompt)
-        else:
-            raise ValueError(f"Unsupported AI service: {self.service_type}")
-
-    def query_ollama(self, prompt: str) -> str:
-        try:
-            print("Generating research insights...", end="", flush=True)
-            response = ollama.generate(
-                model=self.model or OLLAMA_MODEL,
-                prompt=prompt,
-                system="You are a research assistant specialized in synthesizing information and providing comprehensive insights.",
-                options={
-                    "num_predict": 1000,
-                },
-                keep_alive="2m",
-            )
-            print("Done!")
-            return response["response"]
-        except Exception as e:
-            print(f"\nError querying Ollama: {e}")
-            sys.exit(1)
-
-    def query_groq(self, prompt: str) -> str:
-        try:
-            client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
-            chat_completion = client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant specializing in research and information synthesis.",
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt,
-                    },
-                ],
-                model=self.model or GROQ_MODEL,
-            )
-            return chat_completion.choices[0].message.content
-        except Exception as e:
-            print(f"\nError querying Groq: {e}")
-            sys.exit(1)
-
-    def query_anthropic(self, prompt: str) -> str:
-        try:
-            client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
-            message = client.messages.create(
-                model=self.model or ANTHROPIC_MODEL,
-                max_tokens=1000,
-                messages=[
-                    {"role": "user", "content": prompt},
-                ],
-            )
-            return message.content[0].text
-        except Exception as e:
-            print(f"Error querying Anthropic: {e}")
-            sys.exit(1)
-
-
 class ResearchAssistant:
     def __init__(
         self,
@@ -115,7 +51,12 @@ class ResearchAssistant:
         vault_path: str = DEFAULT_VAULT_PATH,
         firecrawl_base_url: str = DEFAULT_FIRECRAWL_BASE_URL,
     ):
-        self.ai_service = AIService(service_type, model)
+        self.ai_service = AIService(
+            service_type,
+            model or MODELS.get(service_type),
+            options={"max_tokens": 1000},
+            system=SYSTEM_PROMPT,
+        )
         self.model = model
         self.exa_client = Exa(api_key=os.environ["EXA_API_KEY"])
         self.firecrawl_base_url = firecrawl_base_url
@@ -304,10 +245,31 @@ class ResearchAssistant:
                 f.write(f"- Content:\n\n{result.get('content', 'N/A')}\n")
             print(f"Created firecrawl_result_{i}.md")
 
-    def summarize_single_source(
+    def summarize_sources(
+        self, query: str, sources: List[Dict], source_type: str
+    ) -> List[str]:
+        """Summarize every source concurrently, in source order."""
+        budget = self.ai_service.prompt_budget()
+        prompts = []
+        for source in sources:
+            overhead = count_tokens(
+                self.summary_prompt(query, "", source_type, source["url"])
+            )
+            content = truncate_to_tokens(source["content"], budget - overhead)
+            if len(content) < len(source["content"]):
+                print(
+                    f"Truncated {source['url']} to {count_tokens(content)} of "
+                    f"{count_tokens(source['content'])} tokens to fit the model's context."
+                )
+            prompts.append(
+                self.summary_prompt(query, content, source_type, source["url"])
+            )
+        return self.ai_service.query_batch(prompts)
+
+    def summary_prompt(
         self, query: str, source_content: str, source_type: str, source_url: str
     ) -> str:
-        prompt = f"""
+        return f"""
         Original Query: {query}
 
         Summarize the following {source_type} content in the context of the original query.
@@ -321,29 +283,9 @@ class ResearchAssistant:
         Your summary should be concise and highly factual, highlighting the most important information from this source that relates to the original query.
         Do not mention Firecrawl or any other tool used in the data collection process.
         """
-        return self.ai_service.query(prompt, self.model)
-
-    def create_comprehensive_learning_material(
-        self,
-        query: str,
-        individual_summaries: List[str],
-        exa_results: List[Dict],
-        arxiv_results: List[Dict],
-        technical: bool,
-    ) -> str:
 
-        # Combine full texts from arXiv results
-        arxiv_full_texts = (
-            "\n\n".join(
-                [result["full_text"] for result in arxiv_results if result["full_text"]]
-            )
-            if technical
-            else ""
-        )
-
-        combined_content = "\n\n".join(individual_summaries) + "\n\n" + arxiv_full_texts
-
-        prompt = f"""
+    def learning_material_prompt(self, query: str, combined_content: str) -> str:
+        return f"""
         Original Query: {query}
         Based on the following summaries of various sources, create comprehensive learning material on the topic. Your goal is to help someone learn this topic 90% faster than traditional research methods. Be thorough, accurate, and helpful. Do not hallucinate.
 
@@ -368,7 +310,38 @@ class ResearchAssistant:
         Use clear headings and subheadings to organize the information.
         """
 
-        ai_generated_content = self.ai_service.query(prompt, self.model)
+    def create_comprehensive_learning_material(
+        self,
+        query: str,
+        individual_summaries: List[str],
+        exa_results: List[Dict],
+        arxiv_results: List[Dict],
+        technical: bool,
+    ) -> str:
+
+        # Combine full texts from arXiv results
+        arxiv_full_texts = (
+            "\n\n".join(
+                [result["full_text"] for result in arxiv_results if result["full_text"]]
+            )
+            if technical
+            else ""
+        )
+
+        # Summaries take precedence; the arXiv papers get whatever context is left
+        overhead = count_tokens(self.learning_material_prompt(query, ""))
+        fit = fit_sections(
+            [
+                Section("summaries", "\n\n".join(individual_summaries), priority=1),
+                Section("arxiv_full_texts", arxiv_full_texts),
+            ],
+            self.ai_service.prompt_budget() - overhead,
+        )
+        for line in fit.report():
+            print(f"Truncated to fit the model's context: {line}")
+
+        prompt = self.learning_material_prompt(query, fit.join())
+        ai_generated_content = self.ai_service.query(prompt)
 
         # Prepare source summaries for appending
         exa_summaries = "\n\n".join(
@@ -451,12 +424,9 @@ Thank you to arXiv for use of its open access interoperability.
         )
 
         print("Generating individual summaries...")
-        individual_summaries = []
-        for result in firecrawl_results:
-            summary = self.summarize_single_source(
-                query, result["content"], "Firecrawl", result["url"]
-            )
-            individual_summaries.append(summary)
+        individual_summaries = self.summarize_sources(
+            query, firecrawl_results, "Firecrawl"
+        )
 
         print("Generating comprehensive learning material...")
         learning_material = self.create_comprehensive_learning_material(
@@ -1,7 +1,7 @@
 import argparse
+import asyncio
 import subprocess
 import os
-import ollama
 import time
 import pyaudio
 import wave
@@ -17,6 +17,8 @@ from rich import box
 import select
 import sys
 
+from ai_service.ai_service import AIService
+
 console = Console()
 
 OLLAMA_MODEL = "llama3.1"
@@ -41,34 +43,27 @@ ASCII_ART = """
 """
 
 
-class AIService:
-    def __init__(self):
-        pass
-
-    def query(self, prompt: str, max_retries: int = 3) -> str:
-        prompt = f"You are an intelligent text analyzer with specific jobs. You can process any text for the good of the user. Here is your task: {prompt}"
-        retries = 0
-        while retries < max_retries:
-            try:
-                return self.query_ollama(prompt)
-            except Exception as e:
-                retries += 1
-                if retries == max_retries:
-                    console.print(
-                        f"[red]Error: Unable to complete the request after {max_retries} attempts.[/red]"
-                    )
-                    console.print(f"[yellow]Error details: {str(e)}[/yellow]")
-                    return "ERROR: Unable to process request"
-                else:
-                    wait_time = 2**retries
-                    console.print(
-                        f"[yellow]Error occurred. Retrying in {wait_time} seconds...[/yellow]"
-                    )
-                    time.sleep(wait_time)
-
-    def query_ollama(self, prompt: str) -> str:
-        response = ollama.generate(model=OLLAMA_MODEL, prompt=prompt)
-        return response["response"]
+SYSTEM_PROMPT = "You are an intelligent text analyzer with specific jobs. You can process any text for the good of the user."
+
+# name -> (prompt template, result used when the backend fails)
+ANALYSES = {
+    "summary": (
+        "Summarize the following text. Just provide the summary, no preamble. Text:\n\n{text}",
+        "Unable to generate summary.",
+    ),
+    "sentiment": (
+        "Analyze the sentiment of the following text and respond with ONLY ONE WORD - either 'positive', 'neutral', or 'negative':\n\n{text}",
+        "neutral",
+    ),
+    "intent": (
+        "Detect the intent in the following text. Respond with ONLY 2-4 words. Do not return any preamble, only the intent. Text: \n\n{text}",
+        "Unable to detect intent.",
+    ),
+    "topics": (
+        "Please identify the main topics in the following text. Return the topics as a comma-separated list, with no preamble or additional text. Text:\n\n{text}",
+        "No specific topics detected.",
+    ),
+}
 
 
 def install_whisper_model(model_name, whisperfile_path):
@@ -160,29 +155,30 @@ def transcribe_audio(model_name, whisperfile_path, audio_file, verbose):
     return stdout
 
 
-def summarize(text):
-    ai_service = AIService()
-    prompt = f"Summarize the following text. Just provide the summary, no preamble. Text:\n\n{text}"
-    return ai_service.query(prompt)
-
-
-def analyze_sentiment(text):
-    ai_service = AIService()
-    prompt = f"Analyze the sentiment of the following text and respond with ONLY ONE WORD - either 'positive', 'neutral', or 'negative':\n\n{text}"
-    sentiment = ai_service.query(prompt).strip().lower()
-    return sentiment if sentiment in ["positive", "neutral", "negative"] else "neutral"
-
-
-def detect_intent(text):
-    ai_service = AIService()
-    prompt = f"Detect the intent in the following text. Respond with ONLY 2-4 words. Do not return any preamble, only the intent. Text: \n\n{text}"
-    return ai_service.query(prompt)
+def analyze(text, names):
+    """Run the requested analyses concurrently; failed analyses get their default."""
+    ai_service = AIService("ollama", OLLAMA_MODEL, system=SYSTEM_PROMPT)
+    prompts = [ANALYSES[name][0].format(text=text) for name in names]
 
+    async def run_all():
+        # Each analysis succeeds or fails on its own
+        return await asyncio.gather(
+            *(ai_service.aquery(prompt) for prompt in prompts), return_exceptions=True
+        )
 
-def detect_topics(text):
-    ai_service = AIService()
-    prompt = f"Please identify the main topics in the following text. Return the topics as a comma-separated list, with no preamble or additional text. Text:\n\n{text}"
-    return ai_service.query(prompt)
+    results = {}
+    for name, response in zip(names, asyncio.run(run_all())):
+        if isinstance(response, Exception):
+            console.print(f"[red]Error: Unable to complete the {name} analysis.[/red]")
+            console.print(f"[yellow]Error details: {str(response)}[/yellow]")
+            response = ""
+        results[name] = response.strip() or ANALYSES[name][1]
+    if "sentiment" in results:
+        sentiment = results["sentiment"].lower()
+        results["sentiment"] = (
+            sentiment if sentiment in ["positive", "neutral", "negative"] else "neutral"
+        )
+    return results
 
 
 def export_to_markdown(content, vault_path, filename):
@@ -360,32 +356,46 @@ def main():
         return
 
     if args.full:
-        summary = summarize(transcript) or "Unable to generate summary."
-        sentiment = analyze_sentiment(transcript) or "neutral"
-        intent = detect_intent(transcript) or "Unable to detect intent."
-        topics = detect_topics(transcript) or "No specific topics detected."
-
-        display_rich_output(transcript, summary, sentiment, intent, topics)
+        analysis = analyze(transcript, list(ANALYSES))
+
+        display_rich_output(
+            transcript,
+            analysis["summary"],
+            analysis["sentiment"],
+            analysis["intent"],
+            analysis["topics"],
+        )
     else:
         results = [f"# ShallowGram Analysis\n\n## Transcript\n\n{transcript}\n"]
+        requested = [
+            name
+            for name, enabled in [
+                ("summary", args.summarize),
+                ("sentiment", args.sentiment),
+                ("intent", args.intent),
+                ("topics", args.topics),
+            ]
+            if enabled
+        ]
+        analysis = analyze(transcript, requested) if requested else {}
 
         if args.summarize:
-            summary = summarize(transcript)
+            summary = analysis["summary"]
             results.append(f"## Summary\n\n{summary}\n")
             console.print("[bold]Summary:[/bold]", summary)
 
         if args.sentiment:
-            sentiment = analyze_sentiment(transcript)
+            sentiment = analysis["sentiment"]
             results.append(f"## Sentiment Analysis\n\n{sentiment}\n")
             console.print("[bold]Sentiment Analysis:[/bold]", sentiment)
 
         if args.intent:
-            intent = detect_intent(transcript)
+            intent = analysis["intent"]
             results.append(f"## Intent Detection\n\n{intent}\n")
             console.print("[bold]Intent Detection:[/bold]", intent)
 
         if args.topics:
-            topics = detect_topics(transcript)
+            topics = analysis["topics"]
             results.append(f"## Topic Detection\n\n{topics}\n")
             console.print("[bold]Topic Detection:[/bold]", topics)
 